@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Incremental regulatory aggregates for calair hourly data.
+
+Per station and magnitud, and per day:
+  - horas_validas / media / max_horaria for every magnitud,
+  - max_media_8h: max of the rolling 8-hour means ending that day (O3, CO;
+    a mean needs at least 6 of the 8 hours),
+  - superaciones_horarias: hours above the hourly limit (NO2 > 200 µg/m³),
+  - supera_media_diaria: daily mean above the limit (PM10 > 50 µg/m³, with
+    at least 18 valid hours).
+
+State lives in ``data/calair/aggregates_state.json``: per key a watermark
+(last hour folded in), an 8-slot ring buffer and the accumulators of the
+days still open. Each run folds only hours after the watermark, up to the
+newest validated ('V') hour, so the cost is O(new hours). A revalidated
+hour that is already behind the watermark is not revisited; reprocessing
+past days (``fetch_calair.py --backfill``) therefore runs ``rebuild``.
+
+Closed days are appended to ``data/calair/aggregates.csv``; open days are
+written after the committed part and replaced on the next run (the state
+keeps the committed byte count, as the history store does). If the state is
+lost while ``aggregates.csv`` exists, runs leave both untouched until
+``rebuild`` recomputes them: a fresh state would truncate the published
+days and fold the current hours again.
+
+Usage (rebuild everything from the columnar history):
+    python scripts/calair_aggregates.py rebuild
+"""
+from __future__ import annotations
+import argparse
+import csv
+import io
+import json
+import math
+import os
+from array import array
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from calair_history import HISTORY_DIR, list_partitions, read_partition
+
+CALAIR_DIR = Path("data/calair")
+STATE = CALAIR_DIR / "aggregates_state.json"
+OUTPUT = CALAIR_DIR / "aggregates.csv"
+
+RING = 8
+MIN_8H = 6                                  # 75 % de 8 horas
+MEAN_8H = {6: "CO", 14: "O3"}               # MAGNITUD -> medias móviles 8 h
+HOURLY_LIMITS = {8: 200.0}                  # NO2 µg/m³ (valor horario)
+DAILY_MEAN_LIMITS = {10: 50.0}              # PM10 µg/m³ (media diaria)
+MIN_DAILY_HOURS = 18                        # 75 % de 24 horas
+FIELDNAMES = [
+    "estacion", "magnitud", "fecha", "horas_validas", "media", "max_horaria",
+    "max_media_8h", "superaciones_horarias", "supera_media_diaria",
+]
+_VALID = ord("V")
+
+ClosedDay = Tuple[str, str, Dict[str, Any]]  # ('estacion|magnitud', 'YYYY-MM-DD', acumuladores)
+
+
+def hour_index(ymd: int, hour: int) -> int:
+    """Índice horario absoluto (Hora 1..24 del día ymd)."""
+    return date(ymd // 10000, ymd // 100 % 100, ymd % 100).toordinal() * 24 + hour - 1
+
+
+def _day_of(idx: int) -> str:
+    return date.fromordinal(idx // 24).isoformat()
+
+
+def load_state(path: Path = STATE) -> Dict[str, Any]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {"version": 1, "csv_bytes": 0, "keys": {}}
+
+
+def _save_state(path: Path, state: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, separators=(",", ":"), sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _new_day() -> Dict[str, Any]:
+    return {"n": 0, "sum": 0.0, "max": None, "max8h": None, "exc": 0}
+
+
+def _day_row(key: str, day: str, acc: Dict[str, Any]) -> Dict[str, Any]:
+    station, mag = key.split("|")
+    mg = int(mag)
+    mean = acc["sum"] / acc["n"] if acc["n"] else None
+    r2 = lambda x: None if x is None else round(x, 2)
+    limit = DAILY_MEAN_LIMITS.get(mg)
+    return {
+        "estacion": station,
+        "magnitud": mg,
+        "fecha": day,
+        "horas_validas": acc["n"],
+        "media": r2(mean),
+        "max_horaria": r2(acc["max"]),
+        "max_media_8h": r2(acc["max8h"]) if mg in MEAN_8H else None,
+        "superaciones_horarias": acc["exc"] if mg in HOURLY_LIMITS else None,
+        "supera_media_diaria": (
+            int(mean > limit) if limit is not None and mean is not None and acc["n"] >= MIN_DAILY_HOURS else None
+        ),
+    }
+
+
+def _fold_key(ks: Dict[str, Any], key: str, hours: Dict[int, float | None], closed: List[ClosedDay]) -> int:
+    """Incorpora las horas nuevas de una clave; devuelve cuántas horas se recorrieron."""
+    newest = max((i for i, v in hours.items() if v is not None), default=None)
+    last = ks["last"]
+    start = min(hours) if last is None else last + 1
+    if newest is None or newest < start:
+        return 0
+    first_data = min(i for i in hours if i >= start)
+    if first_data - start >= RING:
+        # Hueco largo sin datos: el anillo ya no aporta nada y los días
+        # abiertos anteriores al hueco ya no recibirán más horas
+        first_day = _day_of(first_data)
+        for day in sorted(d for d in ks["days"] if d < first_day):
+            closed.append((key, day, ks["days"].pop(day)))
+        ks["ring"] = [None] * RING
+        start = first_data
+    mg = int(key.split("|")[1])
+    limit = HOURLY_LIMITS.get(mg)
+    ring, days = ks["ring"], ks["days"]
+    for idx in range(start, newest + 1):
+        v = hours.get(idx)
+        ring[idx % RING] = v
+        day = _day_of(idx)
+        acc = days.get(day)
+        if acc is None:
+            acc = days[day] = _new_day()
+        if v is not None:
+            acc["n"] += 1
+            acc["sum"] += v
+            acc["max"] = v if acc["max"] is None else max(acc["max"], v)
+            if limit is not None and v > limit:
+                acc["exc"] += 1
+        if mg in MEAN_8H:
+            window = [x for x in ring if x is not None]
+            if len(window) >= MIN_8H:
+                m = sum(window) / len(window)
+                acc["max8h"] = m if acc["max8h"] is None else max(acc["max8h"], m)
+        if idx % 24 == 23:  # Hora 24: el día queda cerrado
+            closed.append((key, day, days.pop(day)))
+    ks["last"] = newest
+    return newest - start + 1
+
+
+def _group_hours(cols: Dict[str, array]) -> Dict[str, Dict[int, float | None]]:
+    """clave 'estacion|magnitud' -> {índice horario: valor validado o None}."""
+    out: Dict[str, Dict[int, float | None]] = {}
+    for st, mg, d, h, v, f in zip(cols["station"], cols["magnitud"], cols["date"], cols["hour"],
+                                  cols["value"], cols["flag"]):
+        ok = f == _VALID and not math.isnan(v)
+        out.setdefault(f"{st}|{mg}", {})[hour_index(d, h)] = float(v) if ok else None
+    return out
+
+
+def update_aggregates(parts: Iterable[Dict[str, array]], state_path: Path = STATE,
+                      output: Path = OUTPUT, quiet: bool = False) -> List[ClosedDay]:
+    """Pliega columnas (ver calair_history.rows_to_columns) en el estado y el CSV.
+
+    Devuelve los días cerrados en esta llamada (clave, fecha, acumuladores sin
+    redondear) para etapas que se alimentan de ellos, como calair_monthly.
+    """
+    state = load_state(state_path)
+    if not int(state.get("csv_bytes", 0)) and output.exists() and output.stat().st_size:
+        print(f"⚠️ {output} existe pero {state_path} falta o no se puede leer; "
+              "agregados sin actualizar (ejecuta calair_aggregates.py rebuild).")
+        return []
+    keys = state["keys"]
+    closed: List[ClosedDay] = []
+    folded = 0
+    for cols in parts:
+        for key, hours in _group_hours(cols).items():
+            ks = keys.setdefault(key, {"last": None, "ring": [None] * RING, "days": {}})
+            folded += _fold_key(ks, key, hours, closed)
+    _write_output(output, state, closed)
+    _save_state(state_path, state)
+    if not quiet:
+        print(f"📈 Agregados {output}: {folded} horas nuevas, {len(closed)} días cerrados.")
+    return closed
+
+
+def _write_output(output: Path, state: Dict[str, Any], closed: List[ClosedDay]) -> None:
+    order = lambda r: (r["fecha"], r["estacion"], r["magnitud"])
+    open_rows = sorted((_day_row(k, d, acc) for k, ks in state["keys"].items() for d, acc in ks["days"].items()),
+                       key=order)
+    committed = int(state.get("csv_bytes", 0))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "ab") as f:
+        f.truncate(committed)
+        f.seek(0, os.SEEK_END)
+        f.write(_encode_rows(sorted((_day_row(*c) for c in closed), key=order), header=committed == 0))
+        state["csv_bytes"] = f.tell()
+        f.write(_encode_rows(open_rows, header=False))
+
+
+def _encode_rows(rows: List[Dict[str, Any]], header: bool) -> bytes:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=FIELDNAMES, lineterminator="\n")
+    if header:
+        w.writeheader()
+    w.writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def rebuild(history: Path = HISTORY_DIR, state_path: Path = STATE, output: Path = OUTPUT) -> List[ClosedDay]:
+    """Recalcula desde cero leyendo el histórico columnar partición a partición."""
+    state_path.unlink(missing_ok=True)
+    output.unlink(missing_ok=True)
+    parts = (read_partition(p) for p in list_partitions(history))
+    return update_aggregates(parts, state_path, output)
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Agregados normativos incrementales de calair")
+    ap.add_argument("cmd", choices=["rebuild"], help="rebuild: recalcula desde el histórico columnar")
+    ap.add_argument("--history", default=str(HISTORY_DIR), help="Directorio del histórico columnar")
+    args = ap.parse_args(argv)
+    rebuild(Path(args.history))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
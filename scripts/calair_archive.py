@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Per-day compressed archives of stamped calair snapshots.
+
+A finished day directory holds one pretty-printed JSON plus two CSVs per
+cron run. ``pack`` moves those stamped files into a single archive with one
+independent gzip member per file, and a small JSON index::
+
+    data/calair/2025-09-10/
+        archive.gz          # gzip members, one per stamped file
+        archive.idx.json    # {"bytes": N, "members": {name: {offset, length, size, sha256}}}
+        latest.json / latest.csv / latest.flat.csv   # kept for consumers
+
+Any member can be read by seeking to its offset and inflating ``length``
+bytes, without decompressing the rest of the day. Byte-identical files
+(repeated snapshots) share one member. Names stay the same, so the blob
+paths in ``snapshots.jsonl`` still resolve through ``read_member``.
+
+Usage:
+    python scripts/calair_archive.py pack                 # every day before today (UTC)
+    python scripts/calair_archive.py pack --before 2025-09-10
+    python scripts/calair_archive.py cat 2025-09-10/calair_tiemporeal_2025-09-10T22-14-07Z.json
+"""
+from __future__ import annotations
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+CALAIR_DIR = Path("data/calair")
+ARCHIVE = "archive.gz"
+INDEX = "archive.idx.json"
+
+_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_STAMPED_RE = re.compile(r"^calair_tiemporeal_(.+?)\.(json|flat\.csv|csv)$")
+
+
+def load_index(day_dir: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((day_dir / INDEX).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {"bytes": 0, "members": {}}
+
+
+def _write_index(day_dir: Path, index: Dict[str, Any]) -> None:
+    tmp = day_dir / (INDEX + ".tmp")
+    tmp.write_text(json.dumps(index, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, day_dir / INDEX)
+
+
+def stamped_files(day_dir: Path) -> List[Path]:
+    """Ficheros sellados sueltos del día (latest.* nunca entra)."""
+    return sorted(p for p in day_dir.iterdir() if p.is_file() and _STAMPED_RE.match(p.name))
+
+
+def pack_day(day_dir: Path, keep: Tuple[Path, ...] = ()) -> Tuple[int, int, int]:
+    """Mueve los ficheros sellados del día al archivo. Devuelve (ficheros, bytes antes, bytes después).
+
+    Orden seguro ante cortes: se añaden los miembros, se sincroniza el
+    archivo, se publica el índice y solo entonces se borran los sueltos.
+    Un run interrumpido deja bytes huérfanos al final que se truncan al
+    reanudar (el índice guarda los bytes confirmados).
+    """
+    keep_set = {p.resolve() for p in keep}
+    files = [p for p in stamped_files(day_dir) if p.resolve() not in keep_set]
+    if not files:
+        return 0, 0, 0
+    index = load_index(day_dir)
+    members: Dict[str, Any] = index["members"]
+    by_hash = {m["sha256"]: m for m in members.values()}
+    before = sum(p.stat().st_size for p in files)
+    arch = day_dir / ARCHIVE
+    with open(arch, "ab") as f:
+        f.truncate(int(index.get("bytes", 0)))
+        f.seek(0, os.SEEK_END)
+        for p in files:
+            data = p.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            same = by_hash.get(digest)
+            if same is None:
+                blob = gzip.compress(data, compresslevel=9, mtime=0)
+                same = {"offset": f.tell(), "length": len(blob), "size": len(data), "sha256": digest}
+                f.write(blob)
+                by_hash[digest] = same
+            members[p.name] = dict(same)
+        f.flush()
+        os.fsync(f.fileno())
+        index["bytes"] = f.tell()
+    _write_index(day_dir, index)
+    for p in files:
+        p.unlink()
+    return len(files), before, index["bytes"]
+
+
+def read_member(day_dir: Path, name: str) -> bytes:
+    """Contenido de un fichero sellado, suelto o dentro del archivo del día."""
+    loose = day_dir / name
+    if loose.is_file():
+        return loose.read_bytes()
+    m = load_index(day_dir)["members"].get(name)
+    if m is None:
+        raise FileNotFoundError(str(loose))
+    with open(day_dir / ARCHIVE, "rb") as f:
+        f.seek(m["offset"])
+        return gzip.decompress(f.read(m["length"]))
+
+
+def read_blob(blob: str, base: Path = CALAIR_DIR) -> bytes:
+    """Resuelve una ruta de snapshots.jsonl ('<día>/<fichero>') a bytes."""
+    day, _, name = blob.partition("/")
+    return read_member(base / day, name)
+
+
+def member_kind(name: str) -> str | None:
+    """'json', 'csv' o 'flat.csv' para un nombre sellado."""
+    m = _STAMPED_RE.match(name)
+    return m.group(2) if m else None
+
+
+def iter_day_members(day_dir: Path, kind: str = "json") -> Iterator[Tuple[str, bytes]]:
+    """(nombre, bytes) de los sellados del día de un tipo, en orden de timestamp."""
+    names = {p.name for p in stamped_files(day_dir)} | set(load_index(day_dir)["members"])
+    for name in sorted(n for n in names if member_kind(n) == kind):
+        yield name, read_member(day_dir, name)
+
+
+def day_dirs(base: Path = CALAIR_DIR) -> List[Path]:
+    return sorted(d for d in base.iterdir() if d.is_dir() and _DAY_RE.match(d.name)) if base.is_dir() else []
+
+
+def _pinned(base: Path) -> Tuple[Path, ...]:
+    """Ficheros que deben seguir sueltos: el CSV al que apunta last_good.json."""
+    try:
+        entry = json.loads((base / "last_good.json").read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return ()
+    if not entry.get("path"):
+        return ()
+    # La ruta se guarda relativa a la raíz del repo (data/calair/<día>/...):
+    # se resuelve contra base, no contra el directorio actual
+    path = Path(entry["path"])
+    if not path.is_absolute():
+        try:
+            path = base / path.relative_to(CALAIR_DIR)
+        except ValueError:
+            path = base / path
+    return (path,)
+
+
+def cmd_pack(args: argparse.Namespace) -> int:
+    base = Path(args.base)
+    before = args.before or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    keep = _pinned(base)
+    total_before = total_after = 0
+    for d in day_dirs(base):
+        if d.name >= before:
+            continue
+        n, b, a = pack_day(d, keep)
+        if n:
+            print(f"🗜️  {d.name}: {n} ficheros, {b / 1024:.0f} KB → {a / 1024:.0f} KB")
+            total_before += b
+            total_after += a
+    print(f"✅ Archivado hasta {before}: {total_before / 1024:.0f} KB → {total_after / 1024:.0f} KB.")
+    return 0
+
+
+def cmd_cat(args: argparse.Namespace) -> int:
+    sys.stdout.buffer.write(read_blob(args.blob, Path(args.base)))
+    return 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Archivos diarios comprimidos de snapshots calair")
+    ap.add_argument("--base", default=str(CALAIR_DIR), help="Directorio data/calair")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("pack", help="Empaqueta los días terminados")
+    p.add_argument("--before", help="Solo días anteriores a esta fecha (YYYY-MM-DD); por defecto hoy (UTC)")
+    p.set_defaults(func=cmd_pack)
+    p = sub.add_parser("cat", help="Vuelca un fichero sellado ('<día>/<fichero>') a stdout")
+    p.add_argument("blob")
+    p.set_defaults(func=cmd_cat)
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
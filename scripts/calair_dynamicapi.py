@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Paginated client for the ciudadesabiertas.madrid.es dynamicAPI.
+
+Responses are paged (``page``, ``pageSize``, ``totalRecords``, ``first``,
+``last``) and the server may cap ``pageSize`` below what was requested, so a
+single ``?pageSize=5000`` call can silently truncate. ``iter_records`` reads
+``totalRecords`` from page 1, fetches the remaining pages concurrently with a
+bounded thread pool and yields records in page order as they arrive.
+
+Usage:
+    from calair_dynamicapi import iter_records
+    for rec in iter_records(ULT_URL):
+        ...
+"""
+from __future__ import annotations
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import calair_http
+
+BASE_URL = "https://ciudadesabiertas.madrid.es/dynamicAPI/API/query"
+ULT_URL = f"{BASE_URL}/calair_tiemporeal_ult.json"
+PAGE_SIZE = 5000
+MAX_WORKERS = 4
+
+
+def http_get_json(url: str, timeout: int = 60) -> Any:
+    """GET condicional (ver calair_http): páginas sin cambios no se vuelven a descargar."""
+    return calair_http.get(url, timeout=timeout).json()
+
+
+def page_url(url: str, page: int, page_size: int) -> str:
+    """Misma URL con ``page``/``pageSize`` fijados (respeta el resto de parámetros)."""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({"page": str(page), "pageSize": str(page_size)})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _records(payload: Any) -> list:
+    return (payload.get("records") or []) if isinstance(payload, dict) else []
+
+
+def iter_records(
+    url: str = ULT_URL,
+    page_size: int = PAGE_SIZE,
+    max_workers: int = MAX_WORKERS,
+    get_json: Callable[[str], Any] = http_get_json,
+) -> Iterator[Dict[str, Any]]:
+    """Genera todos los registros de una consulta paginada.
+
+    Como mucho ``max_workers`` páginas en vuelo: la memoria no crece con el
+    total de registros y el tiempo lo marca la página más lenta de cada tanda.
+    """
+    first = get_json(page_url(url, 1, page_size))
+    recs = _records(first)
+    yield from recs
+    total = int(first.get("totalRecords") or 0) if isinstance(first, dict) else 0
+    # El servidor puede recortar pageSize (p.ej. 4500 pedidas 5000)
+    effective = int(first.get("pageSize") or page_size) if isinstance(first, dict) else page_size
+    if total <= len(recs) or effective <= 0:
+        return
+    pages = math.ceil(total / effective)
+    seen = len(recs)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending: deque = deque()
+        next_page = 2
+        while next_page <= pages or pending:
+            while next_page <= pages and len(pending) < max_workers:
+                pending.append(pool.submit(get_json, page_url(url, next_page, effective)))
+                next_page += 1
+            page_recs = _records(pending.popleft().result())
+            seen += len(page_recs)
+            yield from page_recs
+    if seen < total:
+        print(f"⚠️ dynamicAPI: {seen}/{total} registros recibidos ({url})")
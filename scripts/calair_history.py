@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+"""Columnar, month-partitioned history store for calair hourly data.
+
+Replaces the ever-growing ``history.csv`` / ``history_flat.csv`` text files
+(imported here; the CSVs stay published, frozen and deprecated) with typed
+column files partitioned by year/month::
+
+    data/calair/history/YYYY/MM/
+        meta.json          # committed rows/bytes per column + date span of each member (written last)
+        station.i32.gz     # station code, e.g. 28079011
+        magnitud.u16.gz    # MAGNITUD
+        date.i32.gz        # yyyymmdd
+        hour.u8.gz         # 1..24
+        value.f32.gz       # float32, NaN when empty
+        flag.u8.gz         # ord() of the validation flag ('V', 'N', 'P' provisional, ...), 0 if empty
+        patch.*.gz         # (row, value, flag) revalidations applied on read
+    data/calair/history/keys.sqlite   # (station, magnitud, date, hour) -> row (not committed)
+
+Each append adds one gzip member per column, so writes only touch the
+current partition and never rewrite older data. Readers open only the
+partitions in the requested date range and only the requested columns.
+
+Appends are upserts: the SQLite key index tells whether a station-hour is
+new (appended), unchanged (skipped) or revalidated (recorded as a patch),
+so re-running a fetch never duplicates history. Lookups go through the
+``(part, date)`` and ``(part, row)`` indexes, so an upsert costs
+O(rows of the dates it touches), not O(history size).
+The index is derived from the partitions and is not committed: it keeps a
+per-day sync marker and an upsert only (re)indexes the days in its own
+date range, decompressing just the gzip members whose date span overlaps
+it, so the first fetch after a fresh checkout reads a day or two of rows,
+not the whole partition.
+Provisional upserts (the accumulated feed, flag 'P') never replace a
+validated hour; the hourly feed later patches them with its 'V' value.
+``compact`` folds patches back into the columns.
+
+Usage:
+    python scripts/calair_history.py query --from 2025-09-01 --to 2025-09-30 --station 28079011
+    python scripts/calair_history.py import data/calair/history_flat.csv
+    python scripts/calair_history.py compact
+"""
+from __future__ import annotations
+import argparse
+import csv
+import gzip
+import json
+import math
+import os
+import sqlite3
+import sys
+from array import array
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+HISTORY_DIR = Path("data/calair/history")
+
+# nombre de columna -> typecode de array (ancho fijo, little-endian en disco)
+COLUMNS: Dict[str, str] = {
+    "station": "i",
+    "magnitud": "H",
+    "date": "i",
+    "hour": "B",
+    "value": "f",
+    "flag": "B",
+}
+# revalidaciones: fila de la partición + nuevo valor/validación
+PATCH_COLUMNS: Dict[str, str] = {"row": "I", "value": "f", "flag": "B"}
+_SUFFIX = {"i": "i32", "I": "u32", "H": "u16", "B": "u8", "f": "f32"}
+KEY_INDEX = "keys.sqlite"
+_VALID = ord("V")
+# claves de meta.json por esquema: filas, bytes confirmados, miembros gzip
+_META_KEYS = {"rows": ("rows", "bytes", "members"), "patches": ("patches", "patch_bytes", "patch_members")}
+# span de los miembros escritos antes de que meta.json los registrara
+_ANY_DATE = (0, 99999999)
+
+
+def column_path(part_dir: Path, name: str, schema: Dict[str, str] = COLUMNS) -> Path:
+    prefix = "patch." if schema is PATCH_COLUMNS else ""
+    return part_dir / f"{prefix}{name}.{_SUFFIX[schema[name]]}.gz"
+
+
+def partition_dir(base: Path, year: int, month: int) -> Path:
+    return base / f"{year:04d}" / f"{month:02d}"
+
+
+# ========= Conversión filas largas -> columnas =========
+def station_code_from(r: Dict[str, Any]) -> int:
+    pm = str(r.get("PUNTO_MUESTREO") or "").strip()
+    if pm:
+        head = pm.split("_", 1)[0]
+        if head.isdigit():
+            return int(head)
+    prov = str(r.get("PROVINCIA", "")).strip().zfill(2)
+    muni = str(r.get("MUNICIPIO", "")).strip().zfill(3)
+    est = str(r.get("ESTACION", "")).strip().zfill(3)
+    try:
+        return int(f"{prov}{muni}{est}")
+    except ValueError:
+        return 0
+
+
+def _to_float(val: Any) -> float:
+    if val in (None, "", "NaN"):
+        return math.nan
+    try:
+        v = float(str(val).replace(",", "."))
+    except ValueError:
+        return math.nan
+    return v if math.isfinite(v) else math.nan
+
+
+def _flag_code(val: Any) -> int:
+    s = str(val or "").strip()
+    return ord(s[0]) if s and ord(s[0]) < 256 else 0
+
+
+def rows_to_columns(rows: Iterable[Dict[str, Any]]) -> Dict[Tuple[int, int], Dict[str, array]]:
+    """Agrupa filas largas (ANO/MES/DIA/Hora/Valor/Validacion) por partición año/mes."""
+    parts: Dict[Tuple[int, int], Dict[str, array]] = {}
+    for r in rows:
+        try:
+            y, m, d = int(r.get("ANO", 0)), int(r.get("MES", 0)), int(r.get("DIA", 0))
+            h = int(r.get("Hora", 0))
+            mag = int(r.get("MAGNITUD", 0))
+        except (TypeError, ValueError):
+            continue
+        if not (y and 1 <= m <= 12 and 1 <= d <= 31 and 1 <= h <= 24):
+            continue
+        cols = parts.get((y, m))
+        if cols is None:
+            cols = parts[(y, m)] = {name: array(tc) for name, tc in COLUMNS.items()}
+        cols["station"].append(station_code_from(r))
+        cols["magnitud"].append(mag)
+        cols["date"].append(y * 10000 + m * 100 + d)
+        cols["hour"].append(h)
+        cols["value"].append(_to_float(r.get("Valor")))
+        cols["flag"].append(_flag_code(r.get("Validacion")))
+    return parts
+
+
+def extend_columns(dst: Dict[Tuple[int, int], Dict[str, array]],
+                   src: Dict[Tuple[int, int], Dict[str, array]]) -> Dict[Tuple[int, int], Dict[str, array]]:
+    """Concatena src detrás de dst partición a partición (en un upsert gana lo último)."""
+    for key, cols in src.items():
+        if key not in dst:
+            dst[key] = {name: array(tc) for name, tc in COLUMNS.items()}
+        for name in COLUMNS:
+            dst[key][name].extend(cols[name])
+    return dst
+
+
+# ========= Escritura =========
+def _read_meta(part_dir: Path) -> Dict[str, Any]:
+    p = part_dir / "meta.json"
+    if not p.exists():
+        return {"rows": 0, "columns": dict(COLUMNS)}
+    return json.loads(p.read_text(encoding="utf-8"))
+
+
+def _write_meta(part_dir: Path, meta: Dict[str, Any]) -> None:
+    tmp = part_dir / "meta.json.tmp"
+    tmp.write_text(json.dumps(meta, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, part_dir / "meta.json")
+
+
+def _encode(col: array) -> bytes:
+    if sys.byteorder == "big" and col.itemsize > 1:
+        col = array(col.typecode, col)
+        col.byteswap()
+    return gzip.compress(col.tobytes(), compresslevel=6, mtime=0)
+
+
+def _schema_keys(schema: Dict[str, str]) -> Tuple[str, str, str]:
+    return _META_KEYS["rows" if schema is COLUMNS else "patches"]
+
+
+def _members(meta: Dict[str, Any], schema: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Miembros gzip de un esquema: fila inicial, filas, span de fechas y offset por columna.
+
+    Las particiones escritas antes de registrar miembros se ven como un único
+    miembro que empieza en el byte 0 y puede contener cualquier fecha.
+    """
+    rows_key, _, members_key = _schema_keys(schema)
+    members = meta.get(members_key)
+    if members is not None:
+        return list(members)
+    n = int(meta.get(rows_key, 0))
+    if not n:
+        return []
+    return [{"row": 0, "rows": n, "lo": _ANY_DATE[0], "hi": _ANY_DATE[1], "at": {name: 0 for name in schema}}]
+
+
+def append_columns(part_dir: Path, cols: Dict[str, array], schema: Dict[str, str] = COLUMNS,
+                   dates: Sequence[int] | None = None) -> int:
+    """Añade un miembro gzip por columna y actualiza meta.json al final.
+
+    meta.json guarda filas y bytes confirmados por columna y se escribe en
+    último lugar: si un append se interrumpe, el siguiente trunca los restos.
+    También registra el span de fechas del miembro (``dates``, por defecto la
+    columna ``date``) para que los lectores por rango se salten el resto.
+    """
+    n = len(next(iter(cols.values())))
+    if not n:
+        return 0
+    rows_key, bytes_key, members_key = _schema_keys(schema)
+    dates = cols["date"] if dates is None else dates
+    part_dir.mkdir(parents=True, exist_ok=True)
+    meta = _read_meta(part_dir)
+    members = _members(meta, schema)
+    sizes: Dict[str, int] = dict(meta.get(bytes_key) or {})
+    member = {"row": int(meta.get(rows_key, 0)), "rows": n, "lo": min(dates), "hi": max(dates), "at": {}}
+    for name in schema:
+        p = column_path(part_dir, name, schema)
+        committed = int(sizes.get(name, 0))
+        with p.open("ab") as f:
+            if f.tell() != committed:
+                f.truncate(committed)
+                f.seek(committed)
+            member["at"][name] = committed
+            f.write(_encode(cols[name]))
+            sizes[name] = f.tell()
+    meta[rows_key] = int(meta.get(rows_key, 0)) + n
+    meta[bytes_key] = sizes
+    meta[members_key] = members + [member]
+    meta["columns"] = dict(COLUMNS)
+    _write_meta(part_dir, meta)
+    return n
+
+
+# ========= Índice de claves (upserts) =========
+def open_key_index(base: Path) -> sqlite3.Connection:
+    base.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(base / KEY_INDEX)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS keys ("
+        " station INTEGER, magnitud INTEGER, date INTEGER, hour INTEGER,"
+        " part TEXT, row INTEGER, value REAL, flag INTEGER,"
+        " PRIMARY KEY (station, magnitud, date, hour)) WITHOUT ROWID"
+    )
+    # upserts y resincronización buscan por día y por fila dentro de la partición
+    conn.execute("CREATE INDEX IF NOT EXISTS keys_part_date ON keys(part, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS keys_part_row ON keys(part, row)")
+    # día indexado -> filas/parches de la partición cuando se indexó
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS days ("
+        " part TEXT, date INTEGER, rows INTEGER, patches INTEGER,"
+        " PRIMARY KEY (part, date)) WITHOUT ROWID"
+    )
+    return conn
+
+
+def _part_name(part_dir: Path) -> str:
+    return f"{part_dir.parent.name}/{part_dir.name}"
+
+
+def _nan_to_none(v: float) -> float | None:
+    return None if math.isnan(v) else v
+
+
+def _month_range(part_dir: Path) -> Tuple[int, int]:
+    ym = int(part_dir.parent.name) * 10000 + int(part_dir.name) * 100
+    return ym + 1, ym + 31
+
+
+def _mark_days(conn: sqlite3.Connection, part: str, lo: int, hi: int, rows: int, patches: int) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?)",
+        ((part, d, rows, patches) for d in range(lo, hi + 1)),
+    )
+
+
+def _sync_index(conn: sqlite3.Connection, part_dir: Path, lo: int, hi: int) -> None:
+    """Deja al día las claves de la partición con fecha en [lo, hi] (yyyymmdd).
+
+    Un día está al día si se indexó con las filas/parches que la partición
+    tiene ahora; si no (checkout nuevo, append de otras fechas, run
+    interrumpido), se reindexan solo las filas de esas fechas, leyendo solo
+    los miembros gzip cuyo span de fechas solapa [lo, hi].
+    """
+    part = _part_name(part_dir)
+    meta = _read_meta(part_dir)
+    rows, patches = int(meta.get("rows", 0)), int(meta.get("patches", 0))
+    (fresh,) = conn.execute(
+        "SELECT COUNT(*) FROM days WHERE part = ? AND date BETWEEN ? AND ? AND rows = ? AND patches = ?",
+        (part, lo, hi, rows, patches),
+    ).fetchone()
+    if fresh == hi - lo + 1:
+        return
+    conn.execute("DELETE FROM keys WHERE part = ? AND date BETWEEN ? AND ?", (part, lo, hi))
+    if rows:
+        cols, row_ids = _read_span(part_dir, COLUMNS, meta, lo, hi)
+        dates = cols["date"]
+        # en orden de fila: para claves repetidas gana la última aparición
+        conn.executemany(
+            "INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (cols["station"][i], cols["magnitud"][i], dates[i], cols["hour"][i],
+                 part, row_ids[i], _nan_to_none(cols["value"][i]), cols["flag"][i])
+                for i in range(len(dates)) if lo <= dates[i] <= hi
+            ),
+        )
+        if patches:
+            in_range = {row_ids[i] for i in range(len(dates)) if lo <= dates[i] <= hi}
+            pcols, _ = _read_span(part_dir, PATCH_COLUMNS, meta, lo, hi)
+            # parches en orden: para una misma fila gana el último
+            last: Dict[int, Tuple[float | None, int]] = {}
+            for r, v, f in zip(pcols["row"], pcols["value"], pcols["flag"]):
+                if r in in_range:
+                    last[r] = (_nan_to_none(v), f)
+            conn.executemany(
+                "UPDATE keys SET value = ?, flag = ? WHERE part = ? AND row = ?",
+                ((v, f, part, r) for r, (v, f) in last.items()),
+            )
+    _mark_days(conn, part, lo, hi, rows, patches)
+
+
+def upsert_columns(conn: sqlite3.Connection, part_dir: Path, cols: Dict[str, array],
+                   provisional: bool = False) -> Tuple[int, int, int]:
+    """Upsert de un lote en una partición. Devuelve (nuevas, revalidadas, sin cambios).
+
+    Solo se consultan (y, si hace falta, se reindexan) las fechas del lote:
+    coste O(filas de esas fechas), no O(partición). Con ``provisional`` las
+    claves ya validadas ('V') se dejan como están.
+    """
+    lo, hi = min(cols["date"]), max(cols["date"])
+    _sync_index(conn, part_dir, lo, hi)
+    part = _part_name(part_dir)
+    # Dentro del lote gana la última aparición de cada clave
+    latest: Dict[Tuple[int, int, int, int], int] = {}
+    for i, key in enumerate(zip(cols["station"], cols["magnitud"], cols["date"], cols["hour"])):
+        latest[key] = i
+    known = {
+        (st, mg, d, h): (row, value, flag)
+        for st, mg, d, h, row, value, flag in conn.execute(
+            "SELECT station, magnitud, date, hour, row, value, flag FROM keys"
+            " WHERE date BETWEEN ? AND ? AND part = ?",
+            (lo, hi, part),
+        )
+    }
+    new_idx: List[int] = []
+    patch = {name: array(tc) for name, tc in PATCH_COLUMNS.items()}
+    patch_dates = array("i")
+    patch_keys: List[Tuple[int, int, int, int]] = []
+    unchanged = 0
+    for key, i in latest.items():
+        value, flag = _nan_to_none(cols["value"][i]), cols["flag"][i]
+        old = known.get(key)
+        if old is None:
+            new_idx.append(i)
+        elif (old[1] == value and old[2] == flag) or (provisional and old[2] == _VALID):
+            unchanged += 1
+        else:
+            patch["row"].append(old[0])
+            patch["value"].append(cols["value"][i])
+            patch["flag"].append(flag)
+            patch_dates.append(key[2])
+            patch_keys.append(key)
+    new_idx.sort()
+    if new_idx:
+        start = int(_read_meta(part_dir).get("rows", 0))
+        append_columns(part_dir, {name: array(tc, (cols[name][i] for i in new_idx)) for name, tc in COLUMNS.items()})
+        conn.executemany(
+            "INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (cols["station"][i], cols["magnitud"][i], cols["date"][i], cols["hour"][i],
+                 part, start + j, _nan_to_none(cols["value"][i]), cols["flag"][i])
+                for j, i in enumerate(new_idx)
+            ),
+        )
+    if patch["row"]:
+        append_columns(part_dir, patch, PATCH_COLUMNS, patch_dates)
+        # la clave completa ya se conoce: actualización por clave primaria
+        conn.executemany(
+            "UPDATE keys SET value = ?, flag = ? WHERE station = ? AND magnitud = ? AND date = ? AND hour = ?",
+            ((_nan_to_none(v), f) + key for key, v, f in zip(patch_keys, patch["value"], patch["flag"])),
+        )
+    # Las filas nuevas son todas de [lo, hi]; el resto de días queda pendiente de resincronizar
+    meta = _read_meta(part_dir)
+    _mark_days(conn, part, lo, hi, int(meta.get("rows", 0)), int(meta.get("patches", 0)))
+    return len(new_idx), len(patch["row"]), unchanged
+
+
+def append_history_columns(base: Path, parts: Dict[Tuple[int, int], Dict[str, array]],
+                           provisional: bool = False, quiet: bool = False) -> int:
+    """Upsert de columnas ya agrupadas por partición (ver rows_to_columns)."""
+    added = revalidated = unchanged = 0
+    conn = open_key_index(base)
+    try:
+        for (y, m), cols in sorted(parts.items()):
+            if not len(cols["date"]):
+                continue
+            with conn:
+                a, r, u = upsert_columns(conn, partition_dir(base, y, m), cols, provisional)
+            added += a; revalidated += r; unchanged += u
+    finally:
+        conn.close()
+    if not quiet:
+        print(f"📚 Histórico columnar {base}: +{added} nuevas, {revalidated} revalidadas, {unchanged} sin cambios.")
+    return added + revalidated
+
+
+def append_history_rows(base: Path, rows_flat: List[Dict[str, Any]]) -> int:
+    """Upsert de filas largas en el almacén, cada una en la partición de su mes."""
+    if not rows_flat:
+        print("ℹ️ No se añaden filas al histórico columnar (0 filas).")
+        return 0
+    return append_history_columns(base, rows_to_columns(rows_flat))
+
+
+def compact_partition(conn: sqlite3.Connection, part_dir: Path) -> int:
+    """Reescribe la partición con una fila por clave y los parches aplicados."""
+    lo, hi = _month_range(part_dir)
+    _sync_index(conn, part_dir, lo, hi)
+    part = _part_name(part_dir)
+    keep = [r for (r,) in conn.execute("SELECT row FROM keys WHERE part = ? ORDER BY row", (part,))]
+    cols = read_partition(part_dir)
+    new_cols = {name: array(tc, (cols[name][i] for i in keep)) for name, tc in COLUMNS.items()}
+    meta: Dict[str, Any] = {"rows": 0, "bytes": {}, "columns": dict(COLUMNS)}
+    for name in COLUMNS:
+        tmp = column_path(part_dir, name).with_suffix(".tmp")
+        data = _encode(new_cols[name])
+        tmp.write_bytes(data)
+        os.replace(tmp, column_path(part_dir, name))
+        meta["bytes"][name] = len(data)
+    for name in PATCH_COLUMNS:
+        column_path(part_dir, name, PATCH_COLUMNS).unlink(missing_ok=True)
+    meta["rows"] = len(keep)
+    meta["members"] = [{
+        "row": 0, "rows": len(keep),
+        "lo": min(new_cols["date"]), "hi": max(new_cols["date"]),
+        "at": {name: 0 for name in COLUMNS},
+    }] if keep else []
+    _write_meta(part_dir, meta)
+    conn.executemany(
+        "UPDATE keys SET row = ? WHERE part = ? AND row = ?",
+        ((j, part, r) for j, r in enumerate(keep) if j != r),
+    )
+    _mark_days(conn, part, lo, hi, len(keep), 0)
+    return len(cols["date"]) - len(keep)
+
+
+# ========= Lectura =========
+def _decode(p: Path, typecode: str, size: int | None = None, offset: int = 0) -> array:
+    col = array(typecode)
+    with p.open("rb") as f:
+        f.seek(offset)
+        data = f.read() if size is None else f.read(size)
+    col.frombytes(gzip.decompress(data))
+    if sys.byteorder == "big" and col.itemsize > 1:
+        col.byteswap()
+    return col
+
+
+def list_partitions(base: Path, start: date | None = None, end: date | None = None) -> List[Path]:
+    """Particiones existentes (orden cronológico) que solapan [start, end]."""
+    if not base.exists():
+        return []
+    lo = (start.year, start.month) if start else (0, 0)
+    hi = (end.year, end.month) if end else (9999, 12)
+    out: List[Path] = []
+    for ydir in sorted(base.iterdir()):
+        if not (ydir.is_dir() and ydir.name.isdigit()):
+            continue
+        for mdir in sorted(ydir.iterdir()):
+            if not (mdir.is_dir() and mdir.name.isdigit()):
+                continue
+            if lo <= (int(ydir.name), int(mdir.name)) <= hi and (mdir / "meta.json").exists():
+                out.append(mdir)
+    return out
+
+
+def _read_columns(part_dir: Path, schema: Dict[str, str], sizes: Dict[str, int],
+                  names: Sequence[str] | None = None) -> Dict[str, array]:
+    return {
+        name: _decode(column_path(part_dir, name, schema), schema[name], sizes.get(name, 0))
+        for name in (names or schema)
+    }
+
+
+def _read_span(part_dir: Path, schema: Dict[str, str], meta: Dict[str, Any],
+               lo: int, hi: int) -> Tuple[Dict[str, array], array]:
+    """Columnas de los miembros gzip cuyo span de fechas solapa [lo, hi].
+
+    Devuelve también el número de fila (en la partición o en los parches) de
+    cada valor leído; las filas fuera de [lo, hi] que comparten miembro
+    siguen ahí y el llamador las filtra.
+    """
+    _, bytes_key, _ = _schema_keys(schema)
+    sizes = meta.get(bytes_key) or {}
+    members = _members(meta, schema)
+    picked = [k for k, m in enumerate(members) if m["lo"] <= hi and lo <= m["hi"]]
+    out = {name: array(tc) for name, tc in schema.items()}
+    row_ids = array("I")
+    for k in picked:
+        m = members[k]
+        for name, tc in schema.items():
+            start = int(m["at"][name])
+            end = int(members[k + 1]["at"][name]) if k + 1 < len(members) else int(sizes.get(name, 0))
+            out[name].extend(_decode(column_path(part_dir, name, schema), tc, end - start, start))
+        row_ids.extend(range(m["row"], m["row"] + m["rows"]))
+    return out, row_ids
+
+
+def read_partition(part_dir: Path, columns: Sequence[str] | None = None) -> Dict[str, array]:
+    names = list(columns or COLUMNS)
+    meta = _read_meta(part_dir)
+    out = _read_columns(part_dir, COLUMNS, meta.get("bytes") or {}, names)
+    if meta.get("patches") and ("value" in out or "flag" in out):
+        patch = _read_columns(part_dir, PATCH_COLUMNS, meta.get("patch_bytes") or {})
+        for r, v, f in zip(patch["row"], patch["value"], patch["flag"]):
+            if "value" in out: out["value"][r] = v
+            if "flag" in out: out["flag"][r] = f
+    return out
+
+
+def read_history(
+    base: Path = HISTORY_DIR,
+    start: date | None = None,
+    end: date | None = None,
+    columns: Sequence[str] | None = None,
+) -> Dict[str, array]:
+    """Lee solo las particiones y columnas necesarias para [start, end].
+
+    Solo las particiones de borde se filtran fila a fila por ``date``; las
+    que caen enteras dentro del rango se concatenan tal cual.
+    """
+    names = list(columns or COLUMNS)
+    lo = start.year * 10000 + start.month * 100 + start.day if start else 0
+    hi = end.year * 10000 + end.month * 100 + end.day if end else 99999999
+    out = {name: array(COLUMNS[name]) for name in names}
+    for part_dir in list_partitions(base, start, end):
+        y, m = int(part_dir.parent.name), int(part_dir.name)
+        inner = lo <= y * 10000 + m * 100 + 1 and y * 10000 + m * 100 + 31 <= hi
+        need = names if inner or "date" in names else names + ["date"]
+        cols = read_partition(part_dir, need)
+        if inner:
+            for name in names:
+                out[name].extend(cols[name])
+            continue
+        keep = [i for i, d in enumerate(cols["date"]) if lo <= d <= hi]
+        for name in names:
+            src = cols[name]
+            out[name].extend(src[i] for i in keep)
+    return out
+
+
+def iter_history_rows(cols: Dict[str, array]) -> Iterator[Dict[str, Any]]:
+    """Materializa filas dict a partir de columnas (solo para exportar)."""
+    names = list(cols)
+    for values in zip(*(cols[n] for n in names)):
+        r = dict(zip(names, values))
+        if "value" in r and math.isnan(r["value"]):
+            r["value"] = None
+        if "flag" in r:
+            r["flag"] = chr(r["flag"]) if r["flag"] else ""
+        yield r
+
+
+# ========= CLI =========
+def _parse_day(s: str | None) -> date | None:
+    return datetime.strptime(s, "%Y-%m-%d").date() if s else None
+
+
+def cmd_query(args: argparse.Namespace) -> int:
+    cols = read_history(Path(args.base), _parse_day(args.date_from), _parse_day(args.date_to))
+    if args.station is not None or args.magnitud is not None:
+        keep = [
+            i for i in range(len(cols["date"]))
+            if (args.station is None or cols["station"][i] == args.station)
+            and (args.magnitud is None or cols["magnitud"][i] == args.magnitud)
+        ]
+        cols = {n: array(c.typecode, (c[i] for i in keep)) for n, c in cols.items()}
+    w = csv.DictWriter(sys.stdout, fieldnames=list(COLUMNS))
+    w.writeheader()
+    w.writerows(iter_history_rows(cols))
+    return 0
+
+
+def cmd_import(args: argparse.Namespace) -> int:
+    """Migra un CSV largo existente (p.ej. history_flat.csv) al almacén."""
+    with open(args.csv, "r", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(f)
+        header = next(rdr, [])
+        long_header = ["PROVINCIA", "MUNICIPIO", "ESTACION", "MAGNITUD", "PUNTO_MUESTREO",
+                       "ANO", "MES", "DIA", "Hora", "Valor", "Validacion"]
+        fields = header if "Hora" in header else long_header
+        # Solo filas con la forma larga; las anchas mezcladas se ignoran
+        rows = [dict(zip(fields, r)) for r in rdr if len(r) == len(fields)]
+    append_history_rows(Path(args.base), rows)
+    return 0
+
+
+def cmd_compact(args: argparse.Namespace) -> int:
+    base = Path(args.base)
+    conn = open_key_index(base)
+    try:
+        for part_dir in list_partitions(base):
+            with conn:
+                dropped = compact_partition(conn, part_dir)
+            print(f"🗜️  {_part_name(part_dir)}: -{dropped} filas duplicadas, parches aplicados.")
+    finally:
+        conn.close()
+    return 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Histórico columnar calair (particionado año/mes)")
+    ap.add_argument("--base", default=str(HISTORY_DIR), help="Directorio raíz del histórico")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    q = sub.add_parser("query", help="Exporta a CSV (stdout) un rango de fechas")
+    q.add_argument("--from", dest="date_from", help="YYYY-MM-DD inclusive")
+    q.add_argument("--to", dest="date_to", help="YYYY-MM-DD inclusive")
+    q.add_argument("--station", type=int, help="Código de estación, p.ej. 28079011")
+    q.add_argument("--magnitud", type=int, help="Código MAGNITUD")
+    q.set_defaults(func=cmd_query)
+
+    imp = sub.add_parser("import", help="Importa un CSV largo existente")
+    imp.add_argument("csv", help="Ruta al CSV (formato history_flat)")
+    imp.set_defaults(func=cmd_import)
+
+    comp = sub.add_parser("compact", help="Aplica parches y elimina filas duplicadas")
+    comp.set_defaults(func=cmd_compact)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
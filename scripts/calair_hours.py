@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Vectorized H01..H24 / V01..V24 engine for calair records (NumPy).
+
+Loads a list of wide records into a (rows × 24) float64 value matrix and a
+(rows × 24) validation-flag matrix, masks NaN/inf in one pass and produces
+the long (Hora/Valor/Validacion) format as parallel column arrays. Dicts are
+only built when rows are handed to the CSV writer.
+
+NumPy is optional: ``fetch_calair.py`` falls back to its per-cell functions
+when it is not installed (``AVAILABLE`` is False).
+"""
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depende del entorno
+    np = None
+
+AVAILABLE = np is not None
+
+HOUR_KEYS = [f"H{i:02d}" for i in range(1, 25)]
+FLAG_KEYS = [f"V{i:02d}" for i in range(1, 25)]
+_HV_KEYS = frozenset(HOUR_KEYS) | frozenset(FLAG_KEYS)
+_EMPTY = ["", "None", "NaN", "nan"]
+
+
+def _parse_values(cells: List[Any]) -> "np.ndarray":
+    """Convierte celdas H a float64 de una vez; celdas basura pasan a NaN."""
+    if not cells:
+        return np.empty(0, dtype=np.float64)
+    txt = np.array(["" if c is None else str(c) for c in cells], dtype=str)
+    txt = np.char.replace(np.char.strip(txt), ",", ".")
+    txt = np.where(np.isin(txt, _EMPTY), "nan", txt)
+    try:
+        vals = txt.astype(np.float64)
+    except ValueError:
+        vals = np.empty(len(txt), dtype=np.float64)
+        for i, s in enumerate(txt.tolist()):
+            try:
+                vals[i] = float(s)
+            except ValueError:
+                vals[i] = np.nan
+    vals[~np.isfinite(vals)] = np.nan
+    return vals
+
+
+class HourMatrix:
+    """Registros anchos como matrices (rows × 24) de valores y validaciones."""
+
+    __slots__ = ("rows", "values", "flags", "flag_empty")
+
+    def __init__(self, rows: List[Dict[str, Any]], values, flags, flag_empty) -> None:
+        self.rows = rows
+        self.values = values          # float64, NaN = vacío
+        self.flags = flags            # object, valor Vxx tal cual (o None)
+        self.flag_empty = flag_empty  # bool, Vxx ausente / "" / None
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[str, Any]]) -> "HourMatrix":
+        n = len(rows)
+        values = _parse_values([r.get(k) for r in rows for k in HOUR_KEYS]).reshape(n, 24)
+        flags = np.array([r.get(k) for r in rows for k in FLAG_KEYS], dtype=object).reshape(n, 24)
+        flag_empty = np.equal(flags, None) | (flags == "")
+        return cls(rows, values, flags, flag_empty)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def select(self, mask) -> "HourMatrix":
+        idx = np.flatnonzero(mask)
+        return HourMatrix([self.rows[i] for i in idx], self.values[idx], self.flags[idx], self.flag_empty[idx])
+
+    def ymd(self):
+        """Clave yyyymmdd por fila (0 si ANO/MES/DIA no son numéricos)."""
+        out = np.zeros(len(self.rows), dtype=np.int64)
+        for i, r in enumerate(self.rows):
+            try:
+                out[i] = int(r.get("ANO", 0)) * 10000 + int(r.get("MES", 0)) * 100 + int(r.get("DIA", 0))
+            except (TypeError, ValueError):
+                pass
+        return out
+
+    def latest_day(self) -> "HourMatrix":
+        if not self.rows:
+            return self
+        ymd = self.ymd()
+        return self.select(ymd == ymd.max())
+
+    def long_columns(self, drop_empty: bool = True) -> Dict[str, Any]:
+        """Formato largo como columnas paralelas: row, Hora, Valor, Validacion.
+
+        Igual que ``unpivot_hours_to_long``: se descarta la celda si el valor
+        está vacío y la validación también.
+        """
+        keep = ~(np.isnan(self.values) & self.flag_empty) if drop_empty else np.ones(self.values.shape, bool)
+        row_idx, hour_idx = np.nonzero(keep)
+        return {
+            "row": row_idx,
+            "Hora": hour_idx + 1,
+            "Valor": self.values[keep],
+            "Validacion": self.flags[keep],
+        }
+
+    def wide_rows(self) -> List[Dict[str, Any]]:
+        """Vuelca los valores normalizados (float o None) a los dicts anchos."""
+        vals = np.where(np.isnan(self.values), None, self.values).tolist()
+        for r, row_vals in zip(self.rows, vals):
+            for k, v in zip(HOUR_KEYS, row_vals):
+                if k in r:
+                    r[k] = v
+        return self.rows
+
+    def iter_long_rows(self, cols: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Materializa dicts largos (resto de columnas + Hora/Valor/Validacion)."""
+        bases: Dict[int, Dict[str, Any]] = {}
+        valores = np.where(np.isnan(cols["Valor"]), None, cols["Valor"]).tolist()
+        for ri, hora, val, flag in zip(cols["row"].tolist(), cols["Hora"].tolist(), valores, cols["Validacion"].tolist()):
+            base = bases.get(ri)
+            if base is None:
+                base = bases[ri] = {k: v for k, v in self.rows[ri].items() if k not in _HV_KEYS}
+            out = dict(base)
+            out["Hora"] = hora
+            out["Valor"] = val
+            out["Validacion"] = flag
+            yield out
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Conditional GET with a small on-disk response cache for the calair fetchers.
+
+Stores the ETag / Last-Modified validators and body of each URL under
+``.cache/calair-http/`` (override with ``CALAIR_HTTP_CACHE``) and sends
+``If-None-Match`` / ``If-Modified-Since`` on the next request. A 304, or a
+200 whose body hashes the same as the cached one, comes back with
+``changed=False`` so callers can skip parsing and writing.
+
+The cache is bounded (``CALAIR_HTTP_CACHE_MB``, default 64 MB); the least
+recently used entries are evicted first.
+
+``open_stream`` is the chunked variant for large bodies: the body is never
+held in memory, it is hashed and spooled to the cache while the caller
+consumes it.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+CACHE_DIR = Path(os.getenv("CALAIR_HTTP_CACHE") or ".cache/calair-http")
+CACHE_MAX_BYTES = int(float(os.getenv("CALAIR_HTTP_CACHE_MB") or "64") * 1024 * 1024)
+
+_lock = threading.Lock()
+
+
+@dataclass
+class Response:
+    url: str
+    status: int
+    body: bytes
+    changed: bool       # False: 304 o mismo sha256 que la copia en caché
+    from_cache: bool    # True: cuerpo servido desde disco (304)
+    sha256: str = ""    # del cuerpo devuelto (el guardado en caché)
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+def _entry_paths(url: str, cache_dir: Path) -> tuple[Path, Path]:
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return cache_dir / f"{key}.json", cache_dir / f"{key}.body"
+
+
+def _load_entry(url: str, cache_dir: Path) -> tuple[Dict[str, Any] | None, bytes | None]:
+    meta_p, body_p = _entry_paths(url, cache_dir)
+    try:
+        meta = json.loads(meta_p.read_text(encoding="utf-8"))
+        body = body_p.read_bytes()
+    except (OSError, json.JSONDecodeError):
+        return None, None
+    if meta.get("url") != url or hashlib.sha256(body).hexdigest() != meta.get("sha256"):
+        return None, None
+    return meta, body
+
+
+def _load_meta(url: str, cache_dir: Path) -> Dict[str, Any] | None:
+    """Como _load_entry sin leer el cuerpo: basta con que exista y tenga el tamaño anotado."""
+    meta_p, body_p = _entry_paths(url, cache_dir)
+    try:
+        meta = json.loads(meta_p.read_text(encoding="utf-8"))
+        size = body_p.stat().st_size
+    except (OSError, json.JSONDecodeError):
+        return None
+    return meta if meta.get("url") == url and meta.get("size") == size else None
+
+
+def _store_entry(url: str, cache_dir: Path, headers: Any, body: bytes, digest: str) -> None:
+    meta_p, body_p = _entry_paths(url, cache_dir)
+    meta = {
+        "url": url,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "sha256": digest,
+        "size": len(body),
+        "stored_at": time.time(),
+    }
+    with _lock:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = body_p.with_suffix(".tmp")
+        tmp.write_bytes(body)
+        os.replace(tmp, body_p)
+        meta_p.write_text(json.dumps(meta), encoding="utf-8")
+        _evict(cache_dir, CACHE_MAX_BYTES)
+
+
+def _touch(url: str, cache_dir: Path) -> None:
+    meta_p, _ = _entry_paths(url, cache_dir)
+    try:
+        os.utime(meta_p)
+    except OSError:
+        pass
+
+
+def _evict(cache_dir: Path, max_bytes: int) -> None:
+    """LRU por mtime del .json (se toca en cada acierto) hasta caber en max_bytes."""
+    entries = []
+    total = 0
+    for meta_p in cache_dir.glob("*.json"):
+        body_p = meta_p.with_suffix(".body")
+        try:
+            size = meta_p.stat().st_size + body_p.stat().st_size
+            entries.append((meta_p.stat().st_mtime, meta_p, body_p, size))
+        except OSError:
+            continue
+        total += size
+    entries.sort()
+    while total > max_bytes and len(entries) > 1:
+        _, meta_p, body_p, size = entries.pop(0)
+        meta_p.unlink(missing_ok=True)
+        body_p.unlink(missing_ok=True)
+        total -= size
+
+
+def _conditional_request(url: str, meta: Dict[str, Any] | None, user_agent: str) -> Request:
+    headers = {"User-Agent": user_agent}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return Request(url, headers=headers)
+
+
+def get(url: str, timeout: int = 60, user_agent: str = "datasets-calair/1.0",
+        cache_dir: Path | None = None) -> Response:
+    """GET condicional; siempre devuelve el cuerpo vigente (descargado o de caché)."""
+    cache_dir = cache_dir or CACHE_DIR
+    meta, cached = _load_entry(url, cache_dir)
+    try:
+        with urlopen(_conditional_request(url, meta, user_agent), timeout=timeout) as resp:
+            body = resp.read()
+            status, resp_headers = resp.status, resp.headers
+    except HTTPError as e:
+        if e.code == 304 and cached is not None:
+            _touch(url, cache_dir)
+            return Response(url, 304, cached, changed=False, from_cache=True, sha256=meta["sha256"])
+        raise
+    digest = hashlib.sha256(body).hexdigest()
+    changed = not meta or meta.get("sha256") != digest
+    if changed or resp_headers.get("ETag") != meta.get("etag") or resp_headers.get("Last-Modified") != meta.get("last_modified"):
+        _store_entry(url, cache_dir, resp_headers, body, digest)
+    else:
+        _touch(url, cache_dir)
+    return Response(url, status, body, changed=changed, from_cache=False, sha256=digest)
+
+
+class Stream:
+    """Respuesta condicional consumida por trozos (``for chunk in stream``).
+
+    ``changed`` solo es definitivo cuando el cuerpo se ha leído entero: un 200
+    con el mismo sha256 que la copia en caché también cuenta como sin cambios.
+    """
+
+    def __init__(self, url: str, status: int, chunks: Iterator[bytes], changed: bool, from_cache: bool) -> None:
+        self.url = url
+        self.status = status
+        self.changed = changed
+        self.from_cache = from_cache
+        self._chunks = chunks
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self._chunks
+
+
+def _iter_file(path: Path, chunk_size: int) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def open_stream(url: str, timeout: int = 60, user_agent: str = "datasets-calair/1.0",
+                cache_dir: Path | None = None, chunk_size: int = 64 * 1024) -> Stream:
+    """GET condicional por trozos: memoria acotada a chunk_size sea cual sea el cuerpo."""
+    cache_dir = cache_dir or CACHE_DIR
+    meta = _load_meta(url, cache_dir)
+    try:
+        resp = urlopen(_conditional_request(url, meta, user_agent), timeout=timeout)
+    except HTTPError as e:
+        if e.code == 304 and meta is not None:
+            _touch(url, cache_dir)
+            return Stream(url, 304, _iter_file(_entry_paths(url, cache_dir)[1], chunk_size),
+                          changed=False, from_cache=True)
+        raise
+    stream = Stream(url, resp.status, iter(()), changed=True, from_cache=False)
+
+    def chunks() -> Iterator[bytes]:
+        meta_p, body_p = _entry_paths(url, cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        spool = body_p.with_name(f"{body_p.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        h = hashlib.sha256()
+        try:
+            with resp, spool.open("wb") as out:
+                while True:
+                    chunk = resp.read(chunk_size)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    out.write(chunk)
+                    yield chunk
+            digest = h.hexdigest()
+            stream.changed = not meta or meta.get("sha256") != digest
+            with _lock:
+                os.replace(spool, body_p)
+                entry = {
+                    "url": url,
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                    "sha256": digest,
+                    "size": body_p.stat().st_size,
+                    "stored_at": time.time(),
+                }
+                meta_p.write_text(json.dumps(entry), encoding="utf-8")
+                _evict(cache_dir, CACHE_MAX_BYTES)
+        finally:
+            spool.unlink(missing_ok=True)
+
+    stream._chunks = chunks()
+    return stream
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Keeps ``calidad-aire-madrid-2001-2024.csv`` current from the live pipeline.
+
+The CSV (year, month, magnitude, val, normalized, year-month) is a static
+export that ends in 2024. ``val`` is the monthly mean of a magnitude over
+every station and ``normalized`` is ``val`` divided by the 2001-01 value of
+the same magnitude (``#N/A`` when that month is missing, as for PM2.5).
+For the live months ``val`` is the mean of every validated ('V') hourly
+value of the month over all stations (hour-weighted, so a station with
+gaps weighs less). The export does not say how its rows were averaged, so
+the two parts may differ slightly in method.
+The export's data ends in ``STATIC_END`` (2024-03) and is followed by
+``,,,,,-`` filler lines and two blank lines.
+
+The rollup is fed with the days that ``calair_aggregates`` closes: each
+station-day arrives exactly once with its raw sum and hour count, so the
+state (``data/calair/monthly_state.json``) only keeps mergeable
+sum/count per (year-month, magnitude) and the days of each month that
+have closed with data. The baselines and the byte offset
+where the ``STATIC_END`` rows end are read once, on the first run. After
+that the 2001–2024 rows are never parsed again. Each run copies the bytes up
+to that offset into a temp file, adds the live months from the state (one
+row per month and magnitude) and the filler tail, and replaces the CSV, so
+an interrupted run never leaves the published file truncated. Months up to
+``STATIC_END`` are left alone.
+
+Only complete months are published: a month appears once every one of its
+calendar days has been closed with at least ``MIN_DAILY_HOURS`` (18) valid
+hours for some station and magnitude. Days that the aggregator force-closes
+after a feed gap with only a few hours still add to the means but do not
+count as covered. The month in
+progress, or one that is only partly covered (e.g. a backfill starting
+mid-month), stays in the state and is not mixed with the full months of
+the export.
+
+If the state is lost, the seed still stops at ``STATIC_END``; live months
+already in the CSV are carried over verbatim (they have no sum/count to
+merge into) until ``rebuild`` recomputes them from the history.
+
+Usage (recompute aggregates and live months from the columnar history):
+    python scripts/calair_monthly.py rebuild
+"""
+from __future__ import annotations
+import argparse
+import calendar
+import csv
+import io
+import json
+import os
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import calair_aggregates
+from calair_history import HISTORY_DIR
+
+SERIES = Path("calidad-aire-madrid-2001-2024.csv")
+STATE = Path("data/calair/monthly_state.json")
+BASELINE_MONTH = (2001, 1)
+STATIC_END = (2024, 3)                      # último mes de la exportación estática
+FILLER = ",,,,,-"
+
+# MAGNITUD (código de la red) -> nombre usado en la serie larga
+MAGNITUDES = {
+    1: "Dióxido de Azufre",
+    6: "Monóxido de Carbono",
+    7: "Monóxido de Nitrógeno",
+    8: "Dióxido de Nitrógeno",
+    9: "Partículas < 2.5 µm",
+    10: "Partículas < 10 µm",
+    12: "Óxidos de Nitrógeno",
+    14: "Ozono",
+    20: "Tolueno",
+    30: "Benceno",
+    35: "Etilbenceno",
+    42: "Hidrocarburos totales (hexano)",
+    43: "Metano",
+    44: "Hidrocarburos no metánicos (hexano)",
+}
+
+
+def _sort_name(name: str) -> str:
+    """Orden de la exportación original: sin acentos ni mayúsculas (Óxidos va antes de Ozono)."""
+    return "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c)).casefold()
+
+
+def _seed(series: Path) -> Dict[str, Any]:
+    """Única lectura de la serie: baselines, fin de la parte estática y cola de relleno."""
+    baselines: Dict[str, float] = {}
+    carried: Dict[str, Dict[str, str]] = {}
+    filler = blank = 0
+    with series.open("rb") as f:
+        header = f.readline()
+        pos = offset = len(header)
+        for raw in f:
+            pos += len(raw)
+            line = raw.decode("utf-8").rstrip("\r\n")
+            if line == FILLER:
+                filler += 1
+                continue
+            if not line.strip():
+                blank += 1
+                continue
+            parts = line.split(",")
+            y, m, name, val = int(parts[0]), int(parts[1]), parts[2], parts[3]
+            if (y, m) > STATIC_END:
+                # Mes vivo escrito antes de perder el estado: se conserva tal cual
+                carried.setdefault(f"{y:04d}-{m:02d}", {})[name] = val
+                continue
+            if (y, m) == BASELINE_MONTH:
+                baselines[name] = float(val)
+            offset = pos
+    if carried:
+        print(f"⚠️ {series}: sin estado mensual; se conservan tal cual {', '.join(sorted(carried))} "
+              "(rebuild los recalcula).")
+    return {"version": 3, "offset": offset, "last_static": list(STATIC_END), "baselines": baselines,
+            "tail": [filler, blank], "carried": carried, "months": {}, "coverage": {}}
+
+
+def load_state(path: Path = STATE, series: Path = SERIES) -> Dict[str, Any]:
+    try:
+        state = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return _seed(series)
+    return state if state.get("version") == 3 else _seed(series)
+
+
+def _save_state(path: Path, state: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, separators=(",", ":"), sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def fold_days(state: Dict[str, Any], closed: Iterable[calair_aggregates.ClosedDay]) -> List[str]:
+    """Suma los días cerrados en sus meses; devuelve los meses tocados ('YYYY-MM').
+
+    Además anota qué días de cada mes han cerrado con al menos
+    ``MIN_DAILY_HOURS`` horas válidas (``coverage``), que es lo que decide si
+    el mes está completo.
+    """
+    last_static = tuple(state["last_static"])
+    months = state["months"]
+    coverage = state.setdefault("coverage", {})
+    touched = set()
+    for key, day, acc in closed:
+        name = MAGNITUDES.get(int(key.split("|")[1]))
+        y, m = int(day[:4]), int(day[5:7])
+        if name is None or not acc["n"] or (y, m) <= last_static:
+            continue
+        ym = f"{y:04d}-{m:02d}"
+        cell = months.setdefault(ym, {}).setdefault(name, [0.0, 0])
+        cell[0] += acc["sum"]
+        cell[1] += acc["n"]
+        if acc["n"] < calair_aggregates.MIN_DAILY_HOURS:
+            continue  # día cerrado por un hueco del feed: suma, pero no cubre el día
+        days = coverage.setdefault(ym, [])
+        d = int(day[8:10])
+        if d not in days:
+            days.append(d)
+            days.sort()
+        touched.add(ym)
+    return sorted(touched)
+
+
+def _complete(state: Dict[str, Any], ym: str) -> bool:
+    y, m = int(ym[:4]), int(ym[5:7])
+    return len(state.get("coverage", {}).get(ym, [])) == calendar.monthrange(y, m)[1]
+
+
+def _fmt(x: float) -> str:
+    return f"{x:.10g}"
+
+
+def _live_rows(state: Dict[str, Any]) -> List[List[str]]:
+    rows: List[List[str]] = []
+    baselines = state["baselines"]
+    carried = state.get("carried", {})
+    for ym in sorted(set(state["months"]) | set(carried)):
+        y, m = int(ym[:4]), int(ym[5:7])
+        if ym in state["months"] and _complete(state, ym):
+            cells = [(name, total / n) for name, (total, n) in state["months"][ym].items()]
+            vals = {name: _fmt(val) for name, val in cells}
+        elif ym in carried:
+            cells = [(name, float(val)) for name, val in carried[ym].items()]
+            vals = carried[ym]
+        else:
+            continue  # mes en curso o incompleto: no se publica
+        for name, val in sorted(cells, key=lambda c: _sort_name(c[0])):
+            base = baselines.get(name)
+            rows.append([str(y), str(m), name, vals[name], _fmt(val / base) if base else "#N/A", f"{y}-{m}"])
+    return rows
+
+
+def write_series(state: Dict[str, Any], series: Path = SERIES) -> None:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\r\n").writerows(_live_rows(state))
+    filler, blank = state.get("tail", [0, 0])
+    buf.write(f"{FILLER}\r\n" * filler + "\r\n" * blank)
+    tmp = series.with_name(series.name + ".tmp")
+    with open(series, "rb") as src, open(tmp, "wb") as dst:
+        left = int(state["offset"])
+        while left:
+            chunk = src.read(min(left, 1 << 20))
+            if not chunk:
+                break
+            dst.write(chunk)
+            left -= len(chunk)
+        dst.write(buf.getvalue().encode("utf-8"))
+    os.replace(tmp, series)
+
+
+def update_monthly(closed: Iterable[calair_aggregates.ClosedDay], state_path: Path = STATE,
+                   series: Path = SERIES) -> List[str]:
+    closed = list(closed)
+    if not closed:
+        return []
+    if not series.exists():
+        print(f"⚠️ {series} no existe; serie mensual sin actualizar.")
+        return []
+    state = load_state(state_path, series)
+    touched = fold_days(state, closed)
+    if touched:
+        write_series(state, series)
+        _save_state(state_path, state)
+        published = {r[5] for r in _live_rows(state)}
+        pending = [ym for ym in touched if f"{int(ym[:4])}-{int(ym[5:])}" not in published]
+        print(f"🗓️  Serie mensual {series}: meses actualizados {', '.join(touched)}"
+              + (f" (incompletos, sin publicar: {', '.join(pending)})." if pending else "."))
+    return touched
+
+
+def rebuild(history: Path = HISTORY_DIR, state_path: Path = STATE, series: Path = SERIES) -> List[str]:
+    """Recalcula agregados y meses vivos desde el histórico (la parte estática no se relee)."""
+    state = load_state(state_path, series)
+    state["months"] = {}
+    state["carried"] = {}
+    state["coverage"] = {}
+    write_series(state, series)
+    _save_state(state_path, state)
+    return update_monthly(calair_aggregates.rebuild(history), state_path, series)
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Serie mensual 2001-actual de calidad del aire")
+    ap.add_argument("cmd", choices=["rebuild"], help="rebuild: recalcula los meses vivos desde el histórico columnar")
+    ap.add_argument("--history", default=str(HISTORY_DIR), help="Directorio del histórico columnar")
+    args = ap.parse_args(argv)
+    rebuild(Path(args.history))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Content-addressed index of raw calair snapshots.
+
+Each run of ``fetch_calair.py`` records one line in
+``data/calair/snapshots.jsonl``::
+
+    {"ts": "...", "hash": "<contentMD5>", "blob": "2025-08-25/calair_tiemporeal_....json",
+     "bytes": 141243, "responseDate": "...", "duplicate": false}
+
+The first time a hash is seen its stamped JSON becomes the blob; later runs
+with the same hash only append a manifest line pointing at that blob and
+skip every downstream CSV/history step. ``snapshots.blobs.json`` maps each
+unique hash to its blob, so that check does not replay the manifest, which
+gains a line on every poll.
+
+``data/calair/last_good.json`` points at the flat CSV of the last run that
+produced rows (path, row count, sha256, first/last station-hour). When the
+feed is empty or unreachable the fallback reads it instead of scanning every
+day directory, and can say how stale the fallback data is.
+
+Usage (rebuild the manifest from the JSON files already on disk):
+    python scripts/calair_snapshots.py index
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+from zoneinfo import ZoneInfo
+
+from calair_archive import day_dirs, iter_day_members
+from calair_time import slot, slot_end
+
+CALAIR_DIR = Path("data/calair")
+MANIFEST = CALAIR_DIR / "snapshots.jsonl"
+LAST_GOOD = CALAIR_DIR / "last_good.json"
+MADRID = ZoneInfo("Europe/Madrid")
+
+_STAMPED_RE = re.compile(r"^calair_tiemporeal_(.+)\.json$")
+
+
+def snapshot_hash(payload: Any, raw: bytes) -> str:
+    """Usa el contentMD5 publicado por la API; si falta, md5 de los bytes."""
+    if isinstance(payload, dict):
+        md5 = str(payload.get("contentMD5") or "").strip().lower()
+        if re.fullmatch(r"[0-9a-f]{32}", md5):
+            return md5
+    return hashlib.md5(raw).hexdigest()
+
+
+def load_manifest(manifest: Path = MANIFEST) -> List[Dict[str, Any]]:
+    if not manifest.exists():
+        return []
+    out: List[Dict[str, Any]] = []
+    with manifest.open("r", encoding="utf-8") as f:
+        for ln in f:
+            ln = ln.strip()
+            if not ln:
+                continue
+            try:
+                out.append(json.loads(ln))
+            except json.JSONDecodeError:
+                continue  # línea truncada por un run interrumpido
+    return out
+
+
+def last_snapshot(manifest: Path = MANIFEST) -> Dict[str, Any] | None:
+    """Última entrada del manifiesto, leyendo solo la cola del fichero."""
+    try:
+        with manifest.open("rb") as f:
+            f.seek(max(0, f.seek(0, os.SEEK_END) - 4096))
+            tail = f.read()
+    except OSError:
+        return None
+    for ln in reversed(tail.splitlines()):
+        try:
+            entry = json.loads(ln)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue  # línea vacía, truncada o cortada por el seek
+        if isinstance(entry, dict) and entry.get("hash") and entry.get("blob"):
+            return entry
+    return None
+
+
+def load_blob_index(manifest: Path = MANIFEST) -> Dict[str, str]:
+    """hash -> blob (ruta relativa a data/calair) de la primera aparición, releyendo el manifiesto."""
+    index: Dict[str, str] = {}
+    for e in load_manifest(manifest):
+        h, blob = e.get("hash"), e.get("blob")
+        if h and blob and h not in index:
+            index[h] = blob
+    return index
+
+
+def _blobs_path(manifest: Path) -> Path:
+    return manifest.with_name(manifest.stem + ".blobs.json")
+
+
+def _write_blobs(manifest: Path, blobs: Dict[str, str]) -> None:
+    path = _blobs_path(manifest)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(blobs, sort_keys=True, indent=0), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _load_blobs(manifest: Path) -> Dict[str, str]:
+    """Índice hash -> blob (una entrada por snapshot único, no por sondeo).
+
+    Si falta o está dañado se reconstruye una vez desde el manifiesto.
+    """
+    try:
+        return json.loads(_blobs_path(manifest).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        blobs = load_blob_index(manifest)
+        if manifest.exists():
+            _write_blobs(manifest, blobs)
+        return blobs
+
+
+def lookup_blob(digest: str, manifest: Path = MANIFEST) -> str | None:
+    """Blob ya guardado para ``digest``, sin releer snapshots.jsonl."""
+    return _load_blobs(manifest).get(digest)
+
+
+def record_snapshot(
+    manifest: Path,
+    ts: str,
+    digest: str,
+    blob: str,
+    size: int,
+    response_date: str | None,
+    duplicate: bool,
+    sha256: str | None = None,
+) -> Dict[str, Any]:
+    entry = {
+        "ts": ts,
+        "hash": digest,
+        "blob": blob,
+        "bytes": size,
+        "responseDate": response_date,
+        "duplicate": duplicate,
+    }
+    if sha256:
+        entry["sha256"] = sha256  # del cuerpo HTTP: permite fiarse de un 304 sin parsear
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    if not duplicate:
+        blobs = _load_blobs(manifest)
+        if digest not in blobs:
+            blobs[digest] = blob
+            _write_blobs(manifest, blobs)
+    with manifest.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False, sort_keys=True) + "\n")
+    return entry
+
+
+def rebuild_manifest(base: Path = CALAIR_DIR, manifest: Path = MANIFEST) -> int:
+    """Reconstruye el manifiesto a partir de los JSON sellados (sueltos o archivados)."""
+    entries: List[Dict[str, Any]] = []
+    seen: Dict[str, str] = {}
+    snapshots = ((f"{d.name}/{name}", raw) for d in day_dirs(base) for name, raw in iter_day_members(d, "json"))
+    for rel, raw in snapshots:
+        m = _STAMPED_RE.match(rel.rpartition("/")[2])
+        if not m:
+            continue
+        try:
+            payload = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(payload, dict) or "error" in payload:
+            continue
+        digest = snapshot_hash(payload, raw)
+        entries.append({
+            "ts": m.group(1),
+            "hash": digest,
+            "blob": seen.setdefault(digest, rel),
+            "bytes": len(raw),
+            "responseDate": payload.get("responseDate"),
+            "duplicate": seen[digest] != rel,
+        })
+    entries.sort(key=lambda e: e["ts"])
+    tmp = manifest.with_suffix(".jsonl.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps(e, ensure_ascii=False, sort_keys=True) + "\n")
+    tmp.replace(manifest)
+    _write_blobs(manifest, seen)
+    dups = sum(1 for e in entries if e["duplicate"])
+    print(f"🧾 {manifest}: {len(entries)} snapshots, {len(seen)} únicos, {dups} duplicados.")
+    return len(entries)
+
+
+# ========= Último snapshot bueno (fallback O(1)) =========
+def _station_hour(r: Dict[str, Any]) -> tuple[int, int, int, int] | None:
+    try:
+        return int(r["ANO"]), int(r["MES"]), int(r["DIA"]), int(r["Hora"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _hour_entry(h: tuple[int, int, int, int] | None) -> Dict[str, Any] | None:
+    """date/hour y, del eje horario, utc = inicio del intervalo (None en el hueco de primavera)."""
+    if not h:
+        return None
+    s = slot(*h)
+    return {"date": f"{h[0]:04d}-{h[1]:02d}-{h[2]:02d}", "hour": h[3], "utc": s.utc if s else None}
+
+
+def write_last_good(flat_csv: Path, rows_flat: List[Dict[str, Any]], ts: str, path: Path = LAST_GOOD) -> Dict[str, Any]:
+    """Actualiza (atómicamente) el puntero al último CSV largo con filas."""
+    hours = [h for h in map(_station_hour, rows_flat) if h]
+    # La última hora "real" es la última validada (las horas futuras llegan como N)
+    valid = [h for r, h in zip(rows_flat, map(_station_hour, rows_flat)) if h and r.get("Validacion") == "V"]
+    first, last = (min(hours), max(valid or hours)) if hours else (None, None)
+    entry = {
+        "path": flat_csv.as_posix(),
+        "rows": len(rows_flat),
+        "sha256": hashlib.sha256(flat_csv.read_bytes()).hexdigest(),
+        "first": _hour_entry(first),
+        "last": _hour_entry(last),
+        "ts": ts,
+    }
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(entry, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+    return entry
+
+
+def read_last_good(path: Path = LAST_GOOD) -> Dict[str, Any] | None:
+    """Entrada de last_good.json si el fichero apuntado sigue existiendo y no está vacío."""
+    try:
+        entry = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+    target = Path(entry.get("path") or "")
+    if not entry.get("rows") or not target.is_file() or target.stat().st_size == 0:
+        return None
+    return entry
+
+
+def staleness_hours(entry: Dict[str, Any], now: datetime | None = None) -> float | None:
+    """Horas entre la última hora con dato (Hora = fin de intervalo, Madrid) y ahora."""
+    last = entry.get("last") or {}
+    try:
+        if last.get("utc"):
+            end = datetime.strptime(last["utc"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc) + timedelta(hours=1)
+        else:  # entradas escritas antes de guardar utc
+            end = slot_end(*last["date"].split("-"), last["hour"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if end is None:
+        return None
+    now = now or datetime.now(MADRID)
+    return round((now - end).total_seconds() / 3600, 1)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Índice content-addressed de snapshots calair")
+    ap.add_argument("cmd", choices=["index"], help="index: reconstruye snapshots.jsonl")
+    ap.add_argument("--base", default=str(CALAIR_DIR), help="Directorio data/calair")
+    args = ap.parse_args()
+    base = Path(args.base)
+    rebuild_manifest(base, base / MANIFEST.name)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Time axis for the H01..H24 slots of calair records.
+
+Slot ``Hora = h`` is the hour that starts at local (Europe/Madrid) wall
+time ``h-1:00``, so H01 is 00:00-01:00 and H24 is 23:00-24:00. ``day_axis``
+builds the 24 timestamps of a day once (cached) and converters index into
+it instead of building an aware ``datetime`` per cell.
+
+DST days:
+  - 23-hour day (last Sunday of March): wall time 02:00 does not exist, so
+    slot H03 has no timestamp (``None``). Building it naively would give
+    the same UTC instant as H04.
+  - 25-hour day (last Sunday of October): 02:00 happens twice and there are
+    still only 24 slots; H03 is the first 02:00 (CEST, +02:00).
+
+Every converter drops values in the non-existent slot (``in_gap``) instead
+of publishing them without a timestamp, warning once per day.
+"""
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+from zoneinfo import ZoneInfo
+
+MADRID = ZoneInfo("Europe/Madrid")
+
+
+class HourSlot(NamedTuple):
+    hora: int
+    local: str    # inicio del intervalo, ISO con offset (2025-09-10T00:00:00+02:00)
+    utc: str      # inicio del intervalo, ISO UTC (2025-09-09T22:00:00Z)
+    start: datetime  # aware, UTC
+
+
+@lru_cache(maxsize=512)
+def day_axis(year: int, month: int, day: int) -> Tuple[HourSlot | None, ...]:
+    """Los 24 slots del día; None donde la hora local no existe."""
+    out = []
+    for h in range(1, 25):
+        wall = datetime(year, month, day, h - 1, tzinfo=MADRID)
+        start = wall.astimezone(timezone.utc)
+        if start.astimezone(MADRID).replace(tzinfo=None) != wall.replace(tzinfo=None):
+            out.append(None)  # salto de primavera
+            continue
+        out.append(HourSlot(h, wall.isoformat(), start.strftime("%Y-%m-%dT%H:%M:%SZ"), start))
+    return tuple(out)
+
+
+def slot(year: int | str, month: int | str, day: int | str, hora: int | str) -> HourSlot | None:
+    """Slot de ANO/MES/DIA/Hora (acepta los strings del payload); None si no es válido."""
+    try:
+        h = int(hora)
+        if not 1 <= h <= 24:
+            return None
+        return day_axis(int(year), int(month), int(day))[h - 1]
+    except (TypeError, ValueError):
+        return None
+
+
+def slot_end(year: int | str, month: int | str, day: int | str, hora: int | str) -> datetime | None:
+    """Fin del intervalo (aware, UTC): el instante al que se refiere el dato."""
+    s = slot(year, month, day, hora)
+    return s.start + timedelta(hours=1) if s else None
+
+
+
+_GAP_WARNED: set = set()
+
+
+def in_gap(year: int | str, month: int | str, day: int | str, hora: int | str) -> bool:
+    """True si Hora cae en la hora local inexistente del día de 23 h (avisa una vez por día).
+
+    Fechas u horas no numéricas o fuera de rango dan False: no se descartan aquí.
+    """
+    try:
+        y, m, d, h = int(year), int(month), int(day), int(hora)
+        if not 1 <= h <= 24 or day_axis(y, m, d)[h - 1] is not None:
+            return False
+    except (TypeError, ValueError):
+        return False
+    if (y, m, d) not in _GAP_WARNED:
+        _GAP_WARNED.add((y, m, d))
+        print(f"⚠️ {y:04d}-{m:02d}-{d:02d} H{h:02d}: hora local inexistente (cambio de hora); se omiten sus valores.")
+    return True
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Shared engine for the ``calair_tiemporeal_ult`` → CSV converters.
+
+The ult payload carries several days of records. Instead of one download
+and one scan per day, the records are read once (all API pages, or a saved
+``--input`` JSON) and grouped by (ANO, MES, DIA) in a single pass; every
+requested day is then written to its own CSV partition.
+
+Day selection (Madrid calendar):
+    (default)               yesterday
+    --days N                the N days ending yesterday
+    --from YYYY-MM-DD [--to YYYY-MM-DD]   inclusive range (``--to`` defaults to yesterday)
+
+``--output`` may contain ``{Y}``, ``{M}`` and ``{D}``. Without them a single
+day goes to ``--output`` itself and several days go to
+``<dir>/<YYYY-MM-DD>/<name>``, like ``data/calair/<day>/``.
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+from calair_dynamicapi import ULT_URL, iter_records
+
+MADRID = ZoneInfo("Europe/Madrid")
+
+Day = Tuple[str, str, str]  # ("2025", "09", "14"), como ANO/MES/DIA del payload
+
+
+def ymd_madrid_minus_1() -> Day:
+    y = datetime.now(MADRID) - timedelta(days=1)
+    return f"{y:%Y}", f"{y:%m}", f"{y:%d}"
+
+
+def _as_day(d: date) -> Day:
+    return f"{d:%Y}", f"{d:%m}", f"{d:%d}"
+
+
+def record_day(r: Dict[str, Any]) -> Day:
+    return str(r.get("ANO", "")).zfill(4), str(r.get("MES", "")).zfill(2), str(r.get("DIA", "")).zfill(2)
+
+
+def add_day_arguments(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--input", help="Path to input JSON (if omitted, fetch every page from the API)")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--days", type=int, help="Write the N days ending yesterday (Europe/Madrid)")
+    g.add_argument("--from", dest="date_from", help="First day to write (YYYY-MM-DD)")
+    ap.add_argument("--to", dest="date_to", help="Last day to write (YYYY-MM-DD, with --from; default yesterday)")
+
+
+def check_day_arguments(ap: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Rechaza combinaciones que requested_days ignoraría en silencio."""
+    if args.date_to and not args.date_from:
+        ap.error("--to requires --from")
+    if args.days is not None and args.days < 1:
+        ap.error("--days must be at least 1")
+    for flag, value in (("--from", args.date_from), ("--to", args.date_to)):
+        if value:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                ap.error(f"{flag}: expected YYYY-MM-DD, got {value!r}")
+    if args.date_from and args.date_to and args.date_to < args.date_from:
+        ap.error("--to is before --from")
+
+
+def requested_days(args: argparse.Namespace) -> List[Day]:
+    yesterday = date(*map(int, ymd_madrid_minus_1()))
+    if args.days:
+        return [_as_day(yesterday - timedelta(days=i)) for i in range(args.days - 1, -1, -1)]
+    if args.date_from:
+        start = date.fromisoformat(args.date_from)
+        end = date.fromisoformat(args.date_to) if args.date_to else yesterday
+        return [_as_day(start + timedelta(days=i)) for i in range((end - start).days + 1)]
+    return [_as_day(yesterday)]
+
+
+def load_records(input_path: str | None) -> Iterable[Dict[str, Any]]:
+    if not input_path:
+        return iter_records(ULT_URL)
+    data = json.loads(Path(input_path).read_text(encoding="utf-8"))
+    recs = data.get("records") or []
+    total = data.get("totalRecords")
+    if isinstance(total, int) and total > len(recs):
+        print(f"⚠️ {input_path}: {len(recs)}/{total} records (single page); omit --input to fetch all pages")
+    return recs
+
+
+def group_by_day(records: Iterable[Dict[str, Any]], days: Sequence[Day]) -> Dict[Day, List[Dict[str, Any]]]:
+    """Una sola pasada: registros de los días pedidos, en el orden del payload."""
+    groups: Dict[Day, List[Dict[str, Any]]] = {d: [] for d in days}
+    for r in records:
+        bucket = groups.get(record_day(r))
+        if bucket is not None:
+            bucket.append(r)
+    return groups
+
+
+def partition_path(template: str, day: Day, several: bool) -> Path:
+    Y, M, D = day
+    if "{" in template:
+        return Path(template.format(Y=Y, M=M, D=D))
+    p = Path(template)
+    return p.parent / f"{Y}-{M}-{D}" / p.name if several else p
+
+
+def write_partitions(
+    args: argparse.Namespace,
+    headers: Sequence[str],
+    convert: Callable[[Dict[str, Any], Day], List[Dict[str, Any]]],
+    what: str = "rows",
+) -> int:
+    """Descarga (o lee) una vez, agrupa por día y escribe un CSV por día pedido."""
+    days = requested_days(args)
+    groups = group_by_day(load_records(args.input), days)
+    for day in days:
+        rows: List[Dict[str, Any]] = []
+        for r in groups[day]:
+            rows.extend(convert(r, day))
+        outp = partition_path(args.output, day, len(days) > 1)
+        outp.parent.mkdir(parents=True, exist_ok=True)
+        # temp + rename: outp puede ser un hardlink a un fichero sellado de fetch_calair
+        tmp = outp.with_name(outp.name + ".tmp")
+        with tmp.open("w", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=list(headers))
+            w.writeheader()
+            if rows:
+                w.writerows(rows)
+        os.replace(tmp, outp)
+        print(f"Wrote {len(rows)} {what} for {'-'.join(day)} to {outp}")
+    return 0
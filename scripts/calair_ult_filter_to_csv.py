@@ -1,26 +1,10 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 import argparse
-import csv
-import json
-from datetime import datetime, timedelta
-from pathlib import Path
 from typing import Any, Dict, List
-from urllib.request import Request, urlopen
-from zoneinfo import ZoneInfo
 
-URL = "https://ciudadesabiertas.madrid.es/dynamicAPI/API/query/calair_tiemporeal_ult.json?pageSize=5000"
-
-
-def http_get_json(url: str) -> Any:
-    req = Request(url, headers={"User-Agent": "datasets-calair/1.0"})
-    with urlopen(req, timeout=60) as resp:
-        return json.load(resp)
-
-
-def ymd_madrid_minus_1() -> tuple[str, str, str]:
-    y = datetime.now(ZoneInfo("Europe/Madrid")) - timedelta(days=1)
-    return f"{y:%Y}", f"{y:%m}", f"{y:%d}"
+from calair_time import in_gap
+from calair_ult import add_day_arguments, check_day_arguments, write_partitions
 
 
 HEADERS = [
@@ -53,7 +37,7 @@ def flatten_record(r: Dict[str, Any]) -> List[Dict[str, Any]]:
     for h in range(1, 25):
         hh = f"{h:02d}"
         val = r.get(f"H{hh}")
-        if val in (None, ""):
+        if val in (None, "") or in_gap(base["ANO"], base["MES"], base["DIA"], h):
             continue
         row = dict(base)
         row["Hora"] = h  # 1..24, without leading zero
@@ -64,33 +48,13 @@ def flatten_record(r: Dict[str, Any]) -> List[Dict[str, Any]]:
 
 
 def main() -> int:
-    ap = argparse.ArgumentParser(description="Filter calair_tiemporeal_ult to yesterday and write flattened CSV")
-    ap.add_argument("--input", help="Path to input JSON (if omitted, fetch from URL)")
-    ap.add_argument("--output", default="data/calair/latest.flat.csv", help="Output CSV path")
+    ap = argparse.ArgumentParser(description="Filter calair_tiemporeal_ult by day (default yesterday) and write flattened CSV")
+    add_day_arguments(ap)
+    ap.add_argument("--output", default="data/calair/latest.flat.csv",
+                    help="Output CSV path; may use {Y}/{M}/{D} when writing several days")
     args = ap.parse_args()
-
-    if args.input:
-        data = json.loads(Path(args.input).read_text(encoding="utf-8"))
-    else:
-        data = http_get_json(URL)
-
-    recs = data.get("records") or []
-    Y, M, D = ymd_madrid_minus_1()
-    filtered = [r for r in recs if r.get("ANO") == Y and r.get("MES") == M and r.get("DIA") == D]
-
-    rows: List[Dict[str, Any]] = []
-    for r in filtered:
-        rows.extend(flatten_record(r))
-
-    outp = Path(args.output)
-    outp.parent.mkdir(parents=True, exist_ok=True)
-    with outp.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=HEADERS)
-        w.writeheader()
-        if rows:
-            w.writerows(rows)
-    print(f"Wrote {len(rows)} flattened rows for {Y}-{M}-{D} to {outp}")
-    return 0
+    check_day_arguments(ap, args)
+    return write_partitions(args, HEADERS, lambda r, day: flatten_record(r), "flattened rows")
 
 
 if __name__ == "__main__":
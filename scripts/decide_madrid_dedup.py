@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Near-duplicate Decide Madrid proposals with MinHash + LSH.
+
+Each proposal's title+description is folded like the search index
+(decide_madrid_search.tokenize) and cut into word 3-shingles. A 128-value
+MinHash signature (multiply-shift hashes over crc32 shingle ids) estimates
+the Jaccard similarity of any two proposals. The signatures are split into
+16 bands of 8 rows and bucketed, so only proposals sharing a band are
+compared (similar from about 0.7 Jaccard). The cost is linear in the number
+of proposals instead of quadratic. Candidate pairs at or above --threshold
+(estimated Jaccard) are joined into clusters.
+
+Signatures are cached per id with the hash of the text they came from
+(``.cache/decide_dedup/signatures.bin``), so a nightly run only hashes new or
+changed proposals.
+
+Usage:
+    python scripts/decide_madrid_dedup.py decide-madrid/proposals_latest.csv --out decide-madrid/proposals_duplicates.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from decide_madrid_search import tokenize
+
+CACHE_DIR = '.cache/decide_dedup'
+NUM_PERM = 128
+BANDS, ROWS = 16, 8
+SHINGLE = 3
+THRESHOLD = 0.8
+MASK64 = (1 << 64) - 1
+_rng = random.Random(20250914)
+_A = [_rng.getrandbits(64) | 1 for _ in range(NUM_PERM)]
+_B = [_rng.getrandbits(64) for _ in range(NUM_PERM)]
+MAGIC = b'DMMH1\n'
+RECORD = struct.Struct(f'<Q8s{NUM_PERM}I')  # id, hash del texto, firma
+
+Signature = Tuple[int, ...]
+
+
+def shingles(title: str, description: str) -> set:
+    toks = tokenize(title) + tokenize(description)
+    if len(toks) < SHINGLE:
+        return {' '.join(toks)} if toks else set()
+    return {' '.join(toks[i:i + SHINGLE]) for i in range(len(toks) - SHINGLE + 1)}
+
+
+def minhash(items: set) -> Signature:
+    xs = [zlib.crc32(s.encode('utf-8')) for s in items]
+    return tuple(min(((a * x + b) & MASK64) >> 32 for x in xs) for a, b in zip(_A, _B))
+
+
+def similarity(s1: Signature, s2: Signature) -> float:
+    return sum(1 for x, y in zip(s1, s2) if x == y) / NUM_PERM
+
+
+def _text_hash(title: str, description: str) -> bytes:
+    return hashlib.blake2b(f'{title}\x1f{description}'.encode('utf-8'), digest_size=8).digest()
+
+
+def load_cache(cache_dir: str) -> Dict[int, Tuple[bytes, Signature]]:
+    try:
+        with open(os.path.join(cache_dir, 'signatures.bin'), 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return {}
+            return {rec[0]: (rec[1], tuple(rec[2:])) for rec in RECORD.iter_unpack(f.read())}
+    except (OSError, struct.error):
+        return {}
+
+
+def save_cache(cache_dir: str, sigs: Dict[int, Tuple[bytes, Signature]]) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, 'signatures.bin')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(b''.join(RECORD.pack(pid, h, *sig) for pid, (h, sig) in sorted(sigs.items())))
+    os.replace(path + '.tmp', path)
+
+
+class DedupStage:
+    """Pipeline stage: rows in (header -> value dicts), duplicate clusters out."""
+
+    def __init__(self, cache_dir: str = CACHE_DIR, threshold: float = THRESHOLD) -> None:
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.cached = load_cache(cache_dir)
+        self.sigs: Dict[int, Tuple[bytes, Signature]] = {}
+        self.hashed = 0
+
+    def add(self, row: Dict[str, str]) -> None:
+        pid = (row.get('id') or '').strip()
+        if not pid.isdigit():
+            return
+        title, description = row.get('title') or '', row.get('description') or ''
+        h = _text_hash(title, description)
+        old = self.cached.get(int(pid))
+        if old is not None and old[0] == h:
+            self.sigs[int(pid)] = old
+            return
+        items = shingles(title, description)
+        if items:
+            self.sigs[int(pid)] = (h, minhash(items))
+            self.hashed += 1
+
+    def clusters(self) -> List[Dict[str, Any]]:
+        buckets: Dict[Tuple[int, Signature], List[int]] = {}
+        for pid in sorted(self.sigs):
+            sig = self.sigs[pid][1]
+            for band in range(BANDS):
+                buckets.setdefault((band, sig[band * ROWS:(band + 1) * ROWS]), []).append(pid)
+        parent: Dict[int, int] = {}
+
+        def find(x: int) -> int:
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x])
+                x = parent[x]
+            return x
+
+        checked = set()
+        best: Dict[Tuple[int, int], float] = {}
+        for ids in buckets.values():
+            for i in range(len(ids)):
+                for j in range(i + 1, len(ids)):
+                    pair = (ids[i], ids[j])
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    s = similarity(self.sigs[pair[0]][1], self.sigs[pair[1]][1])
+                    if s >= self.threshold:
+                        best[pair] = s
+                        ra, rb = find(pair[0]), find(pair[1])
+                        if ra != rb:
+                            parent[max(ra, rb)] = min(ra, rb)
+        groups: Dict[int, set] = {}
+        lowest: Dict[int, float] = {}
+        for (a, b), s in best.items():
+            root = find(a)
+            groups.setdefault(root, set()).update((a, b))
+            lowest[root] = min(lowest.get(root, 1.0), s)
+        out = []
+        for root, members in groups.items():
+            out.append({'ids': sorted(members), 'size': len(members), 'min_similarity': round(lowest[root], 3)})
+        out.sort(key=lambda c: (-c['size'], c['ids'][0]))
+        return out
+
+    def finish(self, out_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Guarda la caché (solo ids vigentes) y escribe los clusters."""
+        save_cache(self.cache_dir, self.sigs)
+        clusters = self.clusters()
+        if out_path:
+            os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+            with open(out_path, 'w', encoding='utf-8') as f:
+                json.dump({'threshold': self.threshold, 'clusters': clusters}, f, ensure_ascii=False, indent=2)
+        print(f'Dedup: {len(self.sigs)} proposals, {self.hashed} hashed, {len(clusters)} duplicate clusters',
+              file=sys.stderr)
+        return clusters
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Near-duplicate proposals (MinHash/LSH)')
+    ap.add_argument('csv', help='Normalized proposals CSV')
+    ap.add_argument('--out', default=None, help='Path to write the clusters JSON')
+    ap.add_argument('--cache', default=CACHE_DIR, help='Signature cache directory')
+    ap.add_argument('--threshold', type=float, default=THRESHOLD, help='Estimated Jaccard to join two proposals')
+    args = ap.parse_args()
+
+    from decide_madrid_filter import iter_rows_flexible
+    from decide_madrid_text import open_text
+    stage = DedupStage(args.cache, args.threshold)
+    with open_text(args.csv) as f:
+        rows, _ = iter_rows_flexible(f)
+        for row in rows:
+            stage.add(row)
+    clusters = stage.finish(args.out)
+    if not args.out:
+        print(json.dumps(clusters, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
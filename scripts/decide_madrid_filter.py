@@ -1,24 +1,15 @@
 #!/usr/bin/env python3
 import argparse
 import csv
+import io
+import itertools
 import re
+import sys
 from datetime import datetime, date
-from typing import Optional, List
+from typing import Iterator, Optional, List
+
+from decide_madrid_text import open_text, used_encoding
 
-def _open_text_with_fallback(path: str):
-    encodings = ("utf-8", "utf-8-sig", "iso-8859-1", "cp1252")
-    last_err = None
-    for enc in encodings:
-        try:
-            f = open(path, mode='r', encoding=enc, newline='')
-            _ = f.read(4096)
-            f.seek(0)
-            return f
-        except UnicodeDecodeError as e:
-            last_err = e
-            continue
-    # Fallback with replacement
-    return open(path, mode='r', encoding='utf-8', errors='replace', newline='')
 
 def parse_args():
     ap = argparse.ArgumentParser(description='Filter Decide Madrid CSV by created_at date and drop columns')
@@ -51,90 +42,140 @@ def extract_date(value: str) -> Optional[date]:
     return None
 
 
-def _read_rows_flexible(inp_path: str) -> tuple[list[dict[str, str]], list[str]]:
-    """Read CSV handling BOM, optional sep= preamble, and , or ; delimiter.
-    Returns (rows, headers_original_case)
+SNIFF_CHUNK = 64 * 1024
+
+
+class _Semicolon(csv.excel):
+    delimiter = ';'
+
+
+def _strip_lines(lines: Iterator[str], quotechar: str) -> Iterator[str]:
+    """Strip each record line and drop blank ones, as the old line-based reader did.
+
+    Lines that continue a quoted multi-line field are passed through untouched.
     """
-    with _open_text_with_fallback(inp_path) as f_in:
-        text = f_in.read()
-    # Remove BOM if present and skip sep= lines
-    lines = [ln for ln in re.split(r'\r?\n', text) if ln]
-    cleaned: list[str] = []
+    inside = False
     for ln in lines:
-        ln_strip = ln.lstrip('\ufeff').strip()
-        if not ln_strip:
-            continue
-        if ln_strip.lower().startswith('sep='):
+        starts_inside = inside
+        if ln.count(quotechar) % 2:
+            inside = not inside
+        if inside:
+            yield ln if starts_inside else ln.lstrip()
             continue
-        cleaned.append(ln_strip)
-    if not cleaned:
-        return ([], [])
-    sample = '\n'.join(cleaned[:5])
-    try:
-        dialect = csv.Sniffer().sniff(sample, delimiters=',;')
-    except Exception:
-        dialect = csv.excel
-        dialect.delimiter = ';'
-    reader = csv.reader(cleaned, dialect)
-    headers = next(reader, [])
-    rows: list[dict[str, str]] = []
-    for arr in reader:
-        if len(arr) == 1 and arr[0] == '':
-            continue
-        row = {headers[i]: (arr[i] if i < len(arr) else '') for i in range(len(headers))}
-        rows.append(row)
-    return (rows, headers)
+        ln = ln.rstrip() if starts_inside else ln.strip()
+        if ln:
+            yield ln + '\n'
 
-def filter_csv(inp: str, out: str, drop: List[str], from_d: date, to_d: Optional[date], normalize: bool):
-    rows, headers = _read_rows_flexible(inp)
-    headers_lower = [h.lower() for h in headers]
-
-    def get(row: dict[str, str], candidates: list[str]) -> str:
-        for c in candidates:
-            # find original header matching this lowercase
-            for i, hl in enumerate(headers_lower):
-                if hl == c:
-                    return row.get(headers[i], '')
-        return ''
-
-    out_rows: list[dict[str, str]] = []
-    for row in rows:
-        # Flexible created_at lookup
-        created_raw = get(row, ['created_at', 'created at', 'date', 'fecha']) or row.get('created_at', '')
-        d = extract_date(created_raw)
-        if d is None:
-            continue
-        if d < from_d:
-            continue
-        if to_d is not None and d > to_d:
-            continue
 
-        if normalize:
-            norm = {
-                'id': get(row, ['id', 'identifier']),
-                'title': get(row, ['title', 'name', 'subject']),
-                'description': get(row, ['description', 'summary', 'body', 'text', 'content']),
-                'cached_votes_up': get(row, ['cached_votes_up', 'votes_up', 'cached_votes_score', 'votes']) or '0',
-                'created_at': created_raw,
-                'retired_at': get(row, ['retired_at', 'archived_at', 'retired at']),
-            }
-            if not norm['id']:
+def iter_rows_flexible(f_in) -> tuple[Iterator[dict[str, str]], list[str]]:
+    """Stream CSV rows handling BOM, optional sep= preamble, and , or ; delimiter.
+
+    Only the first chunk is held in memory (to sniff the delimiter); the rest is
+    fed to csv.reader straight from the file handle, so quoted multi-line
+    fields are kept intact. As before, record lines are stripped and blank
+    lines skipped. Returns (rows iterator, headers_original_case).
+    """
+    head = f_in.read(SNIFF_CHUNK)
+    if len(head) == SNIFF_CHUNK:
+        head += f_in.readline()  # complete the last physical line of the chunk
+    head = head.lstrip('\ufeff')
+    body = head.lstrip('\r\n')
+    first, _, rest = body.partition('\n')
+    dialect = None
+    if first.strip().lower().startswith('sep='):
+        sep = first.strip()[4:5]
+        if sep:
+            dialect = type('_Sep', (csv.excel,), {'delimiter': sep})
+        body = rest
+    if dialect is None:
+        sample = body[:body.rfind('\n')] if '\n' in body else body
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;')
+        except Exception:
+            dialect = _Semicolon
+    lines = itertools.chain(io.StringIO(body, newline=''), f_in)
+    reader = csv.reader(_strip_lines(lines, getattr(dialect, 'quotechar', None) or '"'), dialect)
+    headers = [h.strip() for h in next(reader, [])]
+
+    def rows() -> Iterator[dict[str, str]]:
+        for arr in reader:
+            if not arr or (len(arr) == 1 and arr[0] == ''):
                 continue
-            out_rows.append(norm)
-        else:
-            # Build output row sans dropped columns
-            out_rows.append({k: row.get(k, '') for k in headers if k not in drop})
-
-    with open(out, 'w', encoding='utf-8', newline='') as f_out:
-        if normalize:
-            writer = csv.writer(f_out, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL)
-            writer.writerow(['id','title','description','cached_votes_up','created_at','retired_at'])
-            for r in out_rows:
-                writer.writerow([r['id'], r['title'], r['description'], r['cached_votes_up'], r['created_at'], r['retired_at']])
-        else:
-            writer = csv.DictWriter(f_out, fieldnames=[h for h in headers if h not in drop])
-            writer.writeheader()
-            writer.writerows(out_rows)
+            yield {headers[i]: (arr[i] if i < len(arr) else '') for i in range(len(headers))}
+
+    return (rows(), headers)
+
+NORMALIZED_HEADER = ['id', 'title', 'description', 'cached_votes_up', 'created_at', 'retired_at']
+
+
+def filter_rows(f_in, drop: List[str], from_d: date, to_d: Optional[date],
+                normalize: bool) -> tuple[list[str], Iterator[list[str]]]:
+    """Stream the filtered (and optionally normalized) rows of an open input.
+
+    Returns (output header, iterator of output rows as lists).
+    """
+    rows, headers = iter_rows_flexible(f_in)
+    # Resolve the flexible column names once, not per row
+    lower_to_header: dict[str, str] = {}
+    for h in headers:
+        lower_to_header.setdefault(h.lower(), h)
+
+    def col(candidates: list[str]) -> Optional[str]:
+        return next((lower_to_header[c] for c in candidates if c in lower_to_header), None)
+
+    created_col = col(['created_at', 'created at', 'date', 'fecha'])
+    norm_cols = {
+        'id': col(['id', 'identifier']),
+        'title': col(['title', 'name', 'subject']),
+        'description': col(['description', 'summary', 'body', 'text', 'content']),
+        'cached_votes_up': col(['cached_votes_up', 'votes_up', 'cached_votes_score', 'votes']),
+        'retired_at': col(['retired_at', 'archived_at', 'retired at']),
+    }
+
+    def get(row: dict[str, str], name: str) -> str:
+        c = norm_cols[name]
+        return row.get(c, '') if c else ''
+
+    kept = [h for h in headers if h not in drop]
+
+    def out_rows() -> Iterator[list[str]]:
+        for row in rows:
+            # Flexible created_at lookup
+            created_raw = (row.get(created_col, '') if created_col else '') or row.get('created_at', '')
+            d = extract_date(created_raw)
+            if d is None:
+                continue
+            if d < from_d:
+                continue
+            if to_d is not None and d > to_d:
+                continue
+
+            if normalize:
+                rid = get(row, 'id')
+                if not rid:
+                    continue
+                yield [rid, get(row, 'title'), get(row, 'description'),
+                       get(row, 'cached_votes_up') or '0', created_raw, get(row, 'retired_at')]
+            else:
+                # Output row sans dropped columns
+                yield [row.get(k, '') for k in kept]
+
+    return (NORMALIZED_HEADER if normalize else kept, out_rows())
+
+
+def output_writer(f_out, normalize: bool):
+    if normalize:
+        return csv.writer(f_out, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL)
+    return csv.writer(f_out)
+
+
+def filter_csv(inp: str, out: str, drop: List[str], from_d: date, to_d: Optional[date], normalize: bool):
+    with open_text(inp) as f_in, open(out, 'w', encoding='utf-8', newline='') as f_out:
+        header, rows = filter_rows(f_in, drop, from_d, to_d, normalize)
+        writer = output_writer(f_out, normalize)
+        writer.writerow(header)
+        writer.writerows(rows)
+        print(f'Input encoding: {used_encoding(f_in)}', file=sys.stderr)
 
 def main():
     args = parse_args()
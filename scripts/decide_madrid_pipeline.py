@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Filter and summarize a Decide Madrid proposals dump in one pass.
+
+Equivalent to decide_madrid_filter.py followed by decide_madrid_summary.py,
+but the dump is read once: each row that survives the filter is written to
+the output CSV and folded into the summary metrics straight away. The
+previous day's count comes from the existing summary JSON (--prev-json) and
+id-level changes from the previous snapshot index (--prev-index), so neither
+the filtered CSV nor its git history is parsed again. With --votes-store the
+day's votes are appended to the vote time series in the same pass, and
+--search-index updates the full-text index and --dedup-out writes the
+near-duplicate clusters (both only hash new or changed proposals).
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from decide_madrid_dedup import CACHE_DIR as DEDUP_CACHE, DedupStage
+from decide_madrid_filter import filter_rows, output_writer
+from decide_madrid_search import SearchIndexUpdater
+from decide_madrid_snapshot import SnapshotBuilder, compare_with
+from decide_madrid_summary import CountsAccumulator, load_previous_summary, write_summary
+from decide_madrid_text import open_text, used_encoding
+from decide_madrid_votes import VotesCollector, append_day, today_madrid
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Filter Decide Madrid CSV and write its summary in a single pass')
+    ap.add_argument('--in', dest='inp', required=True, help='Input CSV path (raw dump)')
+    ap.add_argument('--out', dest='out', required=True, help='Filtered CSV path')
+    ap.add_argument('--drop-column', dest='drop', action='append', default=[], help='Columns to drop')
+    ap.add_argument('--from-date', dest='from_date', required=True, help='Inclusive lower bound (YYYY-MM-DD)')
+    ap.add_argument('--to-date', dest='to_date', default=None, help='Inclusive upper bound (YYYY-MM-DD)')
+    ap.add_argument('--normalize', dest='normalize', action='store_true', help='Normalize output to app schema (see decide_madrid_filter.py)')
+    ap.add_argument('--out-json', dest='out_json', default=None, help='Optional path to write JSON summary')
+    ap.add_argument('--out-md', dest='out_md', default=None, help='Optional path to write Markdown summary')
+    ap.add_argument('--prev-json', dest='prev_json', default=None, help='Previous summary JSON, for the day-over-day delta (read before --out-json is overwritten)')
+    ap.add_argument('--prev-index', dest='prev_index', default=None, help='Previous snapshot index, for added/removed/modified ids and vote deltas')
+    ap.add_argument('--out-index', dest='out_index', default=None, help='Optional path to write the snapshot index of the filtered rows')
+    ap.add_argument('--votes-store', dest='votes_store', default=None, help='Vote time series directory to append this snapshot to (decide_madrid_votes.py)')
+    ap.add_argument('--date', dest='date', default=None, help='Snapshot day for --votes-store (YYYY-MM-DD, default today in Europe/Madrid)')
+    ap.add_argument('--search-index', dest='search_index', default=None, help='Full-text index directory to update (decide_madrid_search.py; needs --normalize)')
+    ap.add_argument('--dedup-out', dest='dedup_out', default=None, help='Path to write near-duplicate clusters (decide_madrid_dedup.py; needs --normalize)')
+    ap.add_argument('--dedup-cache', dest='dedup_cache', default=DEDUP_CACHE, help='MinHash signature cache directory')
+    ap.add_argument('--source-file', dest='source_file', default=None, help='Name recorded as source_file in the summary (default: --out)')
+    return ap.parse_args()
+
+
+def run(args) -> dict:
+    from_d = datetime.strptime(args.from_date, '%Y-%m-%d').date()
+    to_d = datetime.strptime(args.to_date, '%Y-%m-%d').date() if args.to_date else None
+    prev = load_previous_summary(args.prev_json) if args.prev_json else None
+
+    acc = CountsAccumulator()
+    snapshot = SnapshotBuilder()
+    votes = VotesCollector()
+    search = SearchIndexUpdater(args.search_index) if args.search_index else None
+    dedup = DedupStage(args.dedup_cache) if args.dedup_out else None
+    with open_text(args.inp) as f_in, open(args.out, 'w', encoding='utf-8', newline='') as f_out:
+        header, rows = filter_rows(f_in, args.drop, from_d, to_d, args.normalize)
+        writer = output_writer(f_out, args.normalize)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            d = dict(zip(header, row))
+            acc.add(d)
+            snapshot.add(d)
+            votes.add(d)
+            if search is not None:
+                search.add(d)
+            if dedup is not None:
+                dedup.add(d)
+        print(f'Input encoding: {used_encoding(f_in)}', file=sys.stderr)
+
+    latest = acc.result()
+    changes = compare_with(args.prev_index, snapshot)
+    if args.out_index:
+        snapshot.write(args.out_index)
+    if search is not None:
+        changed, removed = search.commit()
+        print(f'{args.search_index}: {changed} proposals (re)indexed, {removed} removed', file=sys.stderr)
+    if dedup is not None:
+        dedup.finish(args.dedup_out)
+    if args.votes_store:
+        day = args.date or today_madrid()
+        n = append_day(args.votes_store, day, votes.entries)
+        print(f'{args.votes_store}: {day}, {n} vote rows appended', file=sys.stderr)
+    delta = None
+    if prev and isinstance(prev.get('proposals_count'), int):
+        delta = latest['proposals_count'] - prev['proposals_count']
+    elif changes is not None:
+        delta = changes['added'] - changes['removed']
+    write_summary(latest, delta, args.source_file or args.out, args.out_json, args.out_md, changes)
+    return latest
+
+
+def main():
+    args = parse_args()
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""On-disk inverted full-text index over Decide Madrid proposal titles/descriptions.
+
+Built from the normalized CSV (``decide_madrid_filter.py --normalize``)::
+
+    .cache/decide_search/
+        docs.json       # id -> [hash of title+description, token count, segment]
+        lexicon.N.json  # segment N: term -> [offset, bytes, postings] (sorted)
+        postings.N.bin  # segment N: per term, varint (id gap, term frequency) pairs
+
+Text is folded the Spanish way: HTML tags/entities removed, lower case,
+accents dropped (á→a, ü→u) but ñ kept, so "año" and "ano" stay apart.
+Tokens are runs of letters/digits; common Spanish stop words are skipped.
+
+``update`` tokenizes only proposals whose title/description hash is new or
+changed and writes their postings as a new segment, so an update costs
+O(changed proposals). docs.json is the commit point: it says which segment
+holds the live version of each id, and postings of removed or superseded
+versions are skipped on read. When an update would leave more than
+``MAX_SEGMENTS`` segments, all of them are merged into one and the dead
+postings are dropped.
+
+``query`` loads the segment lexicons, reads only the postings of the query
+terms (a trailing ``*`` expands a prefix) and ranks ids with BM25.
+
+Usage:
+    python scripts/decide_madrid_search.py update decide-madrid/proposals_latest.csv
+    python scripts/decide_madrid_search.py query "carril bici" [--all] [--top 20]
+"""
+import argparse
+import bisect
+import hashlib
+import html
+import json
+import math
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+INDEX_DIR = '.cache/decide_search'
+MAX_SEGMENTS = 8
+K1, B = 1.2, 0.75
+TOKEN_RE = re.compile(r'[0-9a-zñ]+')
+TAG_RE = re.compile(r'<[^>]*>')
+STOPWORDS = frozenset('''
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el ella ellas
+ellos en entre era es esa esas ese eso esos esta estan estas este esto estos ha hay la las le les lo los mas
+me mi muy nada ni no nos o os otra otro para pero poco por porque que quien se ser si sin sobre son su sus
+tambien te tiene tienen todo todos tu u un una unas uno unos y ya
+'''.split())
+
+
+# ========= Texto =========
+def fold(text: str) -> str:
+    """Minúsculas sin acentos, conservando la ñ."""
+    text = unicodedata.normalize('NFC', html.unescape(TAG_RE.sub(' ', text))).lower().replace('ñ', '\0')
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return text.replace('\0', 'ñ')
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(fold(text)) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _doc_hash(title: str, description: str) -> str:
+    return hashlib.blake2b(f'{title}\x1f{description}'.encode('utf-8'), digest_size=8).hexdigest()
+
+
+# ========= Postings (varint, ids en huecos) =========
+def encode_postings(postings: List[Tuple[int, int]]) -> bytes:
+    out = bytearray()
+    last = 0
+    for doc, tf in postings:
+        for v in (doc - last, tf):
+            while v >= 0x80:
+                out.append((v & 0x7F) | 0x80)
+                v >>= 7
+            out.append(v)
+        last = doc
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> List[Tuple[int, int]]:
+    vals: List[int] = []
+    v = shift = 0
+    for b in data:
+        v |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            vals.append(v)
+            v = shift = 0
+    out = []
+    doc = 0
+    for i in range(0, len(vals), 2):
+        doc += vals[i]
+        out.append((doc, vals[i + 1]))
+    return out
+
+
+# ========= Índice =========
+def _load_json(path: str, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path: str, data) -> None:
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _segment_paths(index_dir: str, seg: int) -> Tuple[str, str]:
+    """(postings, lexicon) de un segmento; el 0 conserva los nombres del índice sin segmentos."""
+    if not seg:
+        return os.path.join(index_dir, 'postings.bin'), os.path.join(index_dir, 'lexicon.json')
+    return os.path.join(index_dir, f'postings.{seg}.bin'), os.path.join(index_dir, f'lexicon.{seg}.json')
+
+
+def _doc_segment(entry: List) -> int:
+    return entry[2] if len(entry) > 2 else 0
+
+
+def _live_postings(f, entry: List[int], docs: Dict[str, List], seg: int) -> List[Tuple[int, int]]:
+    """Postings de un término en un segmento, solo de ids cuya versión viva está en ese segmento."""
+    off, n, _ = entry
+    f.seek(off)
+    out = []
+    for doc, tf in decode_postings(f.read(n)):
+        d = docs.get(str(doc))
+        if d is not None and _doc_segment(d) == seg:
+            out.append((doc, tf))
+    return out
+
+
+def _write_segment(index_dir: str, seg: int, terms: Dict[str, List[Tuple[int, int]]]) -> None:
+    path, lex_path = _segment_paths(index_dir, seg)
+    lexicon: Dict[str, List[int]] = {}
+    with open(path + '.tmp', 'wb') as f:
+        for term in sorted(terms):
+            postings = sorted(terms[term])
+            data = encode_postings(postings)
+            lexicon[term] = [f.tell(), len(data), len(postings)]
+            f.write(data)
+    os.replace(path + '.tmp', path)
+    _write_json(lex_path, lexicon)
+
+
+def _remove_segment(index_dir: str, seg: int) -> None:
+    for path in _segment_paths(index_dir, seg):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _segments_on_disk(index_dir: str) -> List[int]:
+    segs = []
+    for name in os.listdir(index_dir):
+        if name == 'postings.bin':
+            segs.append(0)
+        elif name.startswith('postings.') and name.endswith('.bin') and name[9:-4].isdigit():
+            segs.append(int(name[9:-4]))
+    return segs
+
+
+class SearchIndexUpdater:
+    """Incremental update fed with normalized rows (header -> value dicts)."""
+
+    def __init__(self, index_dir: str = INDEX_DIR) -> None:
+        self.dir = index_dir
+        self.docs: Dict[str, List] = _load_json(os.path.join(index_dir, 'docs.json'), {})
+        self.seen: set = set()
+        self.changed: Dict[int, Counter] = {}
+
+    def add(self, row: Dict[str, str]) -> None:
+        pid = (row.get('id') or '').strip()
+        if not pid.isdigit() or pid in self.seen:
+            return
+        self.seen.add(pid)
+        title, description = row.get('title') or '', row.get('description') or ''
+        h = _doc_hash(title, description)
+        old = self.docs.get(pid)
+        if old is not None and old[0] == h:
+            return
+        tf = Counter(tokenize(title) + tokenize(description))
+        self.changed[int(pid)] = tf
+        self.docs[pid] = [h, sum(tf.values())]
+
+    def commit(self) -> Tuple[int, int]:
+        """Escribe el índice; devuelve (propuestas reindexadas, eliminadas).
+
+        Los cambios van a un segmento nuevo; al superar MAX_SEGMENTS se
+        fusiona todo en uno (coste O(índice), amortizado entre updates).
+        """
+        removed = {p for p in self.docs if p not in self.seen}
+        if not self.changed and not removed:
+            return (0, 0)
+        for p in removed:
+            del self.docs[p]
+        os.makedirs(self.dir, exist_ok=True)
+        old = {_doc_segment(d) for p, d in self.docs.items() if int(p) not in self.changed}
+        seg = max(old | set(_segments_on_disk(self.dir)), default=-1) + 1  # nunca se pisa un segmento
+        terms: Dict[str, List[Tuple[int, int]]] = {}
+        if len(old) >= MAX_SEGMENTS:
+            # Fusión: postings vivos de todos los segmentos + los cambios, en uno nuevo
+            for s in sorted(old):
+                path, lex_path = _segment_paths(self.dir, s)
+                with open(path, 'rb') as f:
+                    for term, entry in _load_json(lex_path, {}).items():
+                        kept = [p for p in _live_postings(f, entry, self.docs, s) if p[0] not in self.changed]
+                        if kept:
+                            terms.setdefault(term, []).extend(kept)
+            for d in self.docs.values():
+                d[2:] = [seg]
+        for doc in sorted(self.changed):
+            self.docs[str(doc)][2:] = [seg]
+            for term, tf in self.changed[doc].items():
+                terms.setdefault(term, []).append((doc, tf))
+        if terms:
+            _write_segment(self.dir, seg, terms)
+        _write_json(os.path.join(self.dir, 'docs.json'), self.docs)
+        # Segmentos sin ninguna versión viva (fusionados o de runs interrumpidos)
+        live = {_doc_segment(d) for d in self.docs.values()}
+        for s in _segments_on_disk(self.dir):
+            if s not in live:
+                _remove_segment(self.dir, s)
+        return (len(self.changed), len(removed))
+
+
+def query(q: str, index_dir: str = INDEX_DIR, top: int = 20, require_all: bool = False) -> List[Tuple[int, float]]:
+    """Ids ordenados por BM25; ``term*`` busca por prefijo."""
+    docs = _load_json(os.path.join(index_dir, 'docs.json'), {})
+    if not docs:
+        return []
+    segs = sorted({_doc_segment(d) for d in docs.values()})
+    lexicons = {s: _load_json(_segment_paths(index_dir, s)[1], {}) for s in segs}
+    n_docs = len(docs)
+    avgdl = sum(d[1] for d in docs.values()) / n_docs or 1.0
+    sorted_terms: Optional[List[str]] = None
+    groups: List[List[str]] = []  # un grupo por palabra de la consulta (prefijo -> varios términos)
+    for raw in q.split():
+        prefix = raw.endswith('*')
+        toks = tokenize(raw.rstrip('*'))
+        if not toks:
+            continue
+        for i, t in enumerate(toks):
+            if prefix and i == len(toks) - 1:
+                if sorted_terms is None:
+                    sorted_terms = sorted(set().union(*lexicons.values()))
+                lo = bisect.bisect_left(sorted_terms, t)
+                hi = bisect.bisect_left(sorted_terms, t + '\uffff')
+                groups.append(sorted_terms[lo:hi])
+            else:
+                groups.append([t] if any(t in lex for lex in lexicons.values()) else [])
+    scores: Dict[int, float] = {}
+    matched: Dict[int, int] = {}
+    files = {s: open(_segment_paths(index_dir, s)[0], 'rb') for s in segs if lexicons[s]}
+    try:
+        for group in groups:
+            hit = set()
+            for term in group:
+                postings = [
+                    p for s, f in files.items() if term in lexicons[s]
+                    for p in _live_postings(f, lexicons[s][term], docs, s)
+                ]
+                df = len(postings)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc, tf in postings:
+                    dl = docs[str(doc)][1]
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / avgdl))
+                    hit.add(doc)
+            for doc in hit:
+                matched[doc] = matched.get(doc, 0) + 1
+    finally:
+        for f in files.values():
+            f.close()
+    if require_all:
+        scores = {d: s for d, s in scores.items() if matched[d] == len(groups)}
+    return sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:top]
+
+
+def update_from_csv(path: str, index_dir: str = INDEX_DIR) -> Tuple[int, int]:
+    from decide_madrid_filter import iter_rows_flexible
+    from decide_madrid_text import open_text
+    updater = SearchIndexUpdater(index_dir)
+    with open_text(path) as f:
+        rows, _ = iter_rows_flexible(f)
+        for row in rows:
+            updater.add(row)
+    return updater.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Full-text index over Decide Madrid proposals')
+    ap.add_argument('--index', default=INDEX_DIR, help='Index directory')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    u = sub.add_parser('update', help='Index new/changed proposals of a normalized CSV')
+    u.add_argument('csv')
+    qp = sub.add_parser('query', help='Ranked proposal ids for a query')
+    qp.add_argument('q')
+    qp.add_argument('--top', type=int, default=20)
+    qp.add_argument('--all', dest='require_all', action='store_true', help='Require every query word')
+    args = ap.parse_args()
+
+    if args.cmd == 'update':
+        t = time.perf_counter()
+        changed, removed = update_from_csv(args.csv, args.index)
+        print(f'{args.index}: {changed} proposals (re)indexed, {removed} removed in {time.perf_counter() - t:.2f}s')
+    else:
+        t = time.perf_counter()
+        hits = query(args.q, args.index, args.top, args.require_all)
+        for doc, score in hits:
+            print(f'{doc}\t{score:.3f}')
+        print(f'{len(hits)} results in {(time.perf_counter() - t) * 1000:.1f} ms', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Sidecar snapshot index for Decide Madrid proposals.
+
+One fixed-width record per proposal, sorted by numeric id:
+(id, 64-bit row hash, cached_votes_up). The file is written next to
+``proposals_latest.csv`` on every run. Two indexes are compared with a
+single merge pass, which gives added / removed / modified ids and vote deltas
+without ``git show`` or re-parsing the previous CSV. That also works in shallow
+``fetch-depth: 1`` checkouts.
+
+Usage:
+    python scripts/decide_madrid_snapshot.py build decide-madrid/proposals_latest.csv decide-madrid/proposals_snapshot.idx
+    python scripts/decide_madrid_snapshot.py diff OLD.idx NEW.idx
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import struct
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'DMSNAP1\n'
+RECORD = struct.Struct('<QQq')  # id, row hash, cached_votes_up
+READ_RECORDS = 4096
+TOP_MOVERS = 10
+
+Entry = Tuple[int, int, int]
+
+
+def row_hash(values) -> int:
+    h = hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=8)
+    return int.from_bytes(h.digest(), 'little')
+
+
+def _votes(value: Optional[str]) -> int:
+    try:
+        return int(float((value or '').strip() or 0))
+    except ValueError:
+        return 0
+
+
+class SnapshotBuilder:
+    """Collects (id, hash, votes) per row; rows are header -> value dicts in file order."""
+
+    def __init__(self) -> None:
+        self.entries: Dict[int, Tuple[int, int]] = {}
+        self.skipped = 0
+
+    def add(self, row: Dict[str, str]) -> None:
+        pid = (row.get('id') or '').strip()
+        if not pid.isdigit():
+            self.skipped += 1
+            return
+        self.entries[int(pid)] = (row_hash(row.values()), _votes(row.get('cached_votes_up')))
+
+    def write(self, path: str) -> int:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(b''.join(RECORD.pack(pid, h, v) for pid, (h, v) in sorted(self.entries.items())))
+        os.replace(tmp, path)
+        if self.skipped:
+            print(f'{path}: {self.skipped} rows without a numeric id left out', file=sys.stderr)
+        return len(self.entries)
+
+
+def read_snapshot(path: str) -> Iterator[Entry]:
+    """Stream the records of an index file, in id order."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path}: not a proposals snapshot index')
+        while True:
+            chunk = f.read(RECORD.size * READ_RECORDS)
+            if not chunk:
+                return
+            yield from RECORD.iter_unpack(chunk)
+
+
+def diff_snapshots(old: Iterator[Entry], new: Iterator[Entry]) -> Dict[str, Any]:
+    """Merge two id-sorted indexes in one pass."""
+    added = removed = modified = unchanged = 0
+    votes_delta = 0
+    movers: List[Tuple[int, int]] = []  # (delta, id), min-heap of the largest risers
+    o, n = next(old, None), next(new, None)
+    while o is not None or n is not None:
+        if n is None or (o is not None and o[0] < n[0]):
+            removed += 1
+            o = next(old, None)
+        elif o is None or n[0] < o[0]:
+            added += 1
+            n = next(new, None)
+        else:
+            if o[1] == n[1]:
+                unchanged += 1
+            else:
+                modified += 1
+            d = n[2] - o[2]
+            votes_delta += d
+            if d > 0:
+                if len(movers) < TOP_MOVERS:
+                    heapq.heappush(movers, (d, -n[0]))
+                else:
+                    heapq.heappushpop(movers, (d, -n[0]))
+            o, n = next(old, None), next(new, None)
+    return {
+        'added': added,
+        'removed': removed,
+        'modified': modified,
+        'unchanged': unchanged,
+        'cached_votes_up_delta_common': votes_delta,
+        'top_vote_gains': [{'id': -neg_id, 'cached_votes_up_delta': d} for d, neg_id in sorted(movers, reverse=True)],
+    }
+
+
+def compare_with(prev_path: Optional[str], builder: SnapshotBuilder) -> Optional[Dict[str, Any]]:
+    """Diff a freshly built snapshot against a previous index file, if there is one."""
+    if not prev_path or not os.path.exists(prev_path):
+        return None
+    current = iter([(pid, h, v) for pid, (h, v) in sorted(builder.entries.items())])
+    return diff_snapshots(read_snapshot(prev_path), current)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Proposal snapshot index (id -> row hash, cached_votes_up)')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    b = sub.add_parser('build', help='Build the index of a proposals CSV')
+    b.add_argument('csv')
+    b.add_argument('index')
+    d = sub.add_parser('diff', help='Compare two indexes')
+    d.add_argument('old')
+    d.add_argument('new')
+    args = ap.parse_args()
+
+    if args.cmd == 'build':
+        from decide_madrid_filter import iter_rows_flexible
+        from decide_madrid_text import open_text
+        builder = SnapshotBuilder()
+        with open_text(args.csv) as f:
+            rows, _ = iter_rows_flexible(f)
+            for row in rows:
+                builder.add(row)
+        print(f'{args.index}: {builder.write(args.index)} proposals')
+    else:
+        print(json.dumps(diff_snapshots(read_snapshot(args.old), read_snapshot(args.new)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
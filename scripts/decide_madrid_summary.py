@@ -5,7 +5,12 @@ import io
 import json
 import os
 import subprocess
-from typing import Optional, Dict, Any, Tuple
+import sys
+from typing import Optional, Dict, Any
+
+from decide_madrid_filter import iter_rows_flexible
+from decide_madrid_snapshot import SnapshotBuilder, compare_with
+from decide_madrid_text import open_text, used_encoding
 
 
 def parse_float(value: str) -> Optional[float]:
@@ -35,74 +40,65 @@ def count_retired(row: Dict[str, str]) -> int:
     return 0
 
 
-def _open_text_with_fallback(path: str) -> Tuple[io.TextIOBase, str]:
-    encodings = ("utf-8", "utf-8-sig", "iso-8859-1", "cp1252")
-    last_err: Optional[Exception] = None
-    for enc in encodings:
-        try:
-            f = open(path, mode='r', encoding=enc, newline='')
-            # Touch-read a bit to trigger decoding issues early
-            _ = f.read(4096)
-            f.seek(0)
-            return f, enc
-        except UnicodeDecodeError as e:
-            last_err = e
-            continue
-    # Fallback to binary with replacement to avoid hard crash
-    if last_err is not None:
-        f = open(path, mode='r', encoding='utf-8', errors='replace', newline='')
-        return f, 'utf-8-replace'
-    # Should not reach here
-    return open(path, mode='r', encoding='utf-8', newline=''), 'utf-8'
-
-
-def load_csv_counts(path: str) -> Dict[str, Any]:
-    total_rows = 0
-    sum_conf = 0.0
-    cnt_conf = 0
-    sum_up = 0
-    cnt_up = 0
-    sum_votes_total = 0
-    cnt_votes_total = 0
-    retired = 0
-
-    f, used_enc = _open_text_with_fallback(path)
-    with f:
-        reader = csv.DictReader(f)
-        # Normalize headers to handle case differences
-        reader.fieldnames = [h.strip() if h else h for h in (reader.fieldnames or [])]
-        for row in reader:
-            total_rows += 1
-
-            # confidence_score
-            cs = parse_float(row.get('confidence_score')) if 'confidence_score' in row else None
-            if cs is not None:
-                sum_conf += cs
-                cnt_conf += 1
-
-            # cached_votes_up
-            up = parse_int(row.get('cached_votes_up')) if 'cached_votes_up' in row else None
-            if up is not None:
-                sum_up += up
-                cnt_up += 1
-
-            # cached_votes_total if present
-            vt = parse_int(row.get('cached_votes_total')) if 'cached_votes_total' in row else None
-            if vt is not None:
-                sum_votes_total += vt
-                cnt_votes_total += 1
-
-            retired += count_retired(row)
-
-    return {
-        'proposals_count': total_rows,
-        'confidence_score_mean': (sum_conf / cnt_conf) if cnt_conf else None,
-        'cached_votes_up_sum': sum_up,
-        'cached_votes_up_mean': (sum_up / cnt_up) if cnt_up else None,
-        'cached_votes_total_sum': sum_votes_total if cnt_votes_total else None,
-        'cached_votes_total_mean': (sum_votes_total / cnt_votes_total) if cnt_votes_total else None,
-        'retired_count': retired,
-    }
+class CountsAccumulator:
+    """Summary metrics folded one row at a time (rows as header -> value dicts)."""
+
+    def __init__(self) -> None:
+        self.total_rows = 0
+        self.sum_conf = 0.0
+        self.cnt_conf = 0
+        self.sum_up = 0
+        self.cnt_up = 0
+        self.sum_votes_total = 0
+        self.cnt_votes_total = 0
+        self.retired = 0
+
+    def add(self, row: Dict[str, str]) -> None:
+        self.total_rows += 1
+
+        # confidence_score
+        cs = parse_float(row.get('confidence_score')) if 'confidence_score' in row else None
+        if cs is not None:
+            self.sum_conf += cs
+            self.cnt_conf += 1
+
+        # cached_votes_up
+        up = parse_int(row.get('cached_votes_up')) if 'cached_votes_up' in row else None
+        if up is not None:
+            self.sum_up += up
+            self.cnt_up += 1
+
+        # cached_votes_total if present
+        vt = parse_int(row.get('cached_votes_total')) if 'cached_votes_total' in row else None
+        if vt is not None:
+            self.sum_votes_total += vt
+            self.cnt_votes_total += 1
+
+        self.retired += count_retired(row)
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            'proposals_count': self.total_rows,
+            'confidence_score_mean': (self.sum_conf / self.cnt_conf) if self.cnt_conf else None,
+            'cached_votes_up_sum': self.sum_up,
+            'cached_votes_up_mean': (self.sum_up / self.cnt_up) if self.cnt_up else None,
+            'cached_votes_total_sum': self.sum_votes_total if self.cnt_votes_total else None,
+            'cached_votes_total_mean': (self.sum_votes_total / self.cnt_votes_total) if self.cnt_votes_total else None,
+            'retired_count': self.retired,
+        }
+
+
+def load_csv_counts(path: str, snapshot: Optional[SnapshotBuilder] = None) -> Dict[str, Any]:
+    acc = CountsAccumulator()
+    with open_text(path) as f:
+        # Same reader as the filter: BOM, sep= preamble and , or ; delimiter
+        rows, _ = iter_rows_flexible(f)
+        for row in rows:
+            acc.add(row)
+            if snapshot is not None:
+                snapshot.add(row)
+        print(f'{path}: encoding {used_encoding(f)}', file=sys.stderr)
+    return acc.result()
 
 
 def load_previous_from_git(path_in_repo: str) -> Optional[Dict[str, Any]]:
@@ -122,7 +118,16 @@ def load_previous_from_git(path_in_repo: str) -> Optional[Dict[str, Any]]:
     return {'proposals_count': total_rows}
 
 
-def build_markdown(latest: Dict[str, Any], delta: Optional[int]) -> str:
+def load_previous_summary(path: str) -> Optional[Dict[str, Any]]:
+    """Metrics of a previously written summary JSON (no CSV re-parse)."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f).get('metrics')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def build_markdown(latest: Dict[str, Any], delta: Optional[int], changes: Optional[Dict[str, Any]] = None) -> str:
     lines = []
     lines.append('# Decide Madrid – Proposals summary')
     lines.append('')
@@ -145,24 +150,68 @@ def build_markdown(latest: Dict[str, Any], delta: Optional[int]) -> str:
         lines.append('- Mean confidence_score: {:.6f}'.format(latest['confidence_score_mean']))
 
     lines.append('- Retired count: {}'.format(int(latest['retired_count'])))
+
+    if changes is not None:
+        lines.append('')
+        lines.append('## Changes vs previous snapshot')
+        lines.append('')
+        lines.append('- Added: {added}, removed: {removed}, modified: {modified}'.format(**changes))
+        lines.append('- Net cached_votes_up on proposals present both days: {:+d}'.format(changes['cached_votes_up_delta_common']))
+        for m in changes['top_vote_gains']:
+            lines.append('  - {}: {:+d}'.format(m['id'], m['cached_votes_up_delta']))
     lines.append('')
     return "\n".join(lines)
 
 
+def write_summary(latest: Dict[str, Any], delta: Optional[int], source_file: str,
+                  out_json: Optional[str], out_md: Optional[str],
+                  changes: Optional[Dict[str, Any]] = None) -> str:
+    result = {
+        'metrics': latest,
+        'delta_vs_previous_day': delta,
+        'source_file': source_file,
+    }
+    if changes is not None:
+        result['changes_vs_previous'] = changes
+
+    if out_json:
+        os.makedirs(os.path.dirname(out_json) or '.', exist_ok=True)
+        with open(out_json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    md = build_markdown(latest, delta, changes)
+    if out_md:
+        os.makedirs(os.path.dirname(out_md) or '.', exist_ok=True)
+        with open(out_md, 'w', encoding='utf-8') as f:
+            f.write(md)
+
+    # Also print to stdout for CI logs
+    print(md)
+    return md
+
+
 def main():
     ap = argparse.ArgumentParser(description='Summarize Decide Madrid proposals CSV')
     ap.add_argument('--in', dest='inp', default='decide-madrid/proposals_latest.csv', help='Path to latest CSV')
     ap.add_argument('--prev', dest='prev', default=None, help='Optional path to previous-day CSV')
     ap.add_argument('--compare-git', action='store_true', help='Compare proposals count against previous commit version')
+    ap.add_argument('--prev-index', dest='prev_index', default=None, help='Previous snapshot index (decide_madrid_snapshot.py): added/removed/modified ids and vote deltas, no git needed')
+    ap.add_argument('--out-index', dest='out_index', default=None, help='Optional path to write the snapshot index of --in')
     ap.add_argument('--out-json', dest='out_json', default=None, help='Optional path to write JSON summary')
     ap.add_argument('--out-md', dest='out_md', default=None, help='Optional path to write Markdown summary')
     args = ap.parse_args()
 
-    latest = load_csv_counts(args.inp)
+    snapshot = SnapshotBuilder() if (args.prev_index or args.out_index) else None
+    latest = load_csv_counts(args.inp, snapshot)
+    changes = compare_with(args.prev_index, snapshot) if snapshot is not None else None
+    if args.out_index:
+        snapshot.write(args.out_index)
 
     delta = None
     prev_counts = None
-    if args.prev and os.path.exists(args.prev):
+    if changes is not None:
+        delta = changes['added'] - changes['removed']
+    elif args.prev and os.path.exists(args.prev):
         prev_counts = load_csv_counts(args.prev)
     elif args.compare_git:
         # Path relative to repo root
@@ -172,25 +221,7 @@ def main():
     if prev_counts and 'proposals_count' in prev_counts:
         delta = latest['proposals_count'] - prev_counts['proposals_count']
 
-    result = {
-        'metrics': latest,
-        'delta_vs_previous_day': delta,
-        'source_file': args.inp,
-    }
-
-    if args.out_json:
-        os.makedirs(os.path.dirname(args.out_json), exist_ok=True)
-        with open(args.out_json, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-
-    md = build_markdown(latest, delta)
-    if args.out_md:
-        os.makedirs(os.path.dirname(args.out_md), exist_ok=True)
-        with open(args.out_md, 'w', encoding='utf-8') as f:
-            f.write(md)
-
-    # Also print to stdout for CI logs
-    print(md)
+    write_summary(latest, delta, args.inp, args.out_json, args.out_md, changes)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Single-pass encoding detection for the Decide Madrid CSV exports.
+
+The file is read from disk exactly once, in chunks. Bytes are decoded as
+UTF-8 (a BOM is dropped and reported as utf-8-sig) until the first invalid
+sequence, wherever it appears. At that point the decoder switches codec
+without rereading anything:
+
+- if everything before was ASCII, the file is treated as cp1252 from there
+  on (identical to latin-1 for Spanish letters, plus the Windows € and
+  curly quotes);
+- if valid non-ASCII UTF-8 was already seen, the file is mixed: decoding
+  stays UTF-8 and only each invalid sequence is read as cp1252.
+
+``open_text`` returns a regular text stream (newline='' semantics, so
+csv.reader gets proper lines) and ``used_encoding`` reports the decision
+once the stream has been read.
+"""
+import codecs
+import io
+from typing import Optional
+
+CHUNK = 1 << 20
+FALLBACK = 'cp1252'
+MIXED_ERRORS = 'decide-cp1252-fallback'
+
+
+def _cp1252_sequence(exc: UnicodeError):
+    if not isinstance(exc, UnicodeDecodeError):
+        raise exc
+    return exc.object[exc.start:exc.end].decode(FALLBACK, errors='replace'), exc.end
+
+
+codecs.register_error(MIXED_ERRORS, _cp1252_sequence)
+
+
+class DetectingReader(io.RawIOBase):
+    """Raw binary stream: source bytes in any supported encoding, UTF-8 out."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._decoder = codecs.getincrementaldecoder('utf-8')('strict')
+        self._started = False
+        self._utf8_non_ascii = False
+        self._out = b''
+        self._eof = False
+        self.encoding = 'utf-8'
+
+    def readable(self) -> bool:
+        return True
+
+    def _switch(self, buf: bytes, exc: UnicodeDecodeError, final: bool) -> str:
+        head = buf[:exc.start].decode('utf-8')
+        if self._utf8_non_ascii or not buf[:exc.start].isascii():
+            self.encoding = 'utf-8+' + FALLBACK
+            self._decoder = codecs.getincrementaldecoder('utf-8')(MIXED_ERRORS)
+        else:
+            self.encoding = FALLBACK
+            self._decoder = codecs.getincrementaldecoder(FALLBACK)('replace')
+        return head + self._decoder.decode(buf[exc.start:], final)
+
+    def _decode(self, data: bytes, final: bool) -> str:
+        if not self._started:
+            self._started = True
+            if data.startswith(codecs.BOM_UTF8):
+                data = data[len(codecs.BOM_UTF8):]
+                self.encoding = 'utf-8-sig'
+        if self._decoder.errors != 'strict':
+            return self._decoder.decode(data, final)
+        pending = self._decoder.getstate()[0]
+        try:
+            text = self._decoder.decode(data, final)
+        except UnicodeDecodeError as exc:
+            return self._switch(pending + data, exc, final)
+        if not self._utf8_non_ascii and not data.isascii():
+            self._utf8_non_ascii = True
+        return text
+
+    def readinto(self, b) -> int:
+        while not self._out and not self._eof:
+            data = self._raw.read(CHUNK)
+            self._eof = not data
+            self._out = self._decode(data, self._eof).encode('utf-8')
+        n = min(len(b), len(self._out))
+        b[:n] = self._out[:n]
+        self._out = self._out[n:]
+        return n
+
+    def close(self) -> None:
+        self._raw.close()
+        super().close()
+
+
+def open_text(path: str) -> io.TextIOWrapper:
+    """Open a CSV export for reading as text, detecting the encoding on the fly."""
+    raw = DetectingReader(open(path, 'rb'))
+    return io.TextIOWrapper(io.BufferedReader(raw, CHUNK), encoding='utf-8', newline='')
+
+
+def used_encoding(f: io.TextIOWrapper) -> Optional[str]:
+    """Encoding decided so far for a stream from open_text (final once fully read)."""
+    raw = getattr(getattr(f, 'buffer', None), 'raw', None)
+    return getattr(raw, 'encoding', None)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Append-only columnar vote time series for Decide Madrid proposals.
+
+Every nightly run appends one block of rows with the proposals whose
+cached_votes_up or retired state changed since their previous row (plus a
+"gone" row for ids that left the snapshot), so unchanged days cost nothing::
+
+    decide-madrid/votes/
+        meta.json     # committed row count + per-day row ranges (written last)
+        id.u32        # proposal id
+        votes.i32     # cached_votes_up
+        flags.u8      # bit 0 retired, bit 1 gone (not in that day's snapshot)
+        prev.u32      # row of the same proposal's previous entry (0xFFFFFFFF: none)
+        heads.bin     # per-proposal offset index: id -> latest row, votes, flags
+
+Columns are fixed-width little-endian, so any row is one seek away.
+``prev`` chains each proposal's rows, so the history of proposal X walks
+only X's rows from its head, whatever the number of days stored. Risers
+over a window read only the rows appended inside that window. Re-running a
+date replaces that day's block.
+
+Usage:
+    python scripts/decide_madrid_votes.py append decide-madrid/proposals_latest.csv [--date 2025-09-14]
+    python scripts/decide_madrid_votes.py history 35573
+    python scripts/decide_madrid_votes.py risers --days 7 [--top 20]
+"""
+import argparse
+import bisect
+import json
+import os
+import struct
+import sys
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Tuple
+from zoneinfo import ZoneInfo
+
+from decide_madrid_summary import count_retired, parse_int
+
+STORE_DIR = 'decide-madrid/votes'
+MADRID = ZoneInfo('Europe/Madrid')
+
+# nombre de columna -> typecode de array (ancho fijo, little-endian en disco)
+COLUMNS: Dict[str, str] = {'id': 'I', 'votes': 'i', 'flags': 'B', 'prev': 'I'}
+_SUFFIX = {'I': 'u32', 'i': 'i32', 'B': 'u8'}
+NONE = 0xFFFFFFFF
+RETIRED, GONE = 1, 2
+HEAD = struct.Struct('<IIiB')  # id, row, votes, flags
+HEADS_MAGIC = b'DMVH1\n'
+
+Head = Tuple[int, int, int]  # row, votes, flags
+
+
+def _col_path(store: str, name: str) -> str:
+    return os.path.join(store, f'{name}.{_SUFFIX[COLUMNS[name]]}')
+
+
+def load_meta(store: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(store, 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': 1, 'rows': 0, 'days': []}
+
+
+def _write_json(path: str, data: Any) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _read_range(store: str, name: str, start: int, stop: int) -> array:
+    col = array(COLUMNS[name])
+    if stop <= start:
+        return col
+    with open(_col_path(store, name), 'rb') as f:
+        f.seek(start * col.itemsize)
+        col.frombytes(f.read((stop - start) * col.itemsize))
+    if sys.byteorder == 'big':
+        col.byteswap()
+    return col
+
+
+def _read_at(store: str, name: str, row: int) -> int:
+    return _read_range(store, name, row, row + 1)[0]
+
+
+def _append_columns(store: str, cols: Dict[str, array], committed: int) -> None:
+    for name, col in cols.items():
+        if sys.byteorder == 'big':
+            col.byteswap()
+        with open(_col_path(store, name), 'ab') as f:
+            f.truncate(committed * col.itemsize)  # descarta una cola no confirmada
+            f.seek(0, os.SEEK_END)
+            f.write(col.tobytes())
+
+
+# ========= Índice por propuesta =========
+def load_heads(store: str, rows: int) -> Dict[int, Head]:
+    """id -> (última fila, votos, flags); se reconstruye si no cuadra con meta."""
+    try:
+        with open(os.path.join(store, 'heads.bin'), 'rb') as f:
+            if f.read(len(HEADS_MAGIC)) == HEADS_MAGIC and struct.unpack('<I', f.read(4))[0] == rows:
+                return {pid: (row, v, fl) for pid, row, v, fl in HEAD.iter_unpack(f.read())}
+    except (OSError, struct.error):
+        pass
+    ids, votes, flags = (_read_range(store, n, 0, rows) for n in ('id', 'votes', 'flags'))
+    return {pid: (row, votes[row], flags[row]) for row, pid in enumerate(ids)}
+
+
+def _write_heads(store: str, heads: Dict[int, Head], rows: int) -> None:
+    path = os.path.join(store, 'heads.bin')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADS_MAGIC + struct.pack('<I', rows))
+        f.write(b''.join(HEAD.pack(pid, *heads[pid]) for pid in sorted(heads)))
+    os.replace(path + '.tmp', path)
+
+
+def _drop_last_day(store: str, meta: Dict[str, Any], heads: Dict[int, Head]) -> None:
+    """Deshace el último bloque (re-ejecución del mismo día) siguiendo prev."""
+    day = meta['days'].pop()
+    start, stop = day['first_row'], day['first_row'] + day['rows']
+    for pid, prev in zip(_read_range(store, 'id', start, stop), _read_range(store, 'prev', start, stop)):
+        if prev == NONE:
+            heads.pop(pid, None)
+        else:
+            heads[pid] = (prev, _read_at(store, 'votes', prev), _read_at(store, 'flags', prev))
+    meta['rows'] = start
+
+
+# ========= Escritura =========
+class VotesCollector:
+    """Estado del día por propuesta a partir de filas (cabecera -> valor)."""
+
+    def __init__(self) -> None:
+        self.entries: Dict[int, Tuple[int, int]] = {}
+
+    def add(self, row: Dict[str, str]) -> None:
+        pid = (row.get('id') or '').strip()
+        if pid.isdigit():
+            self.entries[int(pid)] = (parse_int(row.get('cached_votes_up')) or 0,
+                                      RETIRED if count_retired(row) else 0)
+
+
+def append_day(store: str, day: str, entries: Dict[int, Tuple[int, int]]) -> int:
+    """Añade el bloque de ``day`` (YYYY-MM-DD); devuelve las filas escritas."""
+    os.makedirs(store, exist_ok=True)
+    meta = load_meta(store)
+    heads = load_heads(store, meta['rows'])
+    if meta['days'] and meta['days'][-1]['date'] >= day:
+        if meta['days'][-1]['date'] > day:
+            raise ValueError(f'{store}: {day} is older than the last stored day {meta["days"][-1]["date"]}')
+        _drop_last_day(store, meta, heads)
+    start = meta['rows']
+    cols = {name: array(tc) for name, tc in COLUMNS.items()}
+
+    def put(pid: int, votes: int, flags: int) -> None:
+        head = heads.get(pid)
+        if head is not None and head[1:] == (votes, flags):
+            return
+        cols['id'].append(pid)
+        cols['votes'].append(votes)
+        cols['flags'].append(flags)
+        cols['prev'].append(head[0] if head is not None else NONE)
+        heads[pid] = (start + len(cols['id']) - 1, votes, flags)
+
+    for pid in sorted(entries):
+        put(pid, *entries[pid])
+    for pid in sorted(set(heads) - set(entries)):
+        _, votes, flags = heads[pid]
+        put(pid, votes, flags | GONE)
+
+    n = len(cols['id'])
+    _append_columns(store, cols, start)
+    meta['rows'] = start + n
+    meta['days'].append({'date': day, 'first_row': start, 'rows': n, 'proposals': len(entries)})
+    _write_heads(store, heads, meta['rows'])
+    _write_json(os.path.join(store, 'meta.json'), meta)
+    return n
+
+
+# ========= Consultas =========
+def _row_dates(meta: Dict[str, Any]):
+    firsts = [d['first_row'] for d in meta['days']]
+    return lambda row: meta['days'][bisect.bisect_right(firsts, row) - 1]['date']
+
+
+def history(store: str, pid: int) -> List[Dict[str, Any]]:
+    """Serie de una propuesta (solo los días en que cambió), de la más antigua a la última."""
+    meta = load_meta(store)
+    head = load_heads(store, meta['rows']).get(pid)
+    date_of = _row_dates(meta)
+    out: List[Dict[str, Any]] = []
+    row = head[0] if head else NONE
+    while row != NONE:
+        flags = _read_at(store, 'flags', row)
+        out.append({'date': date_of(row), 'cached_votes_up': _read_at(store, 'votes', row),
+                    'retired': bool(flags & RETIRED), 'gone': bool(flags & GONE)})
+        row = _read_at(store, 'prev', row)
+    return out[::-1]
+
+
+def risers(store: str, since: str, top: int = 20) -> List[Dict[str, Any]]:
+    """Propuestas que más votos ganan después de ``since`` (lee solo las filas de esos días)."""
+    meta = load_meta(store)
+    start = next((d['first_row'] for d in meta['days'] if d['date'] > since), meta['rows'])
+    ids, votes, prevs = (_read_range(store, n, start, meta['rows']) for n in ('id', 'votes', 'prev'))
+    first: Dict[int, int] = {}
+    last: Dict[int, int] = {}
+    for i, pid in enumerate(ids):
+        first.setdefault(pid, i)
+        last[pid] = i
+    out = []
+    for pid, i in first.items():
+        base = _read_at(store, 'votes', prevs[i]) if prevs[i] != NONE else 0
+        out.append({'id': pid, 'cached_votes_up': votes[last[pid]],
+                    'delta': votes[last[pid]] - base, 'new': prevs[i] == NONE})
+    out.sort(key=lambda r: (-r['delta'], r['id']))
+    return out[:top]
+
+
+def today_madrid() -> str:
+    return datetime.now(MADRID).date().isoformat()
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Serie diaria de votos de propuestas de Decide Madrid')
+    ap.add_argument('--store', default=STORE_DIR, help='Store directory')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    a = sub.add_parser('append', help='Append the snapshot of a proposals CSV as one day')
+    a.add_argument('csv')
+    a.add_argument('--date', default=None, help='Snapshot day (YYYY-MM-DD, default today in Europe/Madrid)')
+    h = sub.add_parser('history', help='Votes over time for one proposal')
+    h.add_argument('id', type=int)
+    r = sub.add_parser('risers', help='Proposals gaining most votes in a window')
+    g = r.add_mutually_exclusive_group()
+    g.add_argument('--days', type=int, default=7, help='Window ending on the last stored day')
+    g.add_argument('--since', default=None, help='Exclusive start day (YYYY-MM-DD)')
+    r.add_argument('--top', type=int, default=20)
+    args = ap.parse_args()
+
+    if args.cmd == 'append':
+        from decide_madrid_filter import iter_rows_flexible
+        from decide_madrid_text import open_text
+        collector = VotesCollector()
+        with open_text(args.csv) as f:
+            rows, _ = iter_rows_flexible(f)
+            for row in rows:
+                collector.add(row)
+        day = args.date or today_madrid()
+        n = append_day(args.store, day, collector.entries)
+        print(f'{args.store}: {day}, {len(collector.entries)} proposals, {n} rows appended')
+    elif args.cmd == 'history':
+        for p in history(args.store, args.id):
+            print(json.dumps(p, ensure_ascii=False))
+    else:
+        since = args.since
+        if since is None:
+            days = load_meta(args.store)['days']
+            last = date.fromisoformat(days[-1]['date']) if days else date.fromisoformat(today_madrid())
+            since = (last - timedelta(days=args.days)).isoformat()
+        for p in risers(args.store, since, args.top):
+            print(json.dumps(p, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,25 @@
 #!/usr/bin/env python3
 from __future__ import annotations
-import json, csv, sys, re, math, os
+import argparse, json, csv, sys, re, math, os, hashlib, shutil
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 import time
+import xml.etree.ElementTree as ET
+from functools import lru_cache
 from pathlib import Path
-from urllib.request import Request, urlopen
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Sequence, Tuple, Any
+
+import calair_hours
+from calair_time import in_gap
+from calair_aggregates import update_aggregates
+from calair_monthly import rebuild as rebuild_monthly, update_monthly
+from calair_archive import day_dirs, iter_day_members
+import calair_http
+from calair_history import HISTORY_DIR, append_history_columns, append_history_rows, extend_columns, rows_to_columns
+from calair_snapshots import (
+    LAST_GOOD, MANIFEST, last_snapshot, lookup_blob, read_last_good, record_snapshot,
+    snapshot_hash, staleness_hours, write_last_good,
+)
 
 # ========= Config =========
 API_URL = (
@@ -14,15 +28,17 @@ API_URL = (
 )
 
 # Catálogo local de estaciones (ya en tu repo)
-LOCAL_STATIONS_CSV = Path("datasets/meta/informacion_estaciones_red_calidad_aire.csv")
-LOCAL_STATIONS_GEO = Path("datasets/meta/informacion_estaciones_red_calidad_aire.geo")  # opcional (GeoJSON)
+LOCAL_STATIONS_CSV = Path("meta/informacion_estaciones_red_calidad_aire.csv")
+LOCAL_STATIONS_GEO = Path("meta/informacion_estaciones_red_calidad_aire.geo")  # opcional (GeoJSON o Atom/GeoRSS)
+# Índice compilado (CSV + GEO) cacheado; se regenera si cambian mtime/hash de las fuentes
+LOCAL_STATIONS_CACHE = Path("meta/.station_catalog.cache.json")
+STATION_CACHE_VERSION = 1
 
 # ========= Utilidades red =========
-def http_get_json(url: str, timeout: int = 90) -> tuple[Any, bytes]:
-    req = Request(url, headers={"User-Agent": "github-action-calair/1.7"})
-    with urlopen(req, timeout=timeout) as resp:
-        raw = resp.read()
-    return json.loads(raw), raw
+def http_get_bytes(url: str, timeout: int = 90) -> tuple[bytes, bool, str]:
+    """(bytes, changed, sha256); changed=False si el servidor respondió 304 o el cuerpo no varió."""
+    resp = calair_http.get(url, timeout=timeout, user_agent="github-action-calair/1.7")
+    return resp.body, resp.changed, resp.sha256
 
 # ========= Payload dinámico =========
 def extract_rows(payload: Any) -> List[Dict[str, Any]]:
@@ -57,33 +73,138 @@ def write_csv_plain(path: Path, rows: List[Dict[str, Any]]):
         w.writeheader()
         if rows: w.writerows(rows)
 
+# ========= Publicación: se escribe una vez, el resto son enlaces =========
+def _link_or_copy(src: Path, dst: Path, link: bool = True) -> None:
+    """Publica dst como hardlink de src (copia si el FS no lo permite), de forma atómica.
+
+    Con link=False siempre es una copia independiente: para rutas que otras
+    herramientas reescriben (p.ej. calair_ult_filter_to_csv.py escribe por
+    defecto en data/calair/latest.flat.csv), que no deben compartir inodo con
+    el fichero sellado al que apunta last_good.
+    """
+    if link and (dst == src or (dst.exists() and os.path.samefile(src, dst))):
+        return  # ya es el mismo inodo (rename sería un no-op y dejaría el .tmp)
+    tmp = dst.with_name(dst.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    if link:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+    else:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def publish_bytes(data: bytes, targets: List[Path]) -> None:
+    """Escribe data una vez (temp + rename) en targets[0] y enlaza el resto.
+
+    Nunca se escribe in situ sobre un destino: latest.* puede ser un enlace
+    a un fichero sellado de un run anterior.
+    """
+    first = targets[0]
+    tmp = first.with_name(first.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, first)
+    for t in targets[1:]:
+        _link_or_copy(first, t)
+
+def publish_csv(rows: List[Dict[str, Any]], targets: List[Path], copies: Sequence[Path] = ()) -> None:
+    """Como publish_bytes para un CSV: cabecera y filas se codifican una sola vez.
+
+    copies son destinos que se publican como copia real, no como enlace.
+    """
+    first = targets[0]
+    tmp = first.with_name(first.name + ".tmp")
+    write_csv_plain(tmp, rows)
+    os.replace(tmp, first)
+    for t in targets[1:]:
+        _link_or_copy(first, t)
+    for t in copies:
+        _link_or_copy(first, t, link=False)
+
+def publish_file(src: Path, targets: List[Path], copies: Sequence[Path] = ()) -> None:
+    for t in targets:
+        _link_or_copy(src, t)
+    for t in copies:
+        _link_or_copy(src, t, link=False)
+
 # ========= Flatten genérico (por si hay dict/list) =========
+class FlattenPlan:
+    """Plan de aplanado compilado a partir de un registro de muestra.
+
+    Todos los registros de un payload comparten esquema: se recorre la muestra
+    una vez (sin recursión) y se guarda qué contenedores hay (nodes) y de qué
+    nodo sale cada columna (leaves). Aplicarlo a otro registro es un bucle
+    plano sin construir claves; si el registro no encaja devuelve None.
+    """
+
+    __slots__ = ("nodes", "leaves")
+
+    def __init__(self, nodes: List[Tuple[int, Any, type, Any]], leaves: List[Tuple[str, int, Any, bool]]) -> None:
+        self.nodes = nodes    # (nodo padre, clave, dict|list, claves|longitud); nodes[0] = registro
+        self.leaves = leaves  # (columna, nodo, clave, dentro de lista)
+
+    @classmethod
+    def compile(cls, sample: Dict[str, Any], parent_key: str = "", sep: str = ".") -> "FlattenPlan":
+        nodes: List[Tuple[int, Any, type, Any]] = [(-1, None, dict, tuple(sample))]
+        leaves: List[Tuple[str, int, Any, bool]] = []
+        col = lambda k: f"{parent_key}{sep}{k}" if parent_key else str(k)
+        # Pila en orden inverso: se visita en el mismo orden que el recorrido recursivo
+        stack = [(0, k, v, col(k), False) for k, v in reversed(list(sample.items()))]
+        while stack:
+            parent, key, v, name, in_list = stack.pop()
+            if isinstance(v, dict):
+                idx = len(nodes)
+                nodes.append((parent, key, dict, tuple(v)))
+                stack.extend((idx, k, vv, f"{name}{sep}{k}", False) for k, vv in reversed(list(v.items())))
+            elif isinstance(v, list) and not in_list:
+                idx = len(nodes)
+                nodes.append((parent, key, list, len(v)))
+                stack.extend((idx, i, v[i], f"{name}{sep}{i}", True) for i in reversed(range(len(v))))
+            else:
+                leaves.append((name, parent, key, in_list))
+        return cls(nodes, leaves)
+
+    def apply(self, rec: Any) -> Dict[str, Any] | None:
+        resolved: List[Any] = []
+        for parent, key, kind, shape in self.nodes:
+            node = rec if parent < 0 else resolved[parent][key]
+            if type(node) is not kind or (tuple(node) if kind is dict else len(node)) != shape:
+                return None
+            resolved.append(node)
+        flat: Dict[str, Any] = {}
+        for name, idx, key, in_list in self.leaves:
+            v = resolved[idx][key]
+            if isinstance(v, dict) or (not in_list and isinstance(v, list)):
+                return None
+            flat[name] = v
+        return flat
+
 def flatten_dict(d: Dict[str, Any], parent_key: str = "", sep: str = ".") -> Dict[str, Any]:
-    flat = {}
-    for k, v in d.items():
-        nk = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, dict):
-            flat.update(flatten_dict(v, nk, sep))
-        elif isinstance(v, list):
-            for i, item in enumerate(v):
-                ik = f"{nk}{sep}{i}"
-                if isinstance(item, dict):
-                    flat.update(flatten_dict(item, ik, sep))
-                else:
-                    flat[ik] = item
-        else:
-            flat[nk] = v
-    return flat
+    return FlattenPlan.compile(d, parent_key, sep).apply(d)
 
 def flatten_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    return [flatten_dict(r) for r in rows]
+    """Compila el plan con el primer registro y lo aplica al resto; solo los
+    registros con otra forma se aplanan por separado."""
+    if not rows:
+        return []
+    plan = FlattenPlan.compile(rows[0])
+    out: List[Dict[str, Any]] = []
+    for r in rows:
+        flat = plan.apply(r)
+        out.append(flat if flat is not None else flatten_dict(r))
+    return out
 
 # ========= Claves estación =========
 STATION_CODE_KEYS = [
     "estacion","station","idEstacion","idestacion","cod_estacion","codigo_estacion","code",
-    "estacion_codigo","codEstacion","cod_est","cod_estac"
+    "estacion_codigo","codEstacion","cod_est","cod_estac","CODIGO","codigo"
 ]
 STATION_NAME_KEYS = ["nombre","name","station_name","nombre_estacion","denominacion","label","estacion_nombre"]
+# En el catálogo municipal el nombre va en ESTACION (el código está en CODIGO)
+CATALOG_NAME_KEYS = ["ESTACION"] + STATION_NAME_KEYS
+LAT_KEYS = ["lat", "latitud", "latitude"]
+LON_KEYS = ["lng", "lon", "long", "longitud", "longitude"]
 
 def detect_station_code_key(sample: Dict[str, Any]) -> str | None:
     for k in STATION_CODE_KEYS:
@@ -105,16 +226,72 @@ def normalize_station_code(x: Any) -> str:
     s = str(x).strip()
     return re.sub(r"\s+", "", s)
 
+def station_code_of(r: Dict[str, Any], code_key: str | None) -> str:
+    """Código completo (p.ej. 28079011) de una fila de datos, comparable con CODIGO."""
+    pm = normalize_station_code(r.get("PUNTO_MUESTREO"))
+    if pm:
+        return pm.split("_", 1)[0]
+    if all(r.get(k) not in (None, "") for k in ("PROVINCIA", "MUNICIPIO", "ESTACION")):
+        return (str(r["PROVINCIA"]).strip().zfill(2) + str(r["MUNICIPIO"]).strip().zfill(3)
+                + str(r["ESTACION"]).strip().zfill(3))
+    return normalize_station_code(r.get(code_key, "")) if code_key else ""
+
+def normalize_station_name(x: Any) -> str:
+    s = str(x or "").strip().casefold()
+    s = s.translate(str.maketrans("áéíóúüñ", "aeiouun"))
+    return re.sub(r"[^a-z0-9]+", " ", s).strip()
+
+def _fix_mojibake(s: str) -> str:
+    """'Plaza de EspaÃ±a' (UTF-8 leído como latin-1) -> 'Plaza de España'."""
+    try:
+        return s.encode("latin-1").decode("utf-8")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return s
+
+def _parse_coord(v: Any) -> float | None:
+    try:
+        f = float(str(v).strip().replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+    return f if math.isfinite(f) else None
+
 # ========= Catálogo estaciones (CSV y GeoJSON) =========
+@lru_cache(maxsize=None)
+def resolve_station_columns(header: Tuple[str, ...]) -> Dict[str, str | None]:
+    """Resuelve una vez por firma de cabecera qué columna es código, nombre, lat y lon."""
+    sample = dict.fromkeys(header, "")
+    lower = {h.lower(): h for h in header}
+
+    def pick(exact: List[str], pattern: str) -> str | None:
+        for k in exact:
+            if k in lower: return lower[k]
+        for h in header:
+            if re.search(pattern, h, flags=re.I): return h
+        return None
+
+    name_key = next((k for k in CATALOG_NAME_KEYS if k in sample), None) or detect_station_name_key(sample)
+    return {
+        "code": detect_station_code_key(sample),
+        "name": name_key,
+        "lat": pick(LAT_KEYS, r"^lat|coord.*y"),
+        "lon": pick(LON_KEYS, r"^(lon|lng)|coord.*x"),
+    }
+
 def load_stations_csv(p: Path) -> Dict[str, Dict[str, Any]]:
     if not p.exists(): return {}
-    with p.open("r", encoding="utf-8", newline="") as f:
-        rdr = csv.DictReader(f)
+    with p.open("r", encoding="utf-8-sig", newline="") as f:
+        head = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(head, delimiters=",;")
+        except csv.Error:
+            dialect = csv.excel
+        rdr = csv.DictReader(f, dialect=dialect)
         rows = list(rdr)
     if not rows: return {}
-    sample = rows[0]
-    code_key = detect_station_code_key(sample) or "estacion_codigo"
-    name_key = detect_station_name_key(sample)
+    roles = resolve_station_columns(tuple(rdr.fieldnames or ()))
+    code_key = roles["code"] or "estacion_codigo"
+    name_key = roles["name"]
 
     mapping: Dict[str, Dict[str, Any]] = {}
     for r in rows:
@@ -125,25 +302,45 @@ def load_stations_csv(p: Path) -> Dict[str, Dict[str, Any]]:
         if name_key and f"station_{name_key}" in meta:
             meta["station_name"] = meta[f"station_{name_key}"]
         # Normaliza lat/lon si existen
-        lat = None; lon = None
-        for k, v in r.items():
-            kl = k.lower()
-            if lat is None and re.search(r"(lat|y|coord.*y)", kl):
-                try: lat = float(str(v).replace(",", "."))
-                except: pass
-            if lon is None and re.search(r"(lon|lng|x|coord.*x)", kl):
-                try: lon = float(str(v).replace(",", "."))
-                except: pass
-        if isinstance(lat, (int,float)): meta["lat"] = lat
-        if isinstance(lon, (int,float)): meta["lng"] = lon
+        lat = _parse_coord(r.get(roles["lat"])) if roles["lat"] else None
+        lon = _parse_coord(r.get(roles["lon"])) if roles["lon"] else None
+        if lat is not None: meta["lat"] = lat
+        if lon is not None: meta["lng"] = lon
         mapping[code] = meta
     print(f"🔎 Estaciones CSV: {len(mapping)} filas ({p})")
     return mapping
 
+def _load_stations_georss(p: Path) -> Dict[str, Dict[str, Any]]:
+    """Feed Atom/GeoRSS (formato real del .geo municipal): sin código, se indexa por nombre."""
+    ns = {
+        "a": "http://www.w3.org/2005/Atom",
+        "geo": "http://www.w3.org/2003/01/geo/wgs84_pos#",
+    }
+    try:
+        root = ET.parse(p).getroot()
+    except ET.ParseError:
+        return {}
+    mapping: Dict[str, Dict[str, Any]] = {}
+    for entry in root.findall("a:entry", ns):
+        name = _fix_mojibake((entry.findtext("a:title", "", ns) or "").strip())
+        key = normalize_station_name(name)
+        if not key: continue
+        meta: Dict[str, Any] = {"station_name": name}
+        lat = _parse_coord(entry.findtext("geo:lat", None, ns))
+        lon = _parse_coord(entry.findtext("geo:long", None, ns))
+        if lat is not None: meta["lat"] = lat
+        if lon is not None: meta["lng"] = lon
+        mapping[f"name:{key}"] = meta
+    print(f"🗺️  Estaciones GeoRSS: {len(mapping)} entradas ({p})")
+    return mapping
+
 def load_stations_geo(p: Path) -> Dict[str, Dict[str, Any]]:
     if not p.exists(): return {}
+    text = p.read_text(encoding="utf-8")
+    if text.lstrip().startswith("<"):
+        return _load_stations_georss(p)
     try:
-        gj = json.loads(p.read_text(encoding="utf-8"))
+        gj = json.loads(text)
     except Exception:
         return {}
     feats = gj.get("features") or []
@@ -171,7 +368,10 @@ def load_stations_geo(p: Path) -> Dict[str, Dict[str, Any]]:
 
 def merge_station_maps(a: Dict[str, Dict[str, Any]], b: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
     out = dict(a)
+    # Entradas sin código (GeoRSS) se casan por nombre normalizado
+    by_name = {f"name:{normalize_station_name(m.get('station_name'))}": c for c, m in a.items()}
     for code, meta_b in b.items():
+        code = by_name.get(code, code)
         meta = out.get(code, {})
         for k, v in meta_b.items():
             if k not in meta or meta.get(k) in (None, "", "NaN"):
@@ -179,10 +379,81 @@ def merge_station_maps(a: Dict[str, Dict[str, Any]], b: Dict[str, Dict[str, Any]
         out[code] = meta
     return out
 
-def load_station_catalog() -> Dict[str, Dict[str, Any]]:
+def _source_signature(p: Path, cached: Dict[str, Any] | None = None) -> Dict[str, Any] | None:
+    """mtime+tamaño; si no coinciden con la caché se decide por sha256 del contenido."""
+    if not p.exists():
+        return None
+    st = p.stat()
+    sig = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if cached and cached.get("size") == sig["size"] and cached.get("mtime_ns") == sig["mtime_ns"]:
+        sig["sha256"] = cached.get("sha256")
+    else:
+        sig["sha256"] = hashlib.sha256(p.read_bytes()).hexdigest()
+    return sig
+
+def load_station_catalog(cache_path: Path = LOCAL_STATIONS_CACHE) -> Dict[str, Dict[str, Any]]:
+    """Catálogo fusionado CSV+GEO por código normalizado, compilado una vez y cacheado en disco."""
+    cached: Dict[str, Any] = {}
+    if cache_path.exists():
+        try:
+            cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            cached = {}
+    old_sources = cached.get("sources") or {}
+    sources = {
+        str(p): _source_signature(p, old_sources.get(str(p)))
+        for p in (LOCAL_STATIONS_CSV, LOCAL_STATIONS_GEO)
+    }
+    strip_mtime = lambda d: {k: (v and v.get("sha256")) for k, v in d.items()}
+    if cached.get("version") == STATION_CACHE_VERSION and strip_mtime(old_sources) == strip_mtime(sources):
+        stations = cached.get("stations") or {}
+        if sources != old_sources:
+            # Mismo contenido, mtime distinto (p.ej. checkout nuevo): solo refresca firmas
+            cached["sources"] = sources
+            _write_station_cache(cache_path, cached)
+        print(f"⚡ Catálogo de estaciones desde caché: {len(stations)} estaciones ({cache_path})")
+        return stations
+
     csv_map = load_stations_csv(LOCAL_STATIONS_CSV)
     geo_map = load_stations_geo(LOCAL_STATIONS_GEO) if LOCAL_STATIONS_GEO.exists() else {}
-    return merge_station_maps(csv_map, geo_map) if geo_map else csv_map
+    stations = merge_station_maps(csv_map, geo_map) if geo_map else csv_map
+    # Entradas GeoRSS que no casaron con ninguna estación del CSV no tienen código: fuera
+    stations = {c: m for c, m in stations.items() if not c.startswith("name:")}
+    _write_station_cache(cache_path, {"version": STATION_CACHE_VERSION, "sources": sources, "stations": stations})
+    return stations
+
+def _write_station_cache(cache_path: Path, data: Dict[str, Any]) -> None:
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        print(f"ℹ️ No se pudo escribir la caché de estaciones ({e}).")
+
+def enrich_with_station_meta(rows_in: List[Dict[str, Any]], station_map: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Añade station_*, lat, lng a cada fila uniendo por código de estación."""
+    if not rows_in: return rows_in
+    code_key = detect_station_code_key(rows_in[0])
+    has_full_code = "PUNTO_MUESTREO" in rows_in[0] or "PROVINCIA" in rows_in[0]
+    if not code_key and not has_full_code:
+        print("ℹ️ No se detectó clave de estación en datos.")
+        return rows_in
+    # La clave de nombre se resuelve una vez (antes de añadir station_*)
+    nm_key = detect_station_name_key(rows_in[0])
+    matched = 0
+    for r in rows_in:
+        meta = station_map.get(station_code_of(r, code_key))
+        if meta:
+            matched += 1
+            for k, v in meta.items():
+                if k not in r:
+                    r[k] = v
+        if "station_name" not in r and nm_key:
+            r["station_name"] = r.get(nm_key, "")
+    join = "PUNTO_MUESTREO/PROVINCIA+MUNICIPIO+ESTACION" if has_full_code else code_key
+    print(f"🧷 Unión por '{join}': {matched}/{len(rows_in)} filas con 'station_*', 'lat', 'lng'.")
+    return rows_in
 
 # ========= Normalización Hxx y unpivot =========
 def normalize_numeric_hours(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -242,32 +513,37 @@ def unpivot_hours_to_long(rows: List[Dict[str, Any]], drop_empty: bool = True) -
             long_rows.append(new_row)
     return long_rows
 
-# ========= Históricos =========
-def append_history(history_csv: Path, rows: List[Dict[str, Any]]):
-    if not rows:
-        print("ℹ️ No se añaden filas a history.csv (0 filas).")
-        return
-    fns = safe_fieldnames(rows)
-    new_file = not history_csv.exists()
-    with history_csv.open("a", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fns)
-        if new_file: w.writeheader()
-        for r in rows:
-            w.writerow(r)
-    print(f"📚 history.csv: {'creado' if new_file else 'actualizado'} (+{len(rows)} filas).")
+def hours_to_wide_and_long(rows: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Normaliza Hxx, filtra el último día y genera (filas anchas, filas largas).
 
-def append_history_flat(history_flat_csv: Path, rows_flat: List[Dict[str, Any]]):
-    if not rows_flat:
-        print("ℹ️ No se añaden filas a history_flat.csv (0 filas).")
-        return
-    fns = safe_fieldnames(rows_flat)
-    new_file = not history_flat_csv.exists()
-    with history_flat_csv.open("a", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fns)
-        if new_file: w.writeheader()
-        for r in rows_flat:
-            w.writerow(r)
-    print(f"📚 history_flat.csv: {'creado' if new_file else 'actualizado'} (+{len(rows_flat)} filas).")
+    Con NumPy usa la matriz (rows × 24) de calair_hours; si no, los pasos por celda.
+    Las filas largas pasan por el eje horario de calair_time: la hora local
+    inexistente del día de 23 h no se publica (igual que en los conversores ult).
+    """
+    if calair_hours.AVAILABLE:
+        hm = calair_hours.HourMatrix.from_rows(rows).latest_day()
+        long_cols = hm.long_columns(drop_empty=True)
+        rows, rows_flat = hm.wide_rows(), list(hm.iter_long_rows(long_cols))
+    else:
+        rows = filter_latest_day(normalize_numeric_hours(rows))
+        rows_flat = unpivot_hours_to_long(rows, drop_empty=True)
+    return rows, [r for r in rows_flat if not in_gap(r.get("ANO"), r.get("MES"), r.get("DIA"), r.get("Hora"))]
+
+# ========= Históricos =========
+# El histórico vive en data/calair/history/YYYY/MM (ver calair_history.py);
+# history.csv / history_flat.csv ya están importados ahí y quedan congelados
+# (obsoletos, ver README) hasta que se retiren.
+
+def _find_fallback_flat(base: Path) -> Path | None:
+    """Último CSV largo bueno: O(1) vía last_good.json; si falta, escaneo de días."""
+    entry = read_last_good(base / LAST_GOOD.name)
+    if entry:
+        stale = staleness_hours(entry)
+        last = entry.get("last") or {}
+        print(f"🧾 last_good.json: {entry['rows']} filas hasta {last.get('date')} H{last.get('hour')}"
+              + (f" ({stale} h de antigüedad)" if stale is not None else ""))
+        return Path(entry["path"])
+    return _search_last_nonempty_latest_flat(base)
 
 def _search_last_nonempty_latest_flat(base: Path) -> Path | None:
     """Busca el último `latest.flat.csv` no vacío en subcarpetas fechadas.
@@ -295,16 +571,79 @@ def _search_last_nonempty_latest_flat(base: Path) -> Path | None:
     return candidates[0][1]
 
 
-def main() -> int:
+# ========= Backfill / reprocesado de snapshots guardados =========
+def _backfill_day(day_dir: Path) -> Tuple[str, int, int, Dict[Tuple[int, int], Any]]:
+    """Procesa los JSON sellados de un día (sueltos o en archive.gz, orden de timestamp)
+    con las mismas etapas que main().
+
+    Devuelve columnas del histórico por partición; los snapshots repetidos
+    (mismo contentMD5) dentro del día se procesan una sola vez.
+    """
+    parts: Dict[Tuple[int, int], Any] = {}
+    seen: set = set()
+    n_snap = n_rows = 0
+    for _, raw in iter_day_members(day_dir, "json"):
+        try:
+            payload = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        digest = snapshot_hash(payload, raw)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        rows = extract_rows(payload)
+        if not rows:
+            continue
+        _, rows_flat = hours_to_wide_and_long(rows)
+        extend_columns(parts, rows_to_columns(rows_flat))
+        n_snap += 1
+        n_rows += len(rows_flat)
+    return day_dir.name, n_snap, n_rows, parts
+
+def backfill(start: str, end: str, workers: int | None = None, base: Path = Path("data/calair"),
+             history: Path = HISTORY_DIR) -> int:
+    """Reprocesa los snapshots de [start, end] (días YYYY-MM-DD) en un pool de procesos.
+
+    Un día por tarea; los resultados se fusionan en orden de día y timestamp,
+    así que el histórico resultante no depende del número de workers.
+    """
+    days = [d for d in day_dirs(base) if start <= d.name <= end]
+    if not days:
+        print(f"⚠️ Sin snapshots entre {start} y {end} en {base}.")
+        return 0
+    workers = max(1, min(workers or os.cpu_count() or 1, len(days)))
+    print(f"🛠️  Backfill {start}..{end}: {len(days)} días con {workers} procesos.")
+    merged: Dict[Tuple[int, int], Any] = {}
+    t0 = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map conserva el orden de entrada: fusión determinista
+        for day, n_snap, n_rows, parts in pool.map(_backfill_day, days):
+            print(f"  · {day}: {n_snap} snapshots, {n_rows} filas largas")
+            extend_columns(merged, parts)
+    append_history_columns(history, merged)
+    # Las horas reprocesadas quedan detrás de la marca de agua de los agregados:
+    # el plegado incremental no las vería, así que se recalcula todo
+    print("🔁 Recalculando agregados y serie mensual desde el histórico...")
+    rebuild_monthly(history)
+    print(f"✅ Backfill completado en {time.time() - t0:.1f}s.")
+    return 0
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Descarga calair tiempo real (o reprocesa snapshots guardados)")
+    ap.add_argument("--backfill", nargs=2, metavar=("FROM", "TO"),
+                    help="Reprocesa los JSON de data/calair/<día>/ entre FROM y TO (YYYY-MM-DD) hacia el histórico")
+    ap.add_argument("--workers", type=int, default=None, help="Procesos para --backfill (por defecto, todos los núcleos)")
+    args = ap.parse_args(argv)
+    if args.backfill:
+        return backfill(*args.backfill, workers=args.workers)
+
     now_utc = datetime.now(timezone.utc)
     dt = now_utc.strftime("%Y-%m-%d")
     ts = now_utc.strftime("%Y-%m-%dT%H-%M-%SZ")
 
-    # Directorios/paths salida
+    # Directorios/paths salida (el directorio del día se crea solo si hay algo que escribir:
+    # un snapshot repetido no deja carpetas vacías que luego recorra calair_archive)
     day_dir = Path("data/calair") / dt
-    day_dir.mkdir(parents=True, exist_ok=True)
-    hist_csv = Path("data/calair/history.csv")
-    hist_flat_csv = Path("data/calair/history_flat.csv")
 
     stamped_json = day_dir / f"calair_tiemporeal_{ts}.json"
     latest_json  = day_dir / "latest.json"
@@ -322,18 +661,25 @@ def main() -> int:
     rows: List[Dict[str, Any]] = []
     while attempt <= max_retries:
         try:
-            payload, raw = http_get_json(API_URL)
-            print(f"✅ Fetch tiempo real OK: {len(raw)} bytes (attempt {attempt+1}/{max_retries+1})")
+            raw, changed, body_sha = http_get_bytes(API_URL)
+            print(f"✅ Fetch tiempo real OK: {len(raw)} bytes{'' if changed else ' (sin cambios en origen)'}"
+                  f" (attempt {attempt+1}/{max_retries+1})")
+            prev = None if changed else last_snapshot(MANIFEST)
+            if prev and prev.get("sha256") == body_sha:
+                # 304 o mismo cuerpo que el último snapshot registrado: ni se parsea ni se escribe nada más.
+                # Si la caché HTTP va por delante del manifiesto (run interrumpido), se procesa normal.
+                record_snapshot(MANIFEST, ts, prev["hash"], prev["blob"], len(raw), prev.get("responseDate"),
+                                duplicate=True, sha256=body_sha)
+                print(f"♻️  Sin cambios en origen; ya guardado en {prev['blob']}. Nada que procesar.")
+                return 0
+            payload = json.loads(raw)
         except Exception as e:
             last_err = e
             print(f"❌ Error fetch (attempt {attempt+1}/{max_retries+1}): {e}")
             payload = None
 
         if payload is not None:
-            # 2) Guarda JSON crudo (siempre que haya respuesta)
-            stamped_json.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-            latest_json.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-            # 3) Extrae filas
+            # 2) Extrae filas
             rows = extract_rows(payload)
             print(f"🧮 Filas detectadas: {len(rows)}")
 
@@ -346,110 +692,93 @@ def main() -> int:
             print(f"⏳ latest.flat.csv vacío o sin filas; reintento en {wait_seconds}s...")
             time.sleep(wait_seconds)
 
+    root_latest_flat = Path("data/calair/latest.flat.csv")
+    # La copia raíz es un fichero propio: el conversor ult escribe ahí por defecto
+    flat_targets = [stamped_flat_csv, latest_flat_csv]
+    root_copies = [root_latest_flat]
+
     if payload is None and last_err is not None:
         # Fallo duro de red en todos los intentos: dejamos diagnóstico mínimo
         err = {"error": str(last_err), "when": ts, "url": API_URL}
-        stamped_json.write_text(json.dumps(err, ensure_ascii=False, indent=2), encoding="utf-8")
-        latest_json.write_text(json.dumps(err, ensure_ascii=False, indent=2), encoding="utf-8")
-        for p in (stamped_csv, latest_csv, stamped_flat_csv, latest_flat_csv):
-            write_csv_plain(p, [])
+        day_dir.mkdir(parents=True, exist_ok=True)
+        publish_bytes(json.dumps(err, ensure_ascii=False, indent=2).encode("utf-8"), [stamped_json, latest_json])
+        publish_csv([], [stamped_csv, latest_csv])
 
         # Intentar fallback con el último latest.flat.csv no vacío
-        cand = _search_last_nonempty_latest_flat(Path("data/calair"))
+        cand = _find_fallback_flat(Path("data/calair"))
         if cand:
             print(f"🔁 Fallback tras error de red: {cand}")
-            data = cand.read_text(encoding="utf-8")
-            stamped_flat_csv.write_text(data, encoding="utf-8")
-            latest_flat_csv.write_text(data, encoding="utf-8")
-            root_latest_flat = Path("data/calair/latest.flat.csv")
-            root_latest_flat.write_text(data, encoding="utf-8")
+            publish_file(cand, flat_targets, root_copies)
             print("✅ Fallback aplicado y copias actualizadas.")
         else:
-            root_latest_flat = Path("data/calair/latest.flat.csv")
-            write_csv_plain(root_latest_flat, [])
+            publish_csv([], flat_targets, root_copies)
 
         print("⚠️ Abortado tras reintentos por error de red; saliendo con éxito.")
         return 0
 
-    # 4) Catálogo de estaciones (local)
-    station_map = load_station_catalog()
+    # 3) Snapshot ya visto (mismo contentMD5): solo entrada en el manifiesto
+    digest = snapshot_hash(payload, raw)
+    response_date = payload.get("responseDate") if isinstance(payload, dict) else None
+    blob = lookup_blob(digest, MANIFEST)
+    if blob:
+        record_snapshot(MANIFEST, ts, digest, blob, len(raw), response_date, duplicate=True, sha256=body_sha)
+        print(f"♻️  Snapshot sin cambios ({digest}); ya guardado en {blob}. Nada que procesar.")
+        return 0
 
-    # 5) Enriquecer con metadatos de estación (station_*, lat, lng)
-    rows = rows or []
-    if rows:
-        sample_key = detect_station_code_key(rows[0])
-    else:
-        sample_key = None
-
-    def enrich_with_station_meta(rows_in: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        if not rows_in: return rows_in
-        code_key = detect_station_code_key(rows_in[0])
-        if not code_key: 
-            print("ℹ️ No se detectó clave de estación en datos.")
-            return rows_in
-        for r in rows_in:
-            code = normalize_station_code(r.get(code_key, ""))
-            meta = station_map.get(code, {})
-            for k, v in meta.items():
-                if k not in r:
-                    r[k] = v
-            if "station_name" not in r:
-                nm_key = detect_station_name_key(r)
-                if nm_key: r["station_name"] = r.get(nm_key, "")
-        print(f"🧷 Unión por '{code_key}'. Añadidos 'station_*', 'lat', 'lng' si existen.")
-        return rows_in
+    # Guarda los bytes descargados tal cual (sin re-serializar); se registran como blob
+    # solo al terminar: si el run muere antes, el siguiente vuelve a procesarlos
+    day_dir.mkdir(parents=True, exist_ok=True)
+    publish_bytes(raw, [stamped_json, latest_json])
 
-    rows = enrich_with_station_meta(rows)
+    def register_blob() -> None:
+        record_snapshot(MANIFEST, ts, digest, stamped_json.relative_to(MANIFEST.parent).as_posix(),
+                        len(raw), response_date, duplicate=False, sha256=body_sha)
 
-    # 6) Normalizar horas a numéricas
-    rows = normalize_numeric_hours(rows)
+    # 4) Catálogo de estaciones (local, índice cacheado)
+    station_map = load_station_catalog()
 
-    # 7) Quedarse solo con el último día disponible
-    rows = filter_latest_day(rows)
+    # 5) Enriquecer con metadatos de estación (station_*, lat, lng)
+    rows = enrich_with_station_meta(rows or [], station_map)
+
+    # 6-7) Horas a numéricas, último día disponible y versión larga (Hora / Valor / Validacion)
+    rows, rows_flat = hours_to_wide_and_long(rows)
 
     # 8) CSV anchos
-    write_csv_plain(stamped_csv, rows)
-    write_csv_plain(latest_csv, rows)
+    publish_csv(rows, [stamped_csv, latest_csv])
     print(f"💾 CSV ancho: {stamped_csv.name}, {latest_csv.name}")
 
-    # 9) Versión larga: Hora / Valor / Validacion
-    rows_flat = unpivot_hours_to_long(rows, drop_empty=True)
+    # 9) Versión larga
     if not rows_flat:
         # Fallback: usar el último latest.flat.csv no vacío de días anteriores
-        cand = _search_last_nonempty_latest_flat(Path("data/calair"))
+        cand = _find_fallback_flat(Path("data/calair"))
         if cand:
             print(f"🔁 latest.flat.csv vacío. Usando fallback: {cand}")
-            # Copiamos contenido de cand a stamped_flat, latest_flat y raíz
-            data = cand.read_text(encoding="utf-8")
-            stamped_flat_csv.write_text(data, encoding="utf-8")
-            latest_flat_csv.write_text(data, encoding="utf-8")
-            root_latest_flat = Path("data/calair/latest.flat.csv")
-            root_latest_flat.write_text(data, encoding="utf-8")
-            # history_flat no se actualiza en este caso (evitar duplicados falsos)
+            # Publicamos cand como stamped_flat, latest_flat y raíz
+            publish_file(cand, flat_targets, root_copies)
+            # El histórico no se actualiza en este caso (evitar duplicados falsos)
             print("✅ Fallback aplicado y copias actualizadas.")
+            register_blob()
             return 0
         else:
             print("⚠️ latest.flat.csv vacío y sin fallback disponible.")
             # Escribimos explícitamente vacíos como diagnóstico
-            write_csv_plain(stamped_flat_csv, [])
-            write_csv_plain(latest_flat_csv, [])
-            root_latest_flat = Path("data/calair/latest.flat.csv")
-            write_csv_plain(root_latest_flat, [])
+            publish_csv([], flat_targets, root_copies)
+            register_blob()
             return 0
 
-    write_csv_plain(stamped_flat_csv, rows_flat)
-    write_csv_plain(latest_flat_csv, rows_flat)
-    print(f"💾 CSV largo: {stamped_flat_csv.name}, {latest_flat_csv.name}")
+    # 8bis) La copia raíz pisa la del día anterior
+    publish_csv(rows_flat, flat_targets, root_copies)
+    print(f"💾 CSV largo: {stamped_flat_csv.name}, {latest_flat_csv.name}, {root_latest_flat}")
+    write_last_good(stamped_flat_csv, rows_flat, ts, LAST_GOOD)
 
-    # 8bis) Copia a nivel raíz para pisar la del día anterior
-    root_latest_flat = Path("data/calair/latest.flat.csv")
-    write_csv_plain(root_latest_flat, rows_flat)
-    print(f"💾 Copia actualizada: {root_latest_flat}")
+    # 9) Histórico columnar (particionado año/mes)
+    append_history_rows(HISTORY_DIR, rows_flat)
 
-    # 9) Históricos (planos, sin fila de tipos)
-    append_history(hist_csv, rows)
-    append_history_flat(hist_flat_csv, rows_flat)
+    # 10) Agregados normativos (solo las horas nuevas) y serie mensual 2001-actual
+    #     con los días que se acaban de cerrar
+    update_monthly(update_aggregates(rows_to_columns(rows_flat).values()))
 
+    register_blob()
     return 0
 
 if __name__ == "__main__":
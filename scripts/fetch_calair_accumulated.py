@@ -6,24 +6,72 @@ provided by the Ayuntamiento de Madrid:
 https://datos.madrid.es/egob/catalogo/212504-1-calidad-aire-tiempo-real-acumulado.json
 
 It stores the raw JSON response and a flattened CSV with one row per
-station and contaminant measurement.
+station and contaminant measurement. Requests are conditional (see
+``calair_http``): when the endpoint has not published new data the outputs
+are left untouched.
+
+The response is processed as a stream: raw bytes are teed to
+``latest.json`` as they arrive and ``@graph`` entries are decoded one at a
+time straight into the CSV writer, so memory does not grow with the number
+of stations or measurements.
+
+The same pass converts each measurement to a station|MAGNITUD hour
+(``history_row``) and upserts them into the columnar history in batches of
+``BATCH`` hours while the stream is read, with the provisional flag 'P'
+(upserts are idempotent, so a batch from a response that turns out to be
+unchanged or a run that dies midway is harmless): the feed carries no
+validation, so these hours never replace a validated one and the
+regulatory aggregates (which only count 'V') do not see them. When the
+hourly feed (``fetch_calair.py``) brings the validated value it patches the
+provisional one and folds it through its own watermark, so the aggregates
+stay a function of the stored history and ``rebuild`` reproduces them.
 """
 from __future__ import annotations
 import argparse
+import codecs
 import csv
 import json
+import os
+import re
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, List
-from urllib.request import Request, urlopen
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import calair_http
+from calair_history import HISTORY_DIR, append_history_columns, rows_to_columns
 
 API_URL = "https://datos.madrid.es/egob/catalogo/212504-1-calidad-aire-tiempo-real-acumulado.json"
+FIELDNAMES = ["station_id", "title", "relation", "magnitud", "valor", "fecha"]
+
+# Fórmula que usa el endpoint -> código MAGNITUD de la red
+MAGNITUD_CODES = {
+    "SO2": 1, "CO": 6, "NO": 7, "NO2": 8, "PM2.5": 9, "PM25": 9, "PM10": 10,
+    "NOX": 12, "O3": 14, "TOL": 20, "BEN": 30, "EBE": 35, "HCT": 42, "CH4": 43, "NMHC": 44,
+}
+PROVISIONAL = "P"  # Validacion de las horas de este feed en el histórico
+BATCH = 4096       # horas por upsert al histórico mientras se lee el stream
+_TRAILING_DIGITS = re.compile(r"(\d+)\D*$")
+
 
+def fetch_payload(url: str = API_URL) -> calair_http.Response:
+    """Return the (conditional) API response; ``.json()`` gives the payload."""
+    return calair_http.get(url, timeout=60, user_agent="datasets-fetch/0.1")
 
-def fetch_payload(url: str = API_URL) -> Any:
-    """Return JSON payload from the API."""
-    req = Request(url, headers={"User-Agent": "datasets-fetch/0.1"})
-    with urlopen(req, timeout=60) as resp:
-        return json.load(resp)
+
+def station_rows(station: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """One row per 'medicion' of a '@graph' station entry."""
+    station_id = station.get("@id", "")
+    title = station.get("title", "")
+    relation = station.get("relation", "")
+    for m in station.get("medicion", []):
+        yield {
+            "station_id": station_id,
+            "title": title,
+            "relation": relation,
+            "magnitud": m.get("magnitud", ""),
+            "valor": m.get("valor"),
+            "fecha": m.get("fecha", ""),
+        }
 
 
 def parse_rows(payload: Any) -> List[Dict[str, Any]]:
@@ -31,49 +79,188 @@ def parse_rows(payload: Any) -> List[Dict[str, Any]]:
 
     Each row contains station id, title, relation, magnitud, valor and fecha.
     """
-    rows: List[Dict[str, Any]] = []
     graph = payload.get("@graph", []) if isinstance(payload, dict) else []
-    for station in graph:
-        station_id = station.get("@id", "")
-        title = station.get("title", "")
-        relation = station.get("relation", "")
-        measurements = station.get("medicion", [])
-        for m in measurements:
-            rows.append(
-                {
-                    "station_id": station_id,
-                    "title": title,
-                    "relation": relation,
-                    "magnitud": m.get("magnitud", ""),
-                    "valor": m.get("valor"),
-                    "fecha": m.get("fecha", ""),
-                }
-            )
-    return rows
-
-
-def write_csv(path: Path, rows: List[Dict[str, Any]]) -> None:
-    if not rows:
-        path.write_text("", encoding="utf-8")
-        return
-    fieldnames = list(rows[0].keys())
+    return [row for station in graph for row in station_rows(station)]
+
+
+def _magnitud_code(val: Any) -> int | None:
+    s = str(val or "").strip()
+    if s.isdigit():
+        return int(s)
+    return MAGNITUD_CODES.get(s.upper().replace(" ", ""))
+
+
+def _station_code(station_id: Any) -> str | None:
+    """28079004 a partir de '.../28079004', '28079004' o '4' (estaciones de Madrid capital)."""
+    m = _TRAILING_DIGITS.search(str(station_id or ""))
+    if not m:
+        return None
+    digits = m.group(1)
+    return digits if len(digits) == 8 else f"28079{digits.zfill(3)}"
+
+
+def _hour_slot(fecha: Any) -> Tuple[datetime, int] | None:
+    """Día y Hora (1..24) de la medida: la hora local de ``fecha`` cierra el intervalo.
+
+    '2025-09-10T10:00:00' es el dato de H10 del día 10; las 00:00 son la H24
+    del día anterior (misma convención que ``calair_time.slot_end``).
+    """
+    s = str(fecha or "").strip().replace(" ", "T")
+    try:
+        t = datetime.fromisoformat(s[:19])
+    except ValueError:
+        return None
+    if len(s) < 13:  # solo fecha: no se puede situar en una hora
+        return None
+    if t.hour == 0:
+        return t - timedelta(days=1), 24
+    return t, t.hour
+
+
+def history_row(row: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Fila larga (forma de calair_history.rows_to_columns) de una medida; None si no encaja."""
+    code = _station_code(row.get("station_id"))
+    mag = _magnitud_code(row.get("magnitud"))
+    at = _hour_slot(row.get("fecha"))
+    if code is None or mag is None or at is None or row.get("valor") in (None, ""):
+        return None
+    day, hora = at
+    return {
+        "PUNTO_MUESTREO": code, "MAGNITUD": mag, "ANO": day.year, "MES": day.month, "DIA": day.day,
+        "Hora": hora, "Valor": row.get("valor"), "Validacion": PROVISIONAL,
+    }
+
+
+def _store_hours(rows: Iterable[Dict[str, Any]], history: Path, stored: List[int]) -> Iterator[Dict[str, Any]]:
+    """Deja pasar las filas hacia el CSV y hace upsert de sus horas al histórico por lotes.
+
+    Solo un lote vive en memoria; ``stored[0]`` acumula las horas nuevas o actualizadas.
+    """
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        hr = history_row(row)
+        if hr is not None:
+            batch.append(hr)
+            if len(batch) >= BATCH:
+                stored[0] += append_history_columns(history, rows_to_columns(batch), provisional=True, quiet=True)
+                batch = []
+        yield row
+    if batch:
+        stored[0] += append_history_columns(history, rows_to_columns(batch), provisional=True, quiet=True)
+
+
+_ARRAY_START = re.compile(r'"@graph"\s*:\s*\[')
+_SEPARATORS = " \t\r\n,"
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str = "@graph") -> Iterator[Any]:
+    """Incrementally decode the elements of the ``key`` array of a JSON document.
+
+    Only the current element (plus one read chunk) is held in memory. The
+    key is located by a textual match, which is enough for the
+    accumulated endpoint where it appears once at the top level.
+    """
+    start_re = _ARRAY_START if key == "@graph" else re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+    it = iter(chunks)
+    buf = ""
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, eof
+        chunk = next(it, None)
+        if chunk is None:
+            buf += utf8.decode(b"", final=True)
+            eof = True
+            return False
+        buf += utf8.decode(chunk)
+        return True
+
+    # 1) Hasta el '[' del array (se descarta lo anterior)
+    while True:
+        m = start_re.search(buf)
+        if m:
+            buf = buf[m.end():]
+            break
+        if eof:
+            return
+        buf = buf[-len(key) - 16:]
+        fill()
+    # 2) Un elemento cada vez
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in _SEPARATORS:
+            pos += 1
+        if pos == len(buf):
+            buf, pos = "", 0
+            if not fill():
+                raise ValueError(f"Unterminated '{key}' array")
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf, pos = buf[pos:], 0
+            fill()
+            continue
+        yield value
+        buf, pos = buf[end:], 0
+
+
+def _tee(chunks: Iterable[bytes], f) -> Iterator[bytes]:
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+
+def write_csv(path: Path, rows: Iterable[Dict[str, Any]]) -> int:
+    """Stream rows to CSV; an empty iterable gives an empty file. Returns the row count."""
+    n = 0
     with path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        for row in rows:
+            if not n:
+                writer.writeheader()
+            writer.writerow(row)
+            n += 1
+    return n
 
 
 def main(output_dir: str) -> int:
     out = Path(output_dir)
     out.mkdir(parents=True, exist_ok=True)
-    data = fetch_payload()
-    rows = parse_rows(data)
-
     json_path = out / "latest.json"
     csv_path = out / "latest.csv"
-    json_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    write_csv(csv_path, rows)
-    print(f"Saved {len(rows)} rows to {csv_path}")
+    stream = calair_http.open_stream(API_URL, timeout=60, user_agent="datasets-fetch/0.1")
+    if not stream.changed and json_path.exists() and csv_path.exists():
+        print(f"No new data ({stream.status}); {csv_path} unchanged")
+        return 0
+    json_tmp = json_path.with_name(json_path.name + ".tmp")
+    csv_tmp = csv_path.with_name(csv_path.name + ".tmp")
+    try:
+        with json_tmp.open("wb") as raw_out:
+            body = _tee(stream, raw_out)
+            graph = iter_json_array(body)
+            stored = [0]
+            rows = (row for station in graph for row in station_rows(station))
+            n = write_csv(csv_tmp, _store_hours(rows, HISTORY_DIR, stored))
+            for _ in body:  # resto del documento tras el array
+                pass
+        # Un 200 con el mismo cuerpo solo se sabe al final
+        if not stream.changed and json_path.exists() and csv_path.exists():
+            print(f"No new data ({stream.status}, same body); {csv_path} unchanged")
+            return 0
+        os.replace(json_tmp, json_path)
+        os.replace(csv_tmp, csv_path)
+    finally:
+        json_tmp.unlink(missing_ok=True)
+        csv_tmp.unlink(missing_ok=True)
+    print(f"Saved {n} rows to {csv_path}")
+    print(f"📚 Histórico columnar {HISTORY_DIR}: {stored[0]} horas provisionales nuevas o actualizadas.")
     return 0
 
 
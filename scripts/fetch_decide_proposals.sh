@@ -10,6 +10,11 @@ LATEST="$OUTDIR/proposals_latest.csv"
 TMPFILE="$(mktemp)"
 HDRS="$(mktemp)"
 COOKIES="$(mktemp)"
+TMPFILT="$(mktemp)"
+TMPJSON="$(mktemp)"
+TMPMD="$(mktemp)"
+TMPIDX="$(mktemp)"
+trap 'rm -f "$TMPFILE" "$HDRS" "$COOKIES" "$TMPFILT" "$TMPJSON" "$TMPMD" "$TMPIDX"' EXIT
 
 echo "Descargando CSV desde: $URL"
 
@@ -58,13 +63,19 @@ if head -c 20 "$TMPFILE" | grep -qi '<html'; then
   exit 1
 fi
 
-# Apply filter (created_at >= 2024-01-01) and drop description
-TMPFILT="$(mktemp)"
-python3 scripts/decide_madrid_filter.py \
+# Apply filter (created_at >= 2024-01-01), drop description and summarize in one pass
+python3 scripts/decide_madrid_pipeline.py \
   --in "$TMPFILE" \
   --out "$TMPFILT" \
   --drop-column description \
-  --from-date 2024-01-01
+  --from-date 2024-01-01 \
+  --prev-json "$OUTDIR/proposals_summary.json" \
+  --prev-index "$OUTDIR/proposals_snapshot.idx" \
+  --out-index "$TMPIDX" \
+  --votes-store "$OUTDIR/votes" \
+  --source-file "$LATEST" \
+  --out-json "$TMPJSON" \
+  --out-md "$TMPMD"
 
 # Check if filtered output changed vs latest
 CHANGED=1
@@ -73,21 +84,15 @@ if [[ -f "$LATEST" ]] && diff -q "$TMPFILT" "$LATEST" >/dev/null 2>&1; then
   CHANGED=0
 else
   mv "$TMPFILT" "$LATEST"
-  echo "Actualizado $LATEST"
-fi
-
-if [[ "$CHANGED" -eq 1 ]]; then
-  echo "Generando resumen..."
-  python3 scripts/decide_madrid_summary.py \
-    --in "$LATEST" \
-    --compare-git \
-    --out-json "$OUTDIR/proposals_summary.json" \
-    --out-md "$OUTDIR/proposals_summary.md"
+  mv "$TMPJSON" "$OUTDIR/proposals_summary.json"
+  mv "$TMPMD" "$OUTDIR/proposals_summary.md"
+  mv "$TMPIDX" "$OUTDIR/proposals_snapshot.idx"
+  echo "Actualizado $LATEST (y resumen)"
 fi
 
 # Prepara commit si está en un repo git
 if git rev-parse --is-inside-work-tree >/dev/null 2>&1; then
-  git add "$LATEST" "$OUTDIR/proposals_summary.json" "$OUTDIR/proposals_summary.md"
+  git add "$LATEST" "$OUTDIR/proposals_summary.json" "$OUTDIR/proposals_summary.md" "$OUTDIR/proposals_snapshot.idx" "$OUTDIR/votes"
   if [[ "$CHANGED" -eq 1 ]]; then
     ROWS=$(wc -l < "$LATEST" | tr -d ' ')
     git -c user.name="github-actions[bot]" \
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""LOWESS smoothing for the global temperature anomaly series.
+
+Regenerates the ``Lowess(5)`` column of ``temperaturas_anomalias_1880_2024.csv``
+(wide: Year, No_Smoothing, Lowess(5)) and ``temperaturas_flattened.csv``
+(long: year, category, country, val). Both files are written from the same
+in-memory column set.
+
+The smoother is Cleveland's LOWESS: a local linear fit over the 10 nearest
+years with tricube weights and 3 bisquare robustness iterations. With these
+parameters it reproduces the published column exactly at 2 decimals. Fits
+are vectorized with NumPy. Years are sorted, so each point's neighbours lie
+in a band of 2k-1 positions and the cost is O(n·k), not O(n²).
+
+Fits of every robustness iteration are cached under ``.cache/lowess/``.
+``append`` adds new years and refits only the tail rows whose neighbourhood
+contains a new point; earlier rows reuse the cached fits. The robustness
+scale (median absolute residual) is global, so a full refit would also
+nudge a few earlier rows (by ~0.001; after appending 2024 to 1880-2023,
+4 rows differ at 2 decimals). ``append`` keeps those published values;
+``regenerate`` always refits everything and reproduces the full fit.
+
+Requires NumPy (``pip install numpy``); without it the script exits with
+an error instead of writing anything.
+
+Usage:
+    python scripts/temperaturas_lowess.py regenerate
+    python scripts/temperaturas_lowess.py append 2025 1.28 [--country World]
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depende del entorno
+    np = None
+
+WIDE = Path("temperaturas_anomalias_1880_2024.csv")
+LONG = Path("temperaturas_flattened.csv")
+CACHE_DIR = Path(".cache/lowess")
+RAW, SMOOTH = "No_Smoothing", "Lowess(5)"
+WIDE_COUNTRY = "World"
+K = 10          # vecinos por ajuste local
+ITERATIONS = 3  # iteraciones de robustez (bisquare)
+
+
+# ========= LOWESS =========
+def _local_fits(x: np.ndarray, y: np.ndarray, rw: np.ndarray, rows: np.ndarray, k: int) -> np.ndarray:
+    """Ajuste lineal local en las filas indicadas (todas a la vez)."""
+    n = len(x)
+    k = min(k, n)
+    cols = rows[:, None] + np.arange(-(k - 1), k)[None, :]
+    valid = (cols >= 0) & (cols < n)
+    cols = np.clip(cols, 0, n - 1)
+    dx = x[cols] - x[rows][:, None]
+    dist = np.where(valid, np.abs(dx), np.inf)
+    h = np.partition(dist, k - 1, axis=1)[:, k - 1]
+    u = dist / np.where(h > 0, h, 1.0)[:, None]
+    w = np.where(u < 1, (1 - u ** 3) ** 3, 0.0) * rw[cols]
+    yy = y[cols]
+    s0, s1, s2 = w.sum(1), (w * dx).sum(1), (w * dx * dx).sum(1)
+    t0, t1 = (w * yy).sum(1), (w * dx * yy).sum(1)
+    den = s0 * s2 - s1 * s1
+    flat = np.abs(den) <= 1e-12 * np.maximum(s0 * s2, 1e-300)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(flat, t0 / s0, (s2 * t0 - s1 * t1) / np.where(flat, 1.0, den))
+
+
+def _robust_weights(residuals: np.ndarray) -> np.ndarray:
+    s = np.median(np.abs(residuals))
+    if s == 0:
+        return np.ones_like(residuals)
+    u = np.clip(residuals / (6 * s), -1, 1)
+    return (1 - u ** 2) ** 2
+
+
+def lowess(x: np.ndarray, y: np.ndarray, k: int = K, iterations: int = ITERATIONS,
+           cached: List[np.ndarray] | None = None) -> List[np.ndarray]:
+    """Ajustes de cada iteración (el último es la serie suavizada).
+
+    Con ``cached`` (ajustes de un prefijo de la serie) solo se recalculan las
+    filas cuya vecindad incluye algún punto nuevo.
+    """
+    n = len(x)
+    start = 0
+    if cached is not None and len(cached) == iterations + 1:
+        start = max(0, len(cached[0]) - k + 1)
+    rows = np.arange(start, n)
+    rw = np.ones(n)
+    fits: List[np.ndarray] = []
+    for it in range(iterations + 1):
+        fit = np.empty(n)
+        fit[:start] = cached[it][:start] if start else fit[:0]
+        fit[start:] = _local_fits(x, y, rw, rows, k)
+        fits.append(fit)
+        if it < iterations:
+            rw = _robust_weights(y - fit)
+    return fits
+
+
+# ========= Columnas en memoria =========
+Series = Dict[str, Tuple[List[int], List[str]]]  # país -> (años, valores sin suavizar tal cual)
+
+
+def load_series(long_path: Path = LONG, wide_path: Path = WIDE) -> Series:
+    """Valores No_Smoothing por país; el fichero largo manda (puede tener varios países)."""
+    out: Dict[str, Dict[int, str]] = {}
+    if long_path.exists():
+        with long_path.open(encoding="utf-8", newline="") as f:
+            for r in csv.DictReader(f):
+                if r["category"] == RAW:
+                    out.setdefault(r["country"], {})[int(r["year"])] = r["val"]
+    elif wide_path.exists():
+        with wide_path.open(encoding="utf-8", newline="") as f:
+            out[WIDE_COUNTRY] = {int(r["Year"]): r[RAW] for r in csv.DictReader(f)}
+    return {c: (sorted(v), [v[y] for y in sorted(v)]) for c, v in out.items()}
+
+
+def _fmt(v: float) -> str:
+    return str(round(float(v), 2))
+
+
+def _cache_path(country: str) -> Path:
+    return CACHE_DIR / f"{country}.json"
+
+
+def _load_cache(country: str, years: List[int], raw: List[str]) -> List[np.ndarray] | None:
+    """Ajustes en caché si se calcularon sobre un prefijo idéntico de la serie."""
+    try:
+        c = json.loads(_cache_path(country).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+    m = len(c.get("years", []))
+    if c.get("k") != K or c.get("iterations") != ITERATIONS or m > len(years):
+        return None
+    if c["years"] != years[:m] or c["raw"] != raw[:m]:
+        return None
+    return [np.asarray(f, dtype=float) for f in c["fits"]]
+
+
+def _save_cache(country: str, years: List[int], raw: List[str], fits: List[np.ndarray]) -> None:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    data = {"k": K, "iterations": ITERATIONS, "years": years, "raw": raw, "fits": [f.tolist() for f in fits]}
+    tmp = _cache_path(country).with_suffix(".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, _cache_path(country))
+
+
+def smooth_all(series: Series, incremental: bool = True) -> Dict[str, List[str]]:
+    """Lowess(5) formateado por país."""
+    out: Dict[str, List[str]] = {}
+    for country, (years, raw) in series.items():
+        x = np.asarray(years, dtype=float)
+        y = np.asarray([float(v) for v in raw])
+        cached = _load_cache(country, years, raw) if incremental else None
+        fits = lowess(x, y, cached=cached)
+        _save_cache(country, years, raw, fits)
+        out[country] = [_fmt(v) for v in fits[-1]]
+        refit = len(years) - (max(0, len(cached[0]) - K + 1) if cached is not None else 0)
+        print(f"🌡️  {country}: {len(years)} años, {refit} reajustados.")
+    return out
+
+
+def _layout(path: Path) -> Tuple[str, int]:
+    """Fin de línea y líneas en blanco finales del fichero actual (el largo va en CRLF)."""
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return "\n", 0
+    eol = "\r\n" if b"\r\n" in data[:4096] else "\n"
+    body = data.rstrip(b"\r\n")
+    return eol, max(0, data[len(body):].count(b"\n") - 1)
+
+
+def _write(path: Path, header: List[str], rows: List[List[str]]) -> None:
+    eol, blank = _layout(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, lineterminator=eol)
+        w.writerow(header)
+        w.writerows(rows)
+        f.write(eol * blank)
+    os.replace(tmp, path)
+
+
+def write_outputs(series: Series, smooth: Dict[str, List[str]], wide_path: Path = WIDE,
+                  long_path: Path = LONG) -> None:
+    long_rows: List[List[str]] = []
+    for country, (years, raw) in series.items():
+        for year, r, s in zip(years, raw, smooth[country]):
+            long_rows.append([str(year), RAW, country, r])
+            long_rows.append([str(year), SMOOTH, country, s])
+    _write(long_path, ["year", "category", "country", "val"], long_rows)
+    if WIDE_COUNTRY in series:
+        years, raw = series[WIDE_COUNTRY]
+        _write(wide_path, ["Year", RAW, SMOOTH],
+               [[str(y), r, s] for y, r, s in zip(years, raw, smooth[WIDE_COUNTRY])])
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Suavizado LOWESS de las anomalías de temperatura")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("regenerate", help="Reajusta todas las series desde No_Smoothing")
+    p = sub.add_parser("append", help="Añade (o corrige) un año y reajusta solo la cola")
+    p.add_argument("year", type=int)
+    p.add_argument("value", help="Anomalía sin suavizar, tal cual se escribirá (p.ej. 1.28)")
+    p.add_argument("--country", default=WIDE_COUNTRY)
+    args = ap.parse_args(argv)
+    if np is None:
+        print("❌ temperaturas_lowess.py necesita NumPy: pip install numpy", file=sys.stderr)
+        return 1
+
+    series = load_series()
+    if args.cmd == "append":
+        float(args.value)  # valida el número
+        years, raw = series.get(args.country, ([], []))
+        merged = dict(zip(years, raw))
+        merged[args.year] = args.value
+        series[args.country] = (sorted(merged), [merged[y] for y in sorted(merged)])
+    write_outputs(series, smooth_all(series, incremental=args.cmd == "append"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())